@@ -0,0 +1,6 @@
+"""Benchmarks for airspeed velocity (asv)
+
+All benchmarks use simulated data and run without the MNE sample data. Each
+benchmark class provides ``time_*`` methods for the execution time and
+``peakmem_*`` methods for the peak memory of the same operation.
+"""
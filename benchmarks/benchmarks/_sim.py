@@ -0,0 +1,108 @@
+"""Simulated data for benchmarks"""
+import os
+import tempfile
+
+import mne
+import numpy as np
+from scipy.spatial import ConvexHull
+
+from eelbrain import configure, datasets, Case, NDVar, SourceSpace, UTS
+
+
+def setup_eelbrain():
+    "Single process, no progress bars, quiet MNE"
+    configure(n_workers=False, tqdm=False)
+    mne.set_log_level('warning')
+
+
+def sphere_points(n):
+    "Approximately evenly spaced points on the unit sphere (Fibonacci lattice)"
+    i = np.arange(n) + 0.5
+    phi = np.arccos(1 - 2 * i / n)
+    theta = np.pi * (1 + 5 ** 0.5) * i
+    return np.column_stack((np.cos(theta) * np.sin(phi),
+                            np.sin(theta) * np.sin(phi),
+                            np.cos(phi)))
+
+
+def source_space(n_vertices=642):
+    """Simulated ico source space with two spherical hemispheres
+
+    Parameters
+    ----------
+    n_vertices : int
+        Number of vertices per hemisphere (default corresponds to ``ico-3``).
+    """
+    tris = ConvexHull(sphere_points(n_vertices)).simplices
+    edges = np.vstack((tris[:, [0, 1]], tris[:, [1, 2]], tris[:, [0, 2]]))
+    edges.sort(1)
+    edges = np.unique(edges, axis=0)
+    edges = np.vstack((edges, edges + n_vertices))
+    vertices = [np.arange(n_vertices), np.arange(n_vertices)]
+    # indexing requires subjects_dir, but no files are read from it
+    subjects_dir = tempfile.gettempdir()
+    return SourceSpace(vertices, 'sim', 'ico-3', subjects_dir, None, edges)
+
+
+def get_dataset(space):
+    """Dataset from :func:`datasets.get_uts` with a ``'y'`` NDVar
+
+    Parameters
+    ----------
+    space : 'uts' | 'sensor' | 'source'
+        Dimensions of ``'y'``: time only, 5 sensors by 100 time points, or
+        1284 sources by 50 time points.
+    """
+    ds = datasets.get_uts(utsnd=True)
+    if space == 'uts':
+        ds['y'] = ds['uts']
+    elif space == 'sensor':
+        ds['y'] = ds['utsnd']
+    elif space == 'source':
+        source = source_space()
+        time = UTS(0, 0.01, 50)
+        x = np.random.normal(0, 1, (ds.n_cases, len(source), len(time)))
+        x += ds['Y'].x[:, None, None]
+        x[:30, :100, 10:40] += np.hanning(30)
+        ds['y'] = NDVar(x, (Case, source, time))
+    else:
+        raise ValueError("space=%r" % (space,))
+    return ds
+
+
+def write_raw(dst, n_channels=64, duration=600., sfreq=200.):
+    """Save a simulated EEG recording with events every second
+
+    Parameters
+    ----------
+    dst : str
+        Directory in which to save the file.
+    n_channels : int
+        Number of EEG channels.
+    duration : scalar
+        Duration of the recording in seconds.
+    sfreq : scalar
+        Sampling frequency.
+
+    Returns
+    -------
+    path : str
+        Path of the raw file.
+    """
+    rng = np.random.RandomState(0)
+    ch_names = ['EEG %03i' % i for i in range(n_channels)] + ['STI 014']
+    ch_types = ['eeg'] * n_channels + ['stim']
+    info = mne.create_info(ch_names, sfreq, ch_types)
+    locs = sphere_points(n_channels) * 0.09
+    for ch, loc in zip(info['chs'], locs):
+        ch['loc'][:3] = loc
+    n_times = int(round(duration * sfreq))
+    x = rng.normal(0, 1e-6, (n_channels + 1, n_times))
+    x[-1] = 0
+    step = int(sfreq)
+    for i in range(step, n_times - step, step):
+        x[-1, i: i + 5] = rng.randint(1, 5)
+    raw = mne.io.RawArray(x, info)
+    path = os.path.join(dst, 'sim-raw.fif')
+    raw.save(path)
+    return path
@@ -0,0 +1,54 @@
+"""Data-object operations"""
+import numpy as np
+
+from eelbrain import combine
+
+from ._sim import get_dataset, setup_eelbrain
+
+
+class Combine:
+    params = [10, 100]
+    param_names = ['n_items']
+
+    def setup(self, n_items):
+        setup_eelbrain()
+        ds = get_dataset('sensor')
+        del ds['y']
+        self.dss = [ds] * n_items
+        self.ndvars = [ds['utsnd']] * n_items
+
+    def time_combine_datasets(self, n_items):
+        combine(self.dss)
+
+    def peakmem_combine_datasets(self, n_items):
+        combine(self.dss)
+
+    def time_combine_ndvars(self, n_items):
+        combine(self.ndvars)
+
+
+class NDVarSub:
+
+    def setup(self):
+        setup_eelbrain()
+        ds = get_dataset('source')
+        self.y = ds['y']
+        self.index = np.arange(0, len(self.y.source), 3)
+
+    def time_sub_time_window(self):
+        self.y.sub(time=(0.1, 0.3))
+
+    def time_sub_time_point(self):
+        self.y.sub(time=0.2)
+
+    def time_sub_hemisphere(self):
+        self.y.sub(source='lh')
+
+    def time_sub_source_index(self):
+        self.y.sub(source=self.index)
+
+    def time_sub_cases(self):
+        self.y.sub(self.index[:20])
+
+    def peakmem_sub_time_window(self):
+        self.y.sub(time=(0.1, 0.3))
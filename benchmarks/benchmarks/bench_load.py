@@ -0,0 +1,46 @@
+"""Importing data from MNE-Python (load.fiff)"""
+import shutil
+import tempfile
+
+from eelbrain import load
+
+from ._sim import setup_eelbrain, write_raw
+
+
+class LoadFiff:
+    number = 1
+    repeat = 5
+    timeout = 120
+
+    def setup(self):
+        setup_eelbrain()
+        self.tempdir = tempfile.mkdtemp()
+        self.raw_path = write_raw(self.tempdir)
+        self.ds = load.fiff.events(self.raw_path)
+        self.epochs = load.fiff.mne_epochs(self.ds, -0.1, 0.5)
+        self.evoked = self.epochs.average()
+
+    def teardown(self):
+        self.ds.info['raw'].close()
+        shutil.rmtree(self.tempdir)
+
+    def time_events(self):
+        load.fiff.events(self.raw_path)
+
+    def time_epochs(self):
+        load.fiff.epochs(self.ds, -0.1, 0.5)
+
+    def peakmem_epochs(self):
+        load.fiff.epochs(self.ds, -0.1, 0.5)
+
+    def time_epochs_ndvar(self):
+        load.fiff.epochs_ndvar(self.epochs)
+
+    def time_evoked_ndvar(self):
+        load.fiff.evoked_ndvar(self.evoked)
+
+    def time_raw_ndvar(self):
+        load.fiff.raw_ndvar(self.raw_path)
+
+    def peakmem_raw_ndvar(self):
+        load.fiff.raw_ndvar(self.raw_path)
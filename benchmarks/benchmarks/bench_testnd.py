@@ -0,0 +1,78 @@
+"""Mass-univariate tests with raw, cluster-based and TFCE permutation tests"""
+from eelbrain import testnd
+
+from ._sim import get_dataset, setup_eelbrain
+
+
+# keyword arguments for the different kinds of permutation test
+KIND_ARGS = {
+    'raw': {'samples': 100},
+    'cluster': {'samples': 100, 'pmin': 0.05},
+    'tfce': {'samples': 20, 'tfce': True},
+}
+
+
+class TestND:
+    params = (['sensor', 'source'], ['raw', 'cluster', 'tfce'])
+    param_names = ['space', 'kind']
+    number = 1
+    repeat = 3
+    timeout = 300
+
+    def setup(self, space, kind):
+        setup_eelbrain()
+        self.ds = get_dataset(space)
+        self.kwargs = KIND_ARGS[kind]
+
+
+class TTest1Samp(TestND):
+
+    def run(self):
+        testnd.ttest_1samp('y', ds=self.ds, **self.kwargs)
+
+    def time_ttest_1samp(self, space, kind):
+        self.run()
+
+    def peakmem_ttest_1samp(self, space, kind):
+        self.run()
+
+
+class TTestRel(TestND):
+
+    def run(self):
+        testnd.ttest_rel('y', 'A%B', ('a1', 'b1'), ('a0', 'b0'), 'rm', ds=self.ds, **self.kwargs)
+
+    def time_ttest_rel(self, space, kind):
+        self.run()
+
+    def peakmem_ttest_rel(self, space, kind):
+        self.run()
+
+
+class ANOVA(TestND):
+    params = (['sensor', 'source'], ['raw', 'cluster', 'tfce'], ['A*B', 'A*B*rm'])
+    param_names = ['space', 'kind', 'model']
+
+    def setup(self, space, kind, model):
+        TestND.setup(self, space, kind)
+
+    def run(self, model):
+        testnd.anova('y', model, ds=self.ds, **self.kwargs)
+
+    def time_anova(self, space, kind, model):
+        self.run(model)
+
+    def peakmem_anova(self, space, kind, model):
+        self.run(model)
+
+
+class Corr(TestND):
+
+    def run(self):
+        testnd.corr('y', 'Y', ds=self.ds, **self.kwargs)
+
+    def time_corr(self, space, kind):
+        self.run()
+
+    def peakmem_corr(self, space, kind):
+        self.run()
@@ -0,0 +1,31 @@
+"""Temporal response functions"""
+import numpy as np
+
+from eelbrain import boosting, datasets, NDVar, Scalar
+
+from ._sim import setup_eelbrain
+
+
+class Boosting:
+    params = ([1, 10], ['l2', 'l1'])
+    param_names = ['n_y', 'error']
+    number = 1
+    repeat = 3
+    timeout = 300
+
+    def setup(self, n_y, error):
+        setup_eelbrain()
+        data = datasets._get_continuous(4000)
+        self.x = [data['x1'], data['x2']]
+        y = data['y']
+        if n_y == 1:
+            self.y = y
+        else:
+            noise = np.random.normal(0, 1, (n_y, len(y)))
+            self.y = NDVar(y.x + noise, (Scalar('signal', range(n_y)), y.time))
+
+    def time_boosting(self, n_y, error):
+        boosting(self.y, self.x, 0, 1, error=error)
+
+    def peakmem_boosting(self, n_y, error):
+        boosting(self.y, self.x, 0, 1, error=error)
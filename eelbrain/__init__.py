@@ -34,8 +34,9 @@ from ._ndvar import (
     set_tmin,
 )
 from ._stats.testnd import NDTest, MultiEffectNDTest
-from ._trf import boosting, BoostingResult
+from ._trf import boosting, boosting_batch, BoostingResult
 from ._utils import set_log_level
+from ._utils.parallel import shutdown
 from ._utils.com import check_for_update
 
 from . import datasets
@@ -3,11 +3,14 @@
 from multiprocessing import cpu_count
 import os
 
+import numpy as np
+
 from ._colorspaces import to_rgb
 
 
 CONFIG = {
     'n_workers': cpu_count(),
+    'persistent_pool': True,
     'eelbrain': True,
     'autorun': None,
     'show': True,
@@ -17,11 +20,18 @@ CONFIG = {
     'animate': True,
     'nice': 0,
     'tqdm': False,  # disable=CONFIG['tqdm']
+    'stat_dtype': np.dtype('float64'),
+    'adaptive_p': 0.05,
+    'adaptive_confidence': 0.999,
+    'adaptive_step': 100,
+    'boosting_backend': 'process',
+    'boosting_dtype': np.dtype('float64'),
 }
 
 
 def configure(
         n_workers=None,
+        persistent_pool=None,
         frame=None,
         autorun=None,
         show=None,
@@ -31,6 +41,12 @@ def configure(
         animate=None,
         nice=None,
         tqdm=None,
+        stat_dtype=None,
+        adaptive_p=None,
+        adaptive_confidence=None,
+        adaptive_step=None,
+        boosting_backend=None,
+        boosting_dtype=None,
 ):
     """Set basic configuration parameters for the current session
 
@@ -41,6 +57,11 @@ def configure(
         computations. ``False`` to disable multiprocessing. ``True`` (default)
         to use as many processes as cores are available. Negative numbers to use
         all but n available CPUs.
+    persistent_pool : bool
+        Keep the worker processes running between multiprocessing enabled
+        computations (default ``True``). Worker processes are started when
+        they are first needed, and are shared by all permutation tests and
+        :func:`boosting`. Use :func:`shutdown` to stop them explicitly.
     frame : bool
         Open figures in the Eelbrain application. This provides additional
         functionality such as copying a figure to the clipboard. If False, open
@@ -74,6 +95,35 @@ def configure(
         other processes; negative numbers require root privileges).
     tqdm : bool
         Enable or disable :mod:`tqdm` progress bars.
+    stat_dtype : 'float64' | 'float32'
+        Data type for computing permutation distributions in :mod:`testnd`
+        tests (default ``'float64'``). With ``'float32'``, the permuted data
+        and the statistical maps computed from them use single precision,
+        which halves the memory of the copy of the data shared with worker
+        processes and of the permutation buffers, and is faster for large
+        datasets. The input data are not converted, so the total memory use
+        does not halve. Statistics for the actual data are always computed in
+        double precision.
+    adaptive_p : scalar (0 < adaptive_p < 1)
+        Adaptive permutation tests (``samples='adaptive'``) stop when all
+        p-values are decided with respect to this threshold (default 0.05).
+    adaptive_confidence : scalar (0 < adaptive_confidence < 1)
+        A p-value is decided when its confidence interval at this confidence
+        level excludes ``adaptive_p`` (default 0.999).
+    adaptive_step : int
+        Evaluate the stopping rule of adaptive tests every ``adaptive_step``
+        permutations (default 100).
+    boosting_backend : 'process' | 'thread'
+        How :func:`boosting` uses ``n_workers``: ``'process'`` (default) to
+        run cross-validation segments in the worker processes, which receive
+        copies of the data in shared memory; ``'thread'`` to run them in
+        threads of the current process, which share the data without copying.
+        Threads avoid the overhead of copying ``y`` and ``x``, but only the
+        parts of boosting that release the GIL run in parallel.
+    boosting_dtype : 'float64' | 'float32'
+        Data type for storing ``y`` and ``x`` in :func:`boosting` (default
+        ``'float64'``). With ``'float32'``, the (scaled) data take half the
+        memory; errors and kernels are still computed in double precision.
     """
     # don't change values before raising an error
     new = {}
@@ -92,6 +142,8 @@ def configure(
                 new['n_workers'] = n_workers
         else:
             raise TypeError("n_workers=%r" % (n_workers,))
+    if persistent_pool is not None:
+        new['persistent_pool'] = bool(persistent_pool)
     if frame is not None:
         new['eelbrain'] = bool(frame)
     if autorun is not None:
@@ -119,5 +171,31 @@ def configure(
         new['nice'] = nice
     if tqdm is not None:
         new['tqdm'] = not tqdm
+    if stat_dtype is not None:
+        stat_dtype = np.dtype(stat_dtype)
+        if stat_dtype not in (np.float64, np.float32):
+            raise ValueError("stat_dtype=%r; needs to be 'float64' or 'float32'" % (stat_dtype.name,))
+        new['stat_dtype'] = stat_dtype
+    if adaptive_p is not None:
+        if not 0 < adaptive_p < 1:
+            raise ValueError("adaptive_p=%r; needs to be between 0 and 1" % (adaptive_p,))
+        new['adaptive_p'] = float(adaptive_p)
+    if adaptive_confidence is not None:
+        if not 0 < adaptive_confidence < 1:
+            raise ValueError("adaptive_confidence=%r; needs to be between 0 and 1" % (adaptive_confidence,))
+        new['adaptive_confidence'] = float(adaptive_confidence)
+    if adaptive_step is not None:
+        if int(adaptive_step) != adaptive_step or adaptive_step < 1:
+            raise ValueError("adaptive_step=%r; needs to be a positive integer" % (adaptive_step,))
+        new['adaptive_step'] = int(adaptive_step)
+    if boosting_backend is not None:
+        if boosting_backend not in ('process', 'thread'):
+            raise ValueError("boosting_backend=%r; needs to be 'process' or 'thread'" % (boosting_backend,))
+        new['boosting_backend'] = boosting_backend
+    if boosting_dtype is not None:
+        boosting_dtype = np.dtype(boosting_dtype)
+        if boosting_dtype not in (np.float64, np.float32):
+            raise ValueError("boosting_dtype=%r; needs to be 'float64' or 'float32'" % (boosting_dtype.name,))
+        new['boosting_dtype'] = boosting_dtype
 
     CONFIG.update(new)
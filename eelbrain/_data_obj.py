@@ -48,6 +48,7 @@ import operator
 import os
 import re
 import string
+import tempfile
 
 from matplotlib.ticker import (
     FixedLocator, FormatStrFormatter, FuncFormatter, IndexFormatter)
@@ -68,6 +69,7 @@ from ._exceptions import DimensionMismatchError, IncompleteModel
 from ._data_opt import gaussian_smoother
 from ._utils import (
     intervals, ui, LazyProperty, n_decimals, natsorted)
+from ._utils.memmap import is_memmap, reduce_cases, take_cases
 from ._utils.numpy_utils import (
     INT_TYPES, FULL_SLICE, FULL_AXIS_SLICE,
     apply_numpy_index, digitize_index, digitize_slice_endpoint,
@@ -948,7 +950,8 @@ def shuffled_index(n, cells=None):
     return out
 
 
-def combine(items, name=None, check_dims=True, incomplete='raise'):
+def combine(items, name=None, check_dims=True, incomplete='raise',
+            memmap=None):
     """Combine a list of items of the same type into one item.
 
     Parameters
@@ -970,16 +973,31 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
         KeyError to be raised. With ``"drop"``, partially missing variables are
         dropped. With ``"fill in"``, they are retained and missing values are
         filled in with empty values (``""`` for factors, ``NaN`` for variables).
+    memmap : str
+        Store the data of combined NDVars (or of the NDVars with case
+        dimension in combined Datasets) in memory-mapped files in this
+        directory, for data that do not fit into memory. ``items`` is then
+        consumed one item at a time, so it can be a generator that loads one
+        item at a time. All items need to contain the elements of the first
+        item's dimensions. The files are not deleted automatically.
 
     Notes
     -----
     The info dict inherits only entries that are equal (``x is y or
     np.array_equal(x, y)``) for all items.
+
+    Memory-mapped NDVars can be indexed along the case dimension, averaged
+    over cases (:meth:`NDVar.mean`, :meth:`NDVar.aggregate`) and used in
+    :mod:`testnd` tests that average cases with ``match``, and these
+    operations read the data in chunks. Most other operations load the data
+    into memory.
     """
     if not isinstance(incomplete, str):
         raise TypeError("incomplete=%s, need str" % repr(incomplete))
     elif incomplete not in ('raise', 'drop', 'fill in'):
         raise ValueError("incomplete=%s" % repr(incomplete))
+    elif memmap is not None:
+        return _combine_memmap(items, name, check_dims, incomplete, memmap)
 
     # check input
     if isinstance(items, Iterator):
@@ -1089,6 +1107,106 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
         raise RuntimeError("combine with stype = %r" % stype)
 
 
+def _combine_memmap(items, name, check_dims, incomplete, dirname):
+    "combine() into memory-mapped NDVars, consuming ``items`` one by one"
+    items = iter(items)
+    try:
+        first_item = next(items)
+    except StopIteration:
+        raise ValueError("combine() called with empty sequence")
+    stype = type(first_item)
+    if stype is NDVar:
+        writer = _MemmapWriter(first_item, dirname, check_dims)
+        for item in items:
+            if type(item) is not stype:
+                raise TypeError("All items to be combined need to have the "
+                                "same type, got %s and %s" % (stype, type(item)))
+            writer.append(item)
+        return writer.ndvar(name)
+    elif stype is not Dataset:
+        raise TypeError("combine() with memmap: need NDVars or Datasets, got "
+                        "%s" % (stype,))
+    elif incomplete != 'raise':
+        raise NotImplementedError("incomplete=%r with memmap" % (incomplete,))
+
+    keys = list(first_item)
+    writers = {}
+    columns = {}
+    for key, value in first_item.items():
+        if isinstance(value, NDVar) and value.has_case:
+            writers[key] = _MemmapWriter(value, dirname, check_dims)
+        else:
+            columns[key] = [value]
+    out = Dataset(name=first_item.name, info=first_item.info)
+    names = [first_item.name]
+    for ds in items:
+        if type(ds) is not Dataset:
+            raise TypeError("All items to be combined need to have the same "
+                            "type, got %s and %s" % (stype, type(ds)))
+        elif set(ds) != set(keys):
+            raise KeyError("Datasets have unequal keys. Combining Datasets "
+                           "with memmap requires incomplete='raise'.")
+        for key, writer in writers.items():
+            writer.append(ds[key])
+        for key, values in columns.items():
+            values.append(ds[key])
+        out.info = _info.merge_info((out, ds))
+        names.append(ds.name)
+    if name is None:
+        name = os.path.commonprefix(tuple(filter(None, names))) or None
+    out.name = name
+    for key in keys:
+        if key in writers:
+            out[key] = writers[key].ndvar()
+        else:
+            out[key] = combine(columns[key], check_dims=check_dims)
+    return out
+
+
+class _MemmapWriter(object):
+    "Append NDVars along the case dimension to a memory-mapped file"
+    def __init__(self, ndvar, dirname, check_dims):
+        self.has_case = ndvar.has_case
+        self.dims = ndvar.dims[ndvar.has_case:]
+        self.dtype = ndvar.x.dtype
+        self.info = ndvar.info
+        self.names = []
+        self.n_cases = 0
+        self._check_dims = check_dims
+        fd, self.path = tempfile.mkstemp('.dat', 'eelbrain-', dirname)
+        self._file = os.fdopen(fd, 'wb')
+        self.append(ndvar)
+
+    def append(self, ndvar):
+        if ndvar.has_case != self.has_case:
+            raise DimensionMismatchError("Some items have a 'case' dimension, "
+                                         "others do not")
+        dims = ndvar.dims[ndvar.has_case:]
+        if dims != self.dims:
+            if intersect_dims(self.dims, dims, self._check_dims) != self.dims:
+                raise DimensionMismatchError(
+                    "%r does not contain all elements of the first item (%s); "
+                    "with memmap, the first item determines the dimensions"
+                    % (ndvar, ', '.join(map(repr, self.dims))))
+            ndvar = ndvar.sub(**{dim.name: dim for dim in self.dims})
+        if np.result_type(ndvar.x.dtype, self.dtype) != self.dtype:
+            raise TypeError("%r: data type %s can not be stored as %s of the "
+                            "first item" % (ndvar, ndvar.x.dtype, self.dtype))
+        x = ndvar.x if self.has_case else ndvar.x[newaxis]
+        np.ascontiguousarray(x, self.dtype).tofile(self._file)
+        self.n_cases += len(x)
+        self.info = _info.merge_info((self, ndvar))
+        self.names.append(ndvar.name)
+
+    def ndvar(self, name=None):
+        self._file.close()
+        shape = (self.n_cases,) + tuple(map(len, self.dims))
+        x = np.memmap(self.path, self.dtype, 'r+', shape=shape)
+        if name is None:
+            name = os.path.commonprefix(tuple(filter(None, self.names))) or None
+        return NDVar(x, (Case(self.n_cases),) + self.dims, self.info, name)
+
+
 def find_factors(obj):
     "Return the list of all factors contained in obj"
     if isinstance(obj, EffectList):
@@ -3352,12 +3470,16 @@ class NDVar(object):
             err = "Length mismatch: %i (Var) != %i (x)" % (len(self), len(x))
             raise ValueError(err)
 
+        memmap = is_memmap(self.x)
         x_out = []
         for cell in x.cells:
             idx = (x == cell)
             if np.sum(idx):
-                x_cell = self.x[idx]
-                x_out.append(func(x_cell, axis=0))
+                # memory-mapped data are read in chunks
+                x_cell = reduce_cases(self.x, func, idx) if memmap else None
+                if x_cell is None:
+                    x_cell = func(self.x[idx], axis=0)
+                x_out.append(x_cell)
 
         # update info for summary
         info = self.info.copy()
@@ -3383,7 +3505,8 @@ class NDVar(object):
                     axis = list(axis) + additional_axis
             return data._aggregate_over_dims(axis, {'name': name}, func)
         elif not axis:
-            return func(self.x)
+            x = self._reduce_memmap_cases(func)
+            return func(self.x if x is None else x)
         elif isinstance(axis, NDVar):
             if axis.ndim == 1:
                 dim = axis.dims[0]
@@ -3417,15 +3540,26 @@ class NDVar(object):
                     return func(self_x[index])
         elif isinstance(axis, str):
             axis = self._dim_2_ax[axis]
-            x = func(self.x, axis=axis)
+            x = self._reduce_memmap_cases(func) if axis == 0 else None
+            if x is None:
+                x = func(self.x, axis=axis)
             dims = tuple(self.dims[i] for i in range(self.ndim) if i != axis)
         else:
             axes = tuple(self._dim_2_ax[dim_name] for dim_name in axis)
-            x = func(self.x, axes)
+            x = self._reduce_memmap_cases(func) if 0 in axes else None
+            if x is None:
+                x = func(self.x, axes)
+            elif len(axes) > 1:
+                x = func(x, tuple(i - 1 for i in axes if i))
             dims = tuple(self.dims[i] for i in range(self.ndim) if i not in axes)
 
         return self._package_aggregated_output(x, dims, _info.for_data(x, self.info), name)
 
+    def _reduce_memmap_cases(self, func):
+        "``func`` over cases of memory-mapped data (None if not applicable)"
+        if self.has_case and is_memmap(self.x):
+            return reduce_cases(self.x, func)
+
     def astype(self, dtype):
         """Copy of the NDVar with data cast to the specified type
 
@@ -4593,7 +4727,13 @@ class NDVar(object):
                     ndim_increment += 1
 
         # create NDVar
-        x = self.x[tuple(index)]
+        if (self.has_case and is_memmap(self.x) and
+                isinstance(index[0], np.ndarray) and
+                not any(isinstance(idx, np.ndarray) for idx in index[1:])):
+            # select cases without loading all of the data
+            x = take_cases(self.x[(FULL_SLICE, *index[1:])], index[0])
+        else:
+            x = self.x[tuple(index)]
         if add_axis:
             x = np.expand_dims(x, 0)
         dims = tuple(dim for dim in dims if dim is not None)
@@ -0,0 +1,159 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Content-based modification times for cache validation
+
+:class:`MneExperiment` decides whether a cached file is up to date by
+comparing its modification time with the modification times of its inputs
+(parameter changes are handled separately through the cache-state file).
+Plain mtimes change whenever a file is copied or touched, which would make the
+whole cache outdated after moving a project to a different computer.
+
+:class:`FileStamps` instead keeps track of the time at which the *content* of
+each file last changed. For each file it stores the mtime and size at which it
+was last seen, a hash of its content, and the content mtime. When the mtime or
+size of a file changes, its content is hashed again, and only if the content
+differs the file counts as modified. Stamps are stored with paths relative to
+the experiment root, so that they remain valid when the experiment folder is
+moved.
+
+Several processes can use the same stamps file (e.g., worker processes, or
+multiple sessions working on the same experiment): each process only writes
+the stamps it changed, merging them into the current file under a lock.
+"""
+from contextlib import contextmanager
+import hashlib
+import os
+from os.path import dirname, exists, relpath
+import pickle
+
+from .._utils.system import file_lock
+
+
+def file_hash(path, block_size=2 ** 24):
+    "Hash of the content of a file"
+    key = hashlib.sha1()
+    with open(path, 'rb') as fid:
+        for block in iter(lambda: fid.read(block_size), b''):
+            key.update(block)
+    return key.hexdigest()
+
+
+class FileStamps(object):
+    """Content modification times of files in an experiment
+
+    Parameters
+    ----------
+    root : str
+        Experiment root; paths are stored relative to ``root``.
+    path : str
+        File in which the stamps are stored.
+
+    Notes
+    -----
+    Changes are saved immediately, except inside a :meth:`batch` block, which
+    saves all changes at the end.
+    """
+    def __init__(self, root, path):
+        self.root = root
+        self.path = path
+        self._stamps = self._load()  # {relpath: (mtime, size, hash, content_mtime)}
+        self._changes = {}  # {relpath: stamp | None}, not yet saved
+        self._batch_level = 0
+
+    def __repr__(self):
+        return f"<FileStamps: {len(self._stamps)} files>"
+
+    @contextmanager
+    def batch(self):
+        "Context in which changes are saved only once, at the end"
+        self._batch_level += 1
+        try:
+            yield
+        finally:
+            self._batch_level -= 1
+            if self._batch_level == 0:
+                self.save()
+
+    def mtime(self, path):
+        """Time at which the content of ``path`` last changed
+
+        Returns ``None`` if the file does not exist.
+        """
+        key = relpath(path, self.root)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if key in self._stamps:
+                self._set(key, None)
+            return
+        stamp = self._stamps.get(key)
+        if stamp is not None:
+            mtime, size, content_hash, content_mtime = stamp
+            if stat.st_mtime == mtime and stat.st_size == size:
+                return content_mtime
+            elif stat.st_size == size:
+                new_hash = file_hash(path)
+                if new_hash == content_hash:
+                    self._set(key, (stat.st_mtime, size, content_hash, content_mtime))
+                    return content_mtime
+            else:
+                new_hash = file_hash(path)
+        else:
+            new_hash = file_hash(path)
+        self._set(key, (stat.st_mtime, stat.st_size, new_hash, stat.st_mtime))
+        return stat.st_mtime
+
+    def hash(self, path):
+        "Hash of the content of ``path`` (the file needs to exist)"
+        self.mtime(path)
+        return self._stamps[relpath(path, self.root)][2]
+
+    def update(self, path):
+        """Register a new version of ``path``
+
+        Needs to be called after writing a cache file. Otherwise, if the file
+        is written with the same content as before, it would retain its old
+        content mtime and remain outdated relative to its inputs.
+        """
+        stat = os.stat(path)
+        self._set(relpath(path, self.root), (
+            stat.st_mtime, stat.st_size, file_hash(path), stat.st_mtime))
+
+    def _set(self, key, stamp):
+        if stamp is None:
+            del self._stamps[key]
+        else:
+            self._stamps[key] = stamp
+        self._changes[key] = stamp
+        if not self._batch_level:
+            self.save()
+
+    def _load(self):
+        if exists(self.path):
+            with open(self.path, 'rb') as fid:
+                return pickle.load(fid)
+        return {}
+
+    def save(self):
+        """Save changed stamps
+
+        Changes are merged into the current file, so that stamps saved by
+        other processes in the meantime are retained; the file is replaced
+        (not overwritten) so that other processes never read a partially
+        written file.
+        """
+        if not self._changes:
+            return
+        os.makedirs(dirname(self.path), exist_ok=True)
+        with file_lock(f'{self.path}.lock'):
+            stamps = self._load()
+            for key, stamp in self._changes.items():
+                if stamp is None:
+                    stamps.pop(key, None)
+                else:
+                    stamps[key] = stamp
+            tmp_path = f'{self.path}.{os.getpid()}'
+            with open(tmp_path, 'wb') as fid:
+                pickle.dump(stamps, fid, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        self._stamps = stamps
+        self._changes.clear()
@@ -10,6 +10,7 @@ e = MneExperiment('.', find_subjects=False)
 
 """
 from collections import Counter, defaultdict, Sequence
+from copy import deepcopy
 from datetime import datetime
 from glob import glob
 import inspect
@@ -17,9 +18,11 @@ from itertools import chain, product
 import logging
 import os
 from os.path import basename, exists, getmtime, isdir, join, relpath
+import pickle
 import re
 import shutil
 import time
+import traceback
 import warnings
 
 import numpy as np
@@ -59,10 +62,12 @@ from ..fmtxt import List, Report, Image, read_meta
 from .._report import named_list, enumeration, plural
 from .._resources import predefined_connectivity
 from .._stats.stats import ttest_t
-from .._stats.testnd import _MergedTemporalClusterDist
+from .._stats.testnd import _MergedTemporalClusterDist, save_checkpoint
 from .._utils import WrappedFormater, ask, subp, keydefaultdict, log_level
 from .._utils.mne_utils import fix_annot_names, is_fake_mri
 from .._utils.numpy_utils import INT_TYPES
+from .._utils.parallel import WorkerPool, get_pool, parallel_map
+from .._utils.system import file_lock
 from .definitions import (
     assert_dict_has_args, find_dependent_epochs,
     find_epochs_vars, find_test_vars, log_dict_change, log_list_change)
@@ -71,6 +76,7 @@ from .epochs import (
 )
 from .exceptions import FileDeficient, FileMissing
 from .experiment import FileTree
+from .file_stamps import FileStamps
 from .parc import (
     FS_PARC, FSA_PARC, PARC_CLASSES, SEEDED_PARC_RE,
     Parcellation, CombinationParcellation, EelbrainParcellation,
@@ -78,8 +84,10 @@ from .parc import (
     IndividualSeededParcellation, LabelParcellation,
 )
 from .preprocessing import (
-    assemble_pipeline, RawICA, pipeline_dict, compare_pipelines,
+    assemble_pipeline, CachedRawPipe, RawICA, pipeline_dict, compare_pipelines,
     ask_to_delete_ica_files)
+from .scheduler import MakeNode, run_graph, serial_map
+from .stc_cache import load_stc, save_stc
 from .test_def import (
     Test, EvokedTest, TTestInd,
     ROITestResult, TestDims, TwoStageTest, assemble_tests,
@@ -205,6 +213,47 @@ class CacheDict(dict):
         return out
 
 
+class _ExperimentJob(object):
+    """Call experiment methods in a worker process
+
+    The job stores the arguments with which the experiment was initialized,
+    its definitions and its input-state. The first time the job is called in a
+    worker, the worker initializes its own instance of the experiment without
+    cache management; the instance is discarded with the job at the end of
+    the map call. For each call, the state of the experiment from which the
+    job was created is restored.
+
+    Returns ``(result, fwd_sessions)``, where ``fwd_sessions`` contains the
+    digitizer checks done in the worker, which are saved by the parent (see
+    :meth:`MneExperiment._worker_results`).
+    """
+    def __init__(self, experiment):
+        self.cls = experiment.__class__
+        self.args, self.kwargs = experiment._init_args
+        self.definitions = {k: getattr(experiment, k) for k in experiment._definition_attributes}
+        self.input_state = getattr(experiment, '_input_state', None)
+        self.experiment = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['experiment'] = None
+        return state
+
+    def __call__(self, state, method, args=(), kwargs={}):
+        if self.experiment is None:
+            experiment = self.cls.__new__(self.cls, *self.args, **self.kwargs)
+            experiment.__dict__.update(self.definitions)
+            experiment._is_worker = True
+            if self.input_state is not None:
+                experiment._input_state = self.input_state
+                experiment._fwd_sessions = self.input_state['fwd-sessions']
+            experiment.__init__(*self.args, **self.kwargs)
+            self.experiment = experiment
+        self.experiment._fwd_session_updates = {}
+        result = self.experiment._call_in_state(state, method, args, kwargs)
+        return result, self.experiment._fwd_session_updates
+
+
 def cache_valid(mtime, *source_mtimes):
     "Determine whether mtime is up-to-date"
     return (
@@ -245,6 +294,7 @@ temp = {
     'cache-dir': join('{root}', 'eelbrain-cache'),
     'input-state-file': join('{cache-dir}', 'input-state.pickle'),
     'cache-state-file': join('{cache-dir}', 'cache-state.pickle'),
+    'file-stamps-file': join('{cache-dir}', 'file-stamps.pickle'),
     # raw
     'raw-cache-dir': join('{cache-dir}', 'raw', '{subject}'),
     'raw-cache-base': join('{raw-cache-dir}', '{session} {raw}'),
@@ -273,6 +323,16 @@ temp = {
                         '{session} {sns_kind} {epoch} {model} {evoked_kind}'),
     'evoked-file': join('{evoked-base}-ave.fif'),
     'evoked-old-file': join('{evoked-base}.pickled'),  # removed for 0.25
+    # morphed source estimates
+    'stc-dir': join('{cache-dir}', 'stc'),
+    'epochs-stc-base': join('{stc-dir}', '{subject}',
+                            '{session} {epoch} {rej} {src_kind} {parc} {connectivity}'),
+    'epochs-stc-file': '{epochs-stc-base}-epochs.pickle',
+    'epochs-stc-data-file': '{epochs-stc-base}-epochs.npy',
+    'evoked-stc-base': join('{stc-dir}', '{subject}',
+                            '{session} {epoch} {model} {evoked_kind} {src_kind} {parc} {connectivity}'),
+    'evoked-stc-file': '{evoked-stc-base}-evoked.pickle',
+    'evoked-stc-data-file': '{evoked-stc-base}-evoked.npy',
     # test files
     'test-dir': join('{cache-dir}', 'test'),
     'test_dims': 'unmasked',  # for some tests, parc and mask parameter can be saved in same file
@@ -545,6 +605,24 @@ class MneExperiment(FileTree):
     _brain_plot_defaults = {'surf': 'inflated'}
     brain_plot_defaults = {}
 
+    # definitions that are passed on to worker processes (see _ExperimentJob)
+    _definition_attributes = (
+        'path_version', 'screen_log_level', 'auto_delete_results',
+        'auto_delete_cache', 'sessions', 'raw', 'trigger_shift', 'variables',
+        'epoch_default', 'epochs', 'artifact_rejection', 'exclude', 'groups',
+        'meg_system', 'parcs', 'freqs', 'defaults', 'tests',
+        'brain_plot_defaults')
+    # instance in a worker process
+    _is_worker = False
+    # digitizer checks done in a worker process, {subject: {session: fwd_session}}
+    _fwd_session_updates = None
+
+    def __new__(cls, *args, **kwargs):
+        self = FileTree.__new__(cls)
+        # arguments for initializing the experiment in worker processes
+        self._init_args = (args, kwargs)
+        return self
+
     def __init__(self, root=None, find_subjects=True, **state):
         # checks
         if hasattr(self, 'cluster_criteria'):
@@ -671,8 +749,13 @@ class MneExperiment(FileTree):
         ica_path = self._partial('raw-ica-file', skip)
         raw_dict = self._raw.copy()
         raw_dict.update(self.raw)
+        if root:
+            self._stamps = FileStamps(root, self._partial('file-stamps-file'))
+        else:
+            self._stamps = None
         self._raw = assemble_pipeline(raw_dict, raw_path, bads_path, cache_path,
-                                      ica_path, self._sessions, log)
+                                      ica_path, self._sessions, log,
+                                      self._stamps)
 
         ########################################################################
         # variables
@@ -875,6 +958,9 @@ class MneExperiment(FileTree):
         # currently only used for .rm()
         self._secondary_cache['cached-raw-file'] = (
             'event-file', 'interp-file', 'cached-raw-log-file')
+        self._secondary_cache['evoked-file'] = (
+            'evoked-stc-file', 'evoked-stc-data-file')
+        self._secondary_cache['epochs-stc-file'] = ('epochs-stc-data-file',)
 
         ########################################################################
         # logger
@@ -935,7 +1021,8 @@ class MneExperiment(FileTree):
         if self.exclude:
             raise ValueError("MneExperiment.exclude must be unspecified for "
                              "cache management to work")
-        elif not root:
+        elif not root or self._is_worker:
+            # in workers, the input-state is provided by the parent
             return
 
         # loading events will create cache-dir
@@ -944,11 +1031,9 @@ class MneExperiment(FileTree):
 
         # collect input file information
         # ==============================
-        raw_missing = []  # [(subject, session), ...]
-        subjects_with_raw_changes = set()  # {subject, ...}
         events = {}  # {(subject, session): event_dataset}
 
-        # saved mtimes
+        # saved input file state
         input_state_file = self.get('input-state-file', mkdir=True)
         if exists(input_state_file):
             input_state = load.unpickle(input_state_file)
@@ -966,92 +1051,62 @@ class MneExperiment(FileTree):
         if input_state is None:
             input_state = {
                 'version': CACHE_STATE_VERSION,
-                'raw-mtimes': {},
                 'fwd-sessions': {s: {} for s in subjects},
             }
-
-        # collect current events and mtime
-        raw_mtimes = input_state['raw-mtimes']
+        # Eelbrain < 0.29: only raw-file mtimes were stored
+        raw_mtimes = input_state.pop('raw-mtimes', {})
+        input_state_changed = 'raw-files' not in input_state
+        if input_state_changed:
+            input_state['raw-files'] = {k: (mtime, None, None) for k, mtime in raw_mtimes.items()}
+            input_state['raw-events'] = {}
+            input_state['dig-pending'] = set()
+
+        # collect current events and raw file state; events are read from
+        # the raw file only if the file changed since the last session. The
+        # content hash is checked when the mtime or size of a file changes,
+        # so that files that were only touched or copied are recognized.
+        raw_files = input_state['raw-files']  # {key: (mtime, size, hash)}
+        raw_events = input_state['raw-events']  # {key: unlabeled events}
         with self._temporary_state:
             for key in self.iter(('subject', 'session'), group='all', raw='raw'):
                 raw_file = self.get('raw-file')
                 if not exists(raw_file):
-                    raw_missing.append(key)
                     continue
-                # events
-                events[key] = self.load_events(add_bads=False, data_raw=False)
-                # mtime
-                mtime = getmtime(raw_file)
-                if key not in raw_mtimes or mtime != raw_mtimes[key]:
-                    subjects_with_raw_changes.add(key[0])
-                    raw_mtimes[key] = mtime
-
-        # check for digitizer data differences
-        # ====================================
-        #  - raw files with different head shapes require different head-mri
-        #    trans files, which is currently not implemented
-        #  - SuperEpochs currently need to have a single forward solution,
-        #    hence marker positions need to be the same between sub-epochs
-            if subjects_with_raw_changes:
-                log.info("Raw input files changed, checking digitizer data")
-                super_epochs = tuple(epoch for epoch in self._epochs.values() if
-                                     isinstance(epoch, SuperEpoch))
-            for subject in subjects_with_raw_changes:
-                self.set(subject)
-                # collect digitizer data
-                digs = {}  # {session: dig}
-                for session in self.iter('session'):
-                    if (subject, session) in raw_missing:
-                        continue
-                    raw = self.load_raw(False)
-                    digs[session] = raw.info['dig']
-                # find unique digitizer datasets
-                unique_digs = []
-                dig_ids = {}  # {session: id}
-                dig_missing = []
-                sessions = sorted(digs)
-                for session in sessions:
-                    dig = digs[session]
-                    if dig is None:
-                        dig_missing.append(session)
+                stat = os.stat(raw_file)
+                if key in raw_files:
+                    old_mtime, old_size, old_hash = raw_files[key]
+                    if key in raw_events and (stat.st_mtime, stat.st_size) == (old_mtime, old_size):
+                        events[key] = self._label_raw_events(deepcopy(raw_events[key]))
                         continue
-                    if unique_digs and not hsp_equal(dig, unique_digs[0]):
-                        raise NotImplementedError(
-                            f"Subject {subject} has different head shape data "
-                            f"for sessions {session} and {session_}. This "
-                            f"would require different trans-files for the "
-                            f"different sessions, which is not yet implemented "
-                            f"in the MneExperiment class.")
-                    for i, dig_i in enumerate(unique_digs):
-                        if mrk_equal(dig, dig_i):
-                            dig_ids[session] = i
-                            break
-                    else:
-                        dig_ids[session] = len(unique_digs)
-                        unique_digs.append(dig)
-                # checks for missing digitizer data
-                if len(unique_digs) > 1:
-                    if dig_missing:
-                        n = len(dig_missing)
-                        raise FileDeficient(f"The raw {plural('file', n)} for {subject}, {plural('session', n)} {enumeration(dig_missing)} {plural('is', n)} missing digitizer information")
-                    for epoch in super_epochs:
-                        if len(set(dig_ids[s] for s in epoch.sessions)) > 1:
-                            groups = defaultdict(list)
-                            for s in epoch.sessions:
-                                groups[dig_ids[s]].append(s)
-                            group_desc = ' vs '.join('/'.join(group) for group in groups.values())
-                            raise NotImplementedError(f"SuperEpoch {epoch.name} has sessions with incompatible marker positions ({group_desc}); SuperEpochs with different forward solutions are not implemented.")
-                # determine which to use for forward solution
-                fwd_sessions = input_state['fwd-sessions'][subject]
-                previous_masters = (s for _, s in fwd_sessions.items() if s in dig_ids)
-                masters = {dig_ids[s]: s for s in previous_masters}
-                for s in sessions:
-                    if dig_ids[s] not in masters:
-                        masters[dig_ids[s]] = s
-                    fwd_sessions[s] = masters[dig_ids[s]]
+                    content_hash = self._stamps.hash(raw_file)
+                    if old_size is None and stat.st_mtime == old_mtime:
+                        pass  # unchanged since Eelbrain < 0.29
+                    elif content_hash != old_hash:
+                        input_state['dig-pending'].add(key[0])
+                        raw_events.pop(key, None)
+                else:
+                    content_hash = self._stamps.hash(raw_file)
+                    input_state['dig-pending'].add(key[0])
+                raw_files[key] = (stat.st_mtime, stat.st_size, content_hash)
+                if key not in raw_events:
+                    raw_events[key], _ = self._load_raw_events(False)
+                input_state_changed = True
+                events[key] = self._label_raw_events(deepcopy(raw_events[key]))
+        for key in set(raw_events).difference(events):
+            del raw_events[key]
+            raw_files.pop(key, None)
+            input_state_changed = True
+
+        # digitizer data of subjects with changed raw files is checked when it
+        # is first needed (see ._fwd_session())
+        if input_state['dig-pending']:
+            log.debug("Raw input files changed for %s, digitizer data will be "
+                      "checked", enumeration(sorted(input_state['dig-pending'])))
 
         # save input-state
-        save.pickle(input_state, input_state_file)
+        self._input_state = input_state
+        if input_state_changed or not exists(input_state_file):
+            self._save_input_state()
         self._fwd_sessions = input_state['fwd-sessions']
 
         # Check the cache, delete invalid files
@@ -1313,6 +1368,7 @@ class MneExperiment(FileTree):
                         if session not in params.sessions:
                             continue
                         rm['evoked-file'].add({'subject': subject, 'epoch': epoch})
+                        rm['epochs-stc-file'].add({'subject': subject, 'epoch': epoch})
 
                 # variables
                 for var in invalid_cache['variables']:
@@ -1328,6 +1384,7 @@ class MneExperiment(FileTree):
                 for raw in invalid_cache['raw']:
                     rm['cached-raw-file'].add({'raw': raw})
                     rm['evoked-file'].add({'raw': raw})
+                    rm['epochs-stc-file'].add({'raw': raw})
                     analysis = {'analysis': '* %s *' % raw}
                     rm['test-file'].add(analysis)
                     rm['report-file'].add(analysis)
@@ -1337,6 +1394,7 @@ class MneExperiment(FileTree):
                 # epochs
                 for epoch in invalid_cache['epochs']:
                     rm['evoked-file'].add({'epoch': epoch})
+                    rm['epochs-stc-file'].add({'epoch': epoch})
                     for cov, cov_params in self._covs.items():
                         if cov_params.get('epoch') != epoch:
                             continue
@@ -1524,6 +1582,21 @@ class MneExperiment(FileTree):
     # intermediate file if it is not needed).
     # _file_mtime() functions directly return the file's mtime, or None if it
     # does not exists or is outdated
+    # All mtimes are content mtimes (see file_stamps.py), so that copying or
+    # touching files does not make the cache outdated
+    def _content_mtime(self, path):
+        "Time at which the content of a file changed, None if it does not exist"
+        if self._stamps is None:
+            if exists(path):
+                return getmtime(path)
+        else:
+            return self._stamps.mtime(path)
+
+    def _stamp(self, path):
+        "Register a newly written cache file"
+        if self._stamps is not None:
+            self._stamps.update(path)
+
     def _annot_file_mtime(self, make_for=None):
         """Return max mtime of annot files or None if they do not exist.
 
@@ -1537,10 +1610,10 @@ class MneExperiment(FileTree):
         mtime = 0
         for _ in self.iter('hemi'):
             fpath = self.get('annot-file')
-            if exists(fpath):
-                mtime = max(mtime, getmtime(fpath))
-            else:
+            fpath_mtime = self._content_mtime(fpath)
+            if fpath_mtime is None:
                 return
+            mtime = max(mtime, fpath_mtime)
         return mtime
 
     def _cov_mtime(self):
@@ -1554,10 +1627,9 @@ class MneExperiment(FileTree):
                 return self._raw_mtime()
 
     def _epochs_mtime(self):
-        bads_path = self.get('bads-file')
-        if exists(bads_path):
+        bads_mtime = self._content_mtime(self.get('bads-file'))
+        if bads_mtime:
             raw_mtime = self._raw_mtime()
-            bads_mtime = getmtime(bads_path)
             epoch = self._epochs[self.get('epoch')]
             rej_mtime = self._rej_mtime(epoch)
             if rej_mtime:
@@ -1582,21 +1654,43 @@ class MneExperiment(FileTree):
             if inv_mtime:
                 return max(evoked_mtime, inv_mtime)
 
+    def _stc_cache_mtime(self, sns_mtime):
+        """Mtime of inputs of a cached morphed source estimate, None if missing
+
+        Parameters
+        ----------
+        sns_mtime : float
+            Mtime of the sensor space data.
+        """
+        if not sns_mtime:
+            return
+        inv_mtime = self._inv_mtime()
+        if not inv_mtime:
+            return
+        # _inv_mtime() does not reflect changes in the cov definition
+        cov_mtime = self._content_mtime(self.get('cov-file'))
+        if not cov_mtime:
+            return
+        if self.get('parc'):
+            annot_mtime = self._annot_file_mtime(self.get('common_brain'))
+            if not annot_mtime:
+                return
+        else:
+            annot_mtime = 0
+        return max(sns_mtime, inv_mtime, cov_mtime, annot_mtime)
+
     def _fwd_mtime(self):
         "The last time at which input files affecting fwd-file changed"
-        trans = self.get('trans-file')
-        if exists(trans):
-            src = self.get('src-file')
-            if exists(src):
-                trans_mtime = getmtime(trans)
-                src_mtime = getmtime(src)
+        trans_mtime = self._content_mtime(self.get('trans-file'))
+        if trans_mtime:
+            src_mtime = self._content_mtime(self.get('src-file'))
+            if src_mtime:
                 return max(self._raw_mtime('raw', bad_chs=False), trans_mtime, src_mtime)
 
     def _ica_file_mtime(self, rej):
         "Mtime if the file exists, else None; do not check raw mtime"
-        ica_path = self.get('ica-file')
-        if exists(ica_path):
-            ica_mtime = getmtime(ica_path)
+        ica_mtime = self._content_mtime(self.get('ica-file'))
+        if ica_mtime:
             if rej['source'] == 'raw':
                 return ica_mtime
             else:
@@ -1612,6 +1706,116 @@ class MneExperiment(FileTree):
             if cov_mtime:
                 return max(cov_mtime, fwd_mtime)
 
+    def _fwd_session(self, subject, session):
+        "Session whose forward solution is used for ``session``"
+        if subject in self._input_state['dig-pending']:
+            self._check_digitizer(subject)
+        try:
+            return self._fwd_sessions[subject][session]
+        except KeyError:
+            raise FileMissing(f"Raw data missing for {subject}, session {session}")
+
+    def _check_digitizer(self, subject):
+        """Check digitizer data for a subject whose raw files changed
+
+        Determines which sessions can share a forward solution:
+
+         - raw files with different head shapes require different head-mri
+           trans files, which is currently not implemented
+         - SuperEpochs currently need to have a single forward solution,
+           hence marker positions need to be the same between sub-epochs
+        """
+        self._log.info("Raw input files changed for %s, checking digitizer data", subject)
+        super_epochs = tuple(epoch for epoch in self._epochs.values() if
+                             isinstance(epoch, SuperEpoch))
+        with self._temporary_state:
+            # collect digitizer data
+            digs = {}  # {session: dig}
+            for session in self.iter('session', subject=subject, raw='raw'):
+                if not exists(self.get('raw-file')):
+                    continue
+                raw = self.load_raw(False)
+                digs[session] = raw.info['dig']
+        # find unique digitizer datasets
+        unique_digs = []
+        dig_ids = {}  # {session: id}
+        dig_missing = []
+        sessions = sorted(digs)
+        for session in sessions:
+            dig = digs[session]
+            if dig is None:
+                dig_missing.append(session)
+                continue
+            if unique_digs and not hsp_equal(dig, unique_digs[0]):
+                session_ = next(s for s, i in dig_ids.items() if i == 0)
+                raise NotImplementedError(
+                    f"Subject {subject} has different head shape data "
+                    f"for sessions {session} and {session_}. This "
+                    f"would require different trans-files for the "
+                    f"different sessions, which is not yet implemented "
+                    f"in the MneExperiment class.")
+            for i, dig_i in enumerate(unique_digs):
+                if mrk_equal(dig, dig_i):
+                    dig_ids[session] = i
+                    break
+            else:
+                dig_ids[session] = len(unique_digs)
+                unique_digs.append(dig)
+        # checks for missing digitizer data
+        if len(unique_digs) > 1:
+            if dig_missing:
+                n = len(dig_missing)
+                raise FileDeficient(f"The raw {plural('file', n)} for {subject}, {plural('session', n)} {enumeration(dig_missing)} {plural('is', n)} missing digitizer information")
+            for epoch in super_epochs:
+                if len(set(dig_ids[s] for s in epoch.sessions)) > 1:
+                    groups = defaultdict(list)
+                    for s in epoch.sessions:
+                        groups[dig_ids[s]].append(s)
+                    group_desc = ' vs '.join('/'.join(group) for group in groups.values())
+                    raise NotImplementedError(f"SuperEpoch {epoch.name} has sessions with incompatible marker positions ({group_desc}); SuperEpochs with different forward solutions are not implemented.")
+        # determine which to use for forward solution
+        fwd_sessions = self._fwd_sessions.setdefault(subject, {})
+        previous_masters = (s for _, s in fwd_sessions.items() if s in dig_ids)
+        masters = {dig_ids[s]: s for s in previous_masters}
+        for s in sessions:
+            if dig_ids[s] not in masters:
+                masters[dig_ids[s]] = s
+            fwd_sessions[s] = masters[dig_ids[s]]
+        # save input-state
+        self._input_state['dig-pending'].discard(subject)
+        if self._is_worker:
+            self._fwd_session_updates[subject] = fwd_sessions
+        else:
+            self._save_input_state()
+
+    def _save_input_state(self):
+        """Save the input-state
+
+        Digitizer checks that other processes saved in the meantime are
+        retained for subjects whose raw files are unchanged; the file is
+        replaced (not overwritten), so that other processes never read a
+        partially written file.
+        """
+        path = self.get('input-state-file')
+        input_state = self._input_state
+        with file_lock(f'{path}.lock'):
+            if exists(path):
+                saved = load.unpickle(path)
+                saved_pending = saved.get('dig-pending', ())
+                saved_fwd_sessions = saved.get('fwd-sessions', {})
+                saved_raw_files = saved.get('raw-files', {})
+                for subject in input_state['dig-pending'].difference(saved_pending):
+                    if subject not in saved_fwd_sessions:
+                        continue
+                    keys = [key for key in input_state['raw-files'] if key[0] == subject]
+                    if all(saved_raw_files.get(key) == input_state['raw-files'][key] for key in keys):
+                        self._fwd_sessions[subject] = saved_fwd_sessions[subject]
+                        input_state['dig-pending'].discard(subject)
+            tmp_path = f'{path}.{os.getpid()}'
+            with open(tmp_path, 'wb') as fid:
+                pickle.dump(input_state, fid, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
     def _raw_mtime(self, raw=None, bad_chs=True):
         if raw is None:
             raw = self.get('raw')
@@ -1635,8 +1839,9 @@ class MneExperiment(FileTree):
             return 1  # no rejection
         with self._temporary_state:
             paths = [self.get('rej-file', epoch=e) for e in epoch.rej_file_epochs]
-        if all(exists(path) for path in paths):
-            mtime = max(getmtime(path) for path in paths)
+        mtimes = [self._content_mtime(path) for path in paths]
+        if all(mtimes):
+            mtime = max(mtimes)
             if pre_ica or rej['kind'] != 'ica' or rej['source'] == 'raw':
                 return mtime
             # incorporate ICA-file
@@ -1663,7 +1868,7 @@ class MneExperiment(FileTree):
         if exists(dst):
             mtime = self._result_mtime(data, single_subject)
             if mtime:
-                dst_mtime = getmtime(dst)
+                dst_mtime = self._content_mtime(dst)
                 if dst_mtime > mtime:
                     return dst_mtime
 
@@ -1739,6 +1944,94 @@ class MneExperiment(FileTree):
 
         return subject_, group
 
+    def _map_subjects(self, method, args, group=None, desc=None):
+        """Call a method once for each subject and collect the results
+
+        Parameters
+        ----------
+        method : str
+            Name of the method to call with the state set to each subject.
+        args : tuple
+            Arguments for the method.
+        group : str
+            Group of subjects (default is the current group).
+        desc : str
+            Description for the progress bar (default no progress bar).
+
+        Returns
+        -------
+        results : list
+            Results in subject order.
+
+        Notes
+        -----
+        If ``CONFIG['n_workers']`` is set, subjects are processed in the
+        worker pool. Each job is created with a copy of the experiment's state
+        for the corresponding subject, so results are identical to the
+        results of processing subjects in a loop. Experiments that can't be
+        pickled are processed in the current process.
+        """
+        states = [self._copy_state() for _ in self.iter(group=group)]
+        job = None
+        if CONFIG['n_workers'] and len(states) > 1:
+            job = self._worker_job()
+
+        with tqdm(total=len(states), desc=desc,
+                  disable=desc is None or CONFIG['tqdm']) as progress:
+            if job is None:
+                results = []
+                for state in states:
+                    results.append(self._call_in_state(state, method, args))
+                    progress.update()
+            else:
+                results = [None] * len(states)
+                jobs = ((state, method, args) for state in states)
+                for i, result in self._worker_results(parallel_map(job, jobs)):
+                    results[i] = result
+                    progress.update()
+        return results
+
+    def _worker_job(self):
+        "Job for calling methods in worker processes (None if not possible)"
+        job = _ExperimentJob(self)
+        try:
+            pickle.dumps(job, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, AttributeError, TypeError) as error:
+            self._log.debug("Can't use worker processes: %s", error)
+            return
+        return job
+
+    def _worker_results(self, results):
+        """Merge digitizer checks from :class:`_ExperimentJob` results
+
+        Parameters
+        ----------
+        results : iterator
+            ``(index, (result, fwd_sessions))`` tuples from mapping the job.
+
+        Yields
+        ------
+        index : int
+            Job index.
+        result
+            Result of the method.
+        """
+        for i, (result, fwd_sessions) in results:
+            if fwd_sessions:
+                subjects = self._input_state['dig-pending'].intersection(fwd_sessions)
+                for subject in subjects:
+                    self._fwd_sessions[subject] = fwd_sessions[subject]
+                    self._input_state['dig-pending'].discard(subject)
+                if subjects:
+                    self._save_input_state()
+            yield i, result
+
+    def _call_in_state(self, state, method, args=(), kwargs={}):
+        "Call a method with a state from ._copy_state()"
+        with self._temporary_state:
+            self._restore_state(state)
+            return getattr(self, method)(*args, **kwargs)
+
     def _cluster_criteria_kwargs(self, data):
         criteria = self._cluster_criteria[self.get('select_clusters')]
         return {'min' + dim: criteria[dim] for dim in data.dims if dim in criteria}
@@ -2208,6 +2501,7 @@ class MneExperiment(FileTree):
         else:
             if level <= 2:
                 self.rm('evoked-dir', confirm=True)
+                self.rm('stc-dir', confirm=True)
                 self.rm('cov-dir', confirm=True)
                 print("Cached epoch data cleared")
             if level <= 5:
@@ -2292,7 +2586,15 @@ class MneExperiment(FileTree):
         """
         if group is not None:
             kwargs['group'] = group
-        return FileTree.iter(self, fields, exclude, values, **kwargs)
+        iterator = FileTree.iter(self, fields, exclude, values, **kwargs)
+        if getattr(self, '_stamps', None) is None:
+            return iterator
+        return self._iter_stamps_batch(iterator)
+
+    def _iter_stamps_batch(self, iterator):
+        "Save file stamps changed during an iteration only once"
+        with self._stamps.batch():
+            yield from iterator
 
     def iter_range(self, start=None, stop=None, field='subject'):
         """Iterate through a range on a field with ordered values.
@@ -2730,6 +3032,12 @@ class MneExperiment(FileTree):
         -------
         epochs_dataset : Dataset
             Dataset containing single trial data (epochs).
+
+        Notes
+        -----
+        Morphed source estimates (``morph=True``) with the default sensor space
+        baseline and decimation are cached, and loaded from memory-mapped files
+        (only the epochs that are used are read from disk).
         """
         if not sns_baseline and src_baseline and \
                 self._epochs[self.get('epoch')].post_baseline_trigger_shift:
@@ -2757,13 +3065,52 @@ class MneExperiment(FileTree):
                                           False, vardef, decim)
                 dss.append(ds)
             return combine(dss)
-        else:
-            ds = self.load_epochs(subject, sns_baseline, False, cat=cat,
-                                  decim=decim, data_raw=data_raw, vardef=vardef)
-            self._add_epochs_stc(ds, ndvar, src_baseline, morph, mask)
-            if not keep_epochs:
-                del ds['epochs']
-            return ds
+
+        epoch = self._epochs[self.get('epoch')]
+        if (ndvar and morph and not keep_epochs and data_raw is False and
+                decim is None and sns_baseline in (True, epoch.baseline) and
+                not isinstance(epoch, EpochCollection) and
+                self.get('modality') != 'meeg'):
+            return self._load_epochs_stcm(src_baseline, cat, mask, vardef)
+        ds = self.load_epochs(subject, sns_baseline, False, cat=cat,
+                              decim=decim, data_raw=data_raw, vardef=vardef)
+        self._add_epochs_stc(ds, ndvar, src_baseline, morph, mask)
+        if not keep_epochs:
+            del ds['epochs']
+        return ds
+
+    def _load_epochs_stcm(self, src_baseline, cat, mask, vardef):
+        """Load morphed single trial source estimates through the stc cache
+
+        Source estimates for all epochs of the subject are cached; events are
+        loaded separately and aligned with the cached data through their index.
+        """
+        with self._temporary_state:
+            if isinstance(mask, str):
+                self.set(parc=mask)
+            path = self.get('epochs-stc-file', mkdir=True)
+            mtime = self._stc_cache_mtime(self._epochs_mtime())
+            if not cache_valid(self._content_mtime(path), mtime):
+                ds = self.load_epochs(None, True, False)
+                self._add_epochs_stc(ds, True, None, True, False)
+                save_stc(path, ds['srcm'], ds['index'].x)
+                self._stamp(path)
+            ds = self.load_selected_events(vardef=vardef, cat=cat)
+            srcm, index = load_stc(path)
+            update_subjects_dir(srcm, self.get('mri-sdir'))
+        # events for which no epoch could be extracted are not in the cache
+        ds = ds.sub(np.isin(ds['index'].x, index))
+        if ds.n_cases == 0:
+            raise RuntimeError(f"No events left for epoch={self.get('epoch')!r}, subject={self.get('subject')!r}")
+        # both are in the order of events
+        ds['srcm'] = srcm[np.searchsorted(index, ds['index'].x)]
+        if src_baseline is True:
+            src_baseline = self._epochs[self.get('epoch')].baseline
+        if src_baseline:
+            ds['srcm'] -= ds['srcm'].summary(time=src_baseline)
+        if mask:
+            _mask_ndvar(ds, 'srcm')
+        return ds
 
     def load_events(self, subject=None, add_bads=True, data_raw=True, **kwargs):
         """
@@ -2789,7 +3136,35 @@ class MneExperiment(FileTree):
         ...
             State parameters.
         """
-        evt_file = self.get('event-file', mkdir=True, subject=subject, **kwargs)
+        self.get('event-file', mkdir=True, subject=subject, **kwargs)
+        ds, raw = self._load_raw_events(add_bads)
+        if data_raw is True and raw is None:
+            raw = self.load_raw(add_bads)
+
+        # if data should come from different raw settings than events
+        if isinstance(data_raw, str):
+            with self._temporary_state:
+                raw = self.load_raw(add_bads, raw=data_raw)
+        elif not isinstance(data_raw, bool):
+            raise TypeError("data_raw=%s; needs to be str or bool"
+                            % repr(data_raw))
+
+        if data_raw is not False:
+            ds.info['raw'] = raw
+
+        return self._label_raw_events(ds)
+
+    def _load_raw_events(self, add_bads=True):
+        """Events in the raw file for the current state, before labeling
+
+        Returns
+        -------
+        ds : Dataset
+            Events.
+        raw : None | mne.io.Raw
+            The raw data, if it had to be loaded to extract the events.
+        """
+        evt_file = self.get('event-file', mkdir=True)
         subject = self.get('subject')
 
         # search for and check cached version
@@ -2803,43 +3178,36 @@ class MneExperiment(FileTree):
         else:
             ds = None
 
-        # refresh cache
-        if ds is None:
-            self._log.debug("Extracting events for %s %s %s", self.get('raw'),
-                            subject, self.get('session'))
-            if self.get('modality') == '':
-                merge = -1
-            else:
-                merge = 0
-            raw = self.load_raw(add_bads)
-            ds = load.fiff.events(raw, merge)
-            del ds.info['raw']
-            ds.info['sfreq'] = raw.info['sfreq']
-            ds.info['raw-mtime'] = raw_mtime
-            ds.info['session'] = self.get('session')
-            ds.info['subject'] = subject
-
-            # add edf
-            if self.has_edf[subject]:
-                edf = self.load_edf()
-                edf.add_t_to(ds)
-                ds.info['edf'] = edf
-
-            save.pickle(ds, evt_file)
-        elif data_raw is True:
-            raw = self.load_raw(add_bads)
-
-        # if data should come from different raw settings than events
-        if isinstance(data_raw, str):
-            with self._temporary_state:
-                raw = self.load_raw(add_bads, raw=data_raw)
-        elif not isinstance(data_raw, bool):
-            raise TypeError("data_raw=%s; needs to be str or bool"
-                            % repr(data_raw))
-
-        if data_raw is not False:
-            ds.info['raw'] = raw
+        if ds is not None:
+            return ds, None
 
+        # refresh cache
+        self._log.debug("Extracting events for %s %s %s", self.get('raw'),
+                        subject, self.get('session'))
+        if self.get('modality') == '':
+            merge = -1
+        else:
+            merge = 0
+        raw = self.load_raw(add_bads)
+        ds = load.fiff.events(raw, merge)
+        del ds.info['raw']
+        ds.info['sfreq'] = raw.info['sfreq']
+        ds.info['raw-mtime'] = raw_mtime
+        ds.info['session'] = self.get('session')
+        ds.info['subject'] = subject
+
+        # add edf
+        if self.has_edf[subject]:
+            edf = self.load_edf()
+            edf.add_t_to(ds)
+            ds.info['edf'] = edf
+
+        save.pickle(ds, evt_file)
+        return ds, raw
+
+    def _label_raw_events(self, ds):
+        "Apply the trigger shift and label_events() to events from a raw file"
+        subject = ds.info['subject']
         if self.trigger_shift:
             if isinstance(self.trigger_shift, dict):
                 trigger_shift = self.trigger_shift[subject]
@@ -2927,9 +3295,9 @@ class MneExperiment(FileTree):
             # when aggregating across sensors, do it before combining subjects
             # to avoid losing sensors that are not shared
             individual_ndvar = isinstance(data.sensor, str)
-            dss = [self.load_evoked(None, baseline, individual_ndvar, cat,
-                                    decim, data_raw, vardef, data)
-                   for _ in self.iter(group=group)]
+            dss = self._map_subjects('load_evoked', (
+                None, baseline, individual_ndvar, cat, decim, data_raw, vardef,
+                data), group)
             if individual_ndvar:
                 ndvar = False
             elif ndvar and data.sensor is True:
@@ -3122,6 +3490,11 @@ class MneExperiment(FileTree):
             Name of a 2-stage test defining additional variables.
         ...
             State parameters.
+
+        Notes
+        -----
+        When only ``morph_ndvar`` is requested with the default sensor space
+        baseline, the morphed source estimates are cached.
         """
         if not any((ind_stc, ind_ndvar, morph_stc, morph_ndvar)):
             err = ("Nothing to load, set at least one of (ind_stc, ind_ndvar, "
@@ -3137,6 +3510,22 @@ class MneExperiment(FileTree):
                                       "implemented for baseline correction in "
                                       "source space")
 
+        _, group = self._process_subject_arg(subject, {})
+        epoch = self._epochs[self.get('epoch')]
+        use_cache = (morph_ndvar and data_raw is False and
+                     sns_baseline in (True, epoch.baseline) and
+                     not any((sns_ndvar, ind_stc, ind_ndvar, morph_stc, keep_evoked)))
+        if group is not None and not (ind_ndvar or sns_ndvar):
+            # apply the inverse solution in the subjects' jobs (sensor NDVars
+            # are combined from the group's evoked responses)
+            dss = self._map_subjects('load_evoked_stc', (
+                None, sns_baseline, src_baseline, sns_ndvar, ind_stc,
+                ind_ndvar, morph_stc, morph_ndvar, cat, keep_evoked, mask,
+                data_raw, vardef), group)
+            return combine(dss, incomplete='drop')
+        elif use_cache:
+            return self._load_evoked_stcm(src_baseline, cat, mask, vardef)
+
         ds = self.load_evoked(subject, sns_baseline, sns_ndvar, cat, None,
                               data_raw, vardef)
         self._add_evoked_stc(ds, ind_stc, ind_ndvar, morph_stc, morph_ndvar,
@@ -3144,6 +3533,40 @@ class MneExperiment(FileTree):
 
         return ds
 
+    def _load_evoked_stcm(self, src_baseline, cat, mask, vardef):
+        "Load morphed evoked source estimates through the stc cache"
+        ds = self.load_evoked(None, True, False, vardef=vardef)
+        with self._temporary_state:
+            if isinstance(mask, str):
+                self.set(parc=mask)
+            path = self.get('evoked-stc-file', mkdir=True)
+            evoked_mtime = self._content_mtime(self.get('evoked-file'))
+            mtime = self._stc_cache_mtime(evoked_mtime)
+            if cache_valid(self._content_mtime(path), mtime):
+                srcm, _ = load_stc(path)
+                update_subjects_dir(srcm, self.get('mri-sdir'))
+                del ds['evoked']
+                ds['srcm'] = srcm
+            else:
+                self._add_evoked_stc(ds, morph_ndvar=True)
+                save_stc(path, ds['srcm'])
+                self._stamp(path)
+
+        if cat:
+            model = ds.eval(self.get('model'))
+            ds = ds.sub(model.isin(cat))
+            if ds.n_cases == 0:
+                raise RuntimeError(f"Selection with cat={cat!r} resulted in empty Dataset")
+        # baseline correction is linear, so it can be applied after morphing
+        if src_baseline is True:
+            src_baseline = self._epochs[self.get('epoch')].baseline
+        if src_baseline:
+            srcm = ds['srcm']
+            rescale(srcm.x, srcm.time.times, src_baseline, 'mean', copy=False)
+        if mask:
+            _mask_ndvar(ds, 'srcm')
+        return ds
+
     def load_fwd(self, surf_ori=True, ndvar=False, mask=None, **state):
         """Load the forward solution
 
@@ -3727,6 +4150,12 @@ class MneExperiment(FileTree):
             raise RuntimeError("data=%r" % (data.string,))
 
         dst = self.get('test-file', mkdir=True)
+        # permutations of single tests are checkpointed, so that interrupted
+        # tests can be resumed and cached tests can be extended
+        if isinstance(test_obj, EvokedTest) and not isinstance(data.source, str):
+            checkpoint = dst + '.checkpoint'
+        else:
+            checkpoint = None
 
         # try to load cached test
         res = None
@@ -3749,6 +4178,9 @@ class MneExperiment(FileTree):
                                   "make=True to perform the test." %
                                   (desc, res.samples, samples))
                 else:
+                    if checkpoint and save_checkpoint(checkpoint, res):
+                        self._log.info("Extending cached test from %i to %i "
+                                       "samples: %s", res.samples, samples, desc)
                     res = None
         elif not make and exists(dst):
             raise IOError("The requested test is outdated: %s. Set make=True "
@@ -3780,6 +4212,8 @@ class MneExperiment(FileTree):
         do_test = res is None
         if do_test:
             test_kwargs = self._test_kwargs(samples, pmin, tstart, tstop, data, parc_dim)
+            if checkpoint:
+                test_kwargs['checkpoint'] = checkpoint
         else:
             test_kwargs = None
 
@@ -3791,24 +4225,11 @@ class MneExperiment(FileTree):
                 self.set(model=test_obj._within_model)
 
             # stage 1
-            lms = []
-            dss = []
-            for subject in tqdm(self, "Loading stage 1 models",
-                                len(self.get_field_values('subject')),
-                                disable=CONFIG['tqdm']):
-                if test_obj.model is None:
-                    ds = self.load_epochs_stc(subject, sns_baseline,
-                                              src_baseline, morph=True,
-                                              mask=mask, vardef=test_obj.vars)
-                else:
-                    ds = self.load_evoked_stc(subject, sns_baseline,
-                                              src_baseline, morph_ndvar=True,
-                                              mask=mask, vardef=test_obj.vars)
-
-                if do_test:
-                    lms.append(test_obj.make_stage_1(y_name, ds, subject))
-                if return_data:
-                    dss.append(ds)
+            results = self._map_subjects('_load_stage_1', (
+                test, y_name, sns_baseline, src_baseline, mask, do_test,
+                return_data), desc="Loading stage 1 models")
+            lms = [lm for lm, _ in results]
+            dss = [ds for _, ds in results]
 
             if do_test:
                 res = test_obj.make_stage_2(lms, test_kwargs)
@@ -3836,12 +4257,31 @@ class MneExperiment(FileTree):
 
         if do_test:
             save.pickle(res, dst)
+            self._stamp(dst)
+            if checkpoint and exists(checkpoint):
+                os.remove(checkpoint)
 
         if return_data:
             return res_data, res
         else:
             return res
 
+    def _load_stage_1(self, test, y_name, sns_baseline, src_baseline, mask,
+                      make_lm, return_data):
+        "Stage 1 model (if make_lm) and data (if return_data) for the current subject"
+        test_obj = self._tests[test]
+        subject = self.get('subject')
+        if test_obj.model is None:
+            ds = self.load_epochs_stc(subject, sns_baseline, src_baseline,
+                                      morph=True, mask=mask,
+                                      vardef=test_obj.vars)
+        else:
+            ds = self.load_evoked_stc(subject, sns_baseline, src_baseline,
+                                      morph_ndvar=True, mask=mask,
+                                      vardef=test_obj.vars)
+        lm = test_obj.make_stage_1(y_name, ds, subject) if make_lm else None
+        return lm, (ds if return_data else None)
+
     def _make_test_rois(self, sns_baseline, src_baseline, test_obj, samples, pmin,
                         test_kwargs, res, data):
         # load data
@@ -3893,6 +4333,253 @@ class MneExperiment(FileTree):
         res = ROITestResult(subjects, samples, n_trials_ds, merged_dist, label_results)
         return label_data, res
 
+    def make_all(self, targets='evoked', n_jobs=None, data='source', **state):
+        """Make all cache files required for one or more targets
+
+        Collects the files that the targets depend on for all subjects in the
+        current group, and makes those that are not up to date. Files that do
+        not depend on each other are made concurrently in worker processes.
+
+        Parameters
+        ----------
+        targets : str | sequence of str
+            What to make: ``'raw'`` (cached files of the current raw
+            pipeline), ``'ica'`` (ICA decompositions of the current raw
+            pipeline), ``'evoked'``, ``'cov'``, ``'src'``, ``'fwd'``, or the
+            name of a test (made like :meth:`.load_test` with ``data`` and
+            default parameters otherwise).
+        n_jobs : int
+            Number of worker processes (default is the session-wide worker
+            pool, see ``n_workers`` in :func:`configure`). With ``1``, all
+            files are made in the current process.
+        data : str
+            Data for tests (default ``'source'``).
+        ...
+            State parameters (use ``group`` to select the subjects).
+
+        Returns
+        -------
+        status : Dataset
+            Status of each file: ``'cached'`` (was up to date), ``'made'``,
+            ``'failed'``, or ``'blocked'`` (a file it depends on failed).
+
+        Notes
+        -----
+        Files that require manual input (bad channels, rejection files and ICA
+        component selection) are not made; making files that depend on them
+        fails if they are missing. Errors are logged, and making files that do
+        not depend on the failed file continues.
+
+        Examples
+        --------
+        Make everything needed for the source space test ``'a>b'`` using 4
+        worker processes::
+
+            >>> ds = e.make_all('a>b', n_jobs=4)
+        """
+        if state:
+            self.set(**state)
+        if isinstance(targets, str):
+            targets = (targets,)
+        nodes = self._make_all_graph(targets, TestDims.coerce(data))
+        n_todo = sum(not node.valid for node in nodes.values())
+
+        # make
+        if n_jobs is None:
+            n_jobs = CONFIG['n_workers'] or 1
+        job = self._worker_job() if n_jobs > 1 and n_todo > 1 else None
+        if job is None:
+            job = self._call_in_state
+            pool = None
+            map_func = serial_map
+        else:
+            if n_jobs == CONFIG['n_workers']:
+                pool = None
+                pool_map = get_pool().map
+            else:
+                pool = WorkerPool(n_jobs, CONFIG['nice'])
+                pool_map = pool.map
+
+            def map_func(func, jobs):
+                return self._worker_results(pool_map(func, jobs))
+        try:
+            with tqdm(total=n_todo, desc="Making cache files",
+                      disable=CONFIG['tqdm']) as progress:
+                run_graph(nodes, job, map_func, progress)
+        finally:
+            if pool is not None:
+                pool.close()
+
+        # summary
+        ds = Dataset()
+        ds['kind'] = Factor([node.kind for node in nodes.values()])
+        ds['item'] = Datalist([node.desc for node in nodes.values()])
+        ds['status'] = Factor([node.status for node in nodes.values()])
+        for node in nodes.values():
+            if node.status == 'failed':
+                self._log.warning("Making %s %s failed: %s", node.kind, node.desc, node.error)
+        counts = Counter(ds['status'])
+        self._log.info("make_all: %s", ', '.join(f"{n} {status}" for status, n in sorted(counts.items())))
+        return ds
+
+    def _make_node(self, method, args=(), kwargs={}):
+        "Call a make method for make_all(); return an error message if it fails"
+        try:
+            getattr(self, method)(*args, **kwargs)
+        except Exception as error:
+            self._log.debug("%s failed:\n%s", method, traceback.format_exc())
+            return f"{error.__class__.__name__}: {error}"
+
+    def _make_all_graph(self, targets, data):
+        """Files required for make_all()
+
+        Returns
+        -------
+        nodes : dict
+            ``{key: MakeNode}``, where ``key`` is ``(kind, path)``.
+        """
+        nodes = {}
+
+        def add(kind, path, desc, method, args=(), kwargs={}, deps=(), valid=False):
+            key = (kind, path)
+            if key not in nodes:
+                job = (self._copy_state(), '_make_node', (method, args, kwargs))
+                nodes[key] = MakeNode(kind, desc, job, deps, valid)
+            return key
+
+        def add_raw(raw, subject, session):
+            "Key for a cached raw file (None if the raw pipe is not cached)"
+            pipe = self._raw[raw]
+            if not isinstance(pipe, CachedRawPipe):
+                return
+            path = pipe.path.format(subject=subject, session=session)
+            if ('raw', path) not in nodes:
+                deps = [add_raw(pipe.source.name, subject, session)]
+                if isinstance(pipe, RawICA):
+                    deps.append(add_ica(raw, subject))
+                with self._temporary_state:
+                    self.set(subject=subject, session=session, raw=raw)
+                    add('raw', path, f"{raw} {subject} {session}", 'make_raw',
+                        deps=filter(None, deps), valid=pipe.is_cached(subject, session))
+            return 'raw', path
+
+        def add_ica(raw, subject):
+            pipe = self._raw[raw]
+            path = pipe.ica_path.format(subject=subject)
+            if ('ica', path) not in nodes:
+                deps = [add_raw(pipe.source.name, subject, s) for s in pipe.session]
+                deps = [dep for dep in deps if dep]
+                # checking the ICA requires loading the source raw files
+                valid = all(nodes[dep].valid for dep in deps) and pipe.ica_is_cached(subject)
+                with self._temporary_state:
+                    self.set(subject=subject, raw=raw)
+                    add('ica', path, f"{raw} {subject}", 'make_ica', deps=deps, valid=valid)
+            return 'ica', path
+
+        def add_epoch_raw(epoch):
+            "Cached raw files for the current subject and an epoch"
+            raw = self.get('raw')
+            subject = self.get('subject')
+            deps = [add_raw(raw, subject, s) for s in self._epochs[epoch].sessions]
+            return [dep for dep in deps if dep]
+
+        def add_evoked():
+            epoch = self.get('epoch')
+            path = self.get('evoked-file', mkdir=True)
+            deps = add_epoch_raw(epoch)
+            valid = exists(path) and cache_valid(self._content_mtime(path), self._evoked_mtime())
+            return add('evoked', path, f"{self.get('subject')} {epoch} {self.get('model')}",
+                       '_make_evoked', (None, False), deps=deps, valid=bool(valid))
+
+        def add_cov():
+            params = self._covs[self.get('cov')]
+            path = self.get('cov-file', mkdir=True)
+            if 'epoch' in params:
+                with self._temporary_state:
+                    deps = add_epoch_raw(params['epoch'])
+            else:
+                deps = [add_raw(self.get('raw'), self.get('subject'), params['session'])]
+            mtime = self._cov_mtime() if exists(path) else None
+            valid = bool(mtime) and self._content_mtime(path) > mtime
+            return add('cov', path, f"{self.get('subject')} {self.get('cov')}",
+                       'make_cov', deps=filter(None, deps), valid=valid)
+
+        def add_src():
+            path = self.get('src-file')
+            mrisubject = self.get('mrisubject')
+            common_brain = self.get('common_brain')
+            deps = []
+            valid = exists(path)
+            if mrisubject != common_brain and is_fake_mri(self.get('mri-dir')):
+                with self._temporary_state:
+                    self.set(mrisubject=common_brain)
+                    orig_key = add_src()
+                    orig = self.get('src-file')
+                deps.append(orig_key)
+                # scaled source spaces are outdated if the original changed
+                valid = valid and nodes[orig_key].valid and self._content_mtime(path) >= self._content_mtime(orig)
+            return add('src', path, f"{mrisubject} {self.get('src')}", 'make_src',
+                       deps=deps, valid=valid)
+
+        def add_fwd():
+            subject = self.get('subject')
+            keys = []
+            sessions = self._epochs[self.get('epoch')].sessions
+            for session in sorted({self._fwd_session(subject, s) for s in sessions}):
+                with self._temporary_state:
+                    self.set(session=session)
+                    path = self.get('fwd-file')
+                    deps = [add_src(), add_raw(self.get('raw'), subject, session)]
+                    valid = exists(path) and cache_valid(self._content_mtime(path), self._fwd_mtime())
+                    keys.append(add('fwd', path, f"{subject} {session}", 'make_fwd',
+                                    deps=filter(None, deps), valid=bool(valid)))
+            return keys
+
+        def add_test(test):
+            test_obj = self._tests[test]
+            with self._temporary_state:
+                self.set(test=test)
+                deps = []
+                for _ in self:
+                    if isinstance(test_obj, EvokedTest) or test_obj.model is not None:
+                        deps.append(add_evoked())
+                    else:
+                        deps.extend(add_epoch_raw(self.get('epoch')))
+                    if data.source:
+                        deps.append(add_cov())
+                        deps.extend(add_fwd())
+                self._set_analysis_options(data, True, None, None, None, None)
+                path = self.get('test-file', mkdir=True)
+                valid = bool(self._result_file_mtime(path, data))
+                add('test', path, f"{test} {self.get('group')}", 'load_test',
+                    (test,), {'data': data.string, 'make': True}, deps, valid)
+
+        for target in targets:
+            if target in self._tests:
+                add_test(target)
+                continue
+            elif target not in ('raw', 'ica', 'evoked', 'cov', 'src', 'fwd'):
+                raise ValueError(f"target={target!r}")
+            for subject in self:
+                if target == 'raw':
+                    add_epoch_raw(self.get('epoch'))
+                elif target == 'ica':
+                    pipe = self._raw[self.get('raw')]
+                    while not isinstance(pipe, RawICA):
+                        if not isinstance(pipe, CachedRawPipe):
+                            raise ValueError(f"target='ica': raw={self.get('raw')!r} does not include ICA")
+                        pipe = pipe.source
+                    add_ica(pipe.name, subject)
+                elif target == 'evoked':
+                    add_evoked()
+                elif target == 'cov':
+                    add_cov()
+                elif target == 'src':
+                    add_src()
+                elif target == 'fwd':
+                    add_fwd()
+        return nodes
+
     def make_annot(self, redo=False, **state):
         """Make sure the annot files for both hemispheres exist
 
@@ -4146,7 +4833,7 @@ class MneExperiment(FileTree):
         dest = self.get('cov-file', mkdir=True)
         if exists(dest):
             mtime = self._cov_mtime()
-            if mtime and getmtime(dest) > mtime:
+            if mtime and self._content_mtime(dest) > mtime:
                 return
 
         params = self._covs[self.get('cov')]
@@ -4201,6 +4888,7 @@ class MneExperiment(FileTree):
             raise RuntimeError(f"reg={reg!r} in {params}")
 
         cov.save(dest)
+        self._stamp(dest)
 
     def make_empty_room_raw(self, source_file, redo=False):
         """Generate am empty room raw file with the subject's digitizer info
@@ -4251,7 +4939,7 @@ class MneExperiment(FileTree):
         model = self.get('model')
         equal_count = self.get('equalize_evoked_count') == 'eq'
         if use_cache and exists(dst):
-            if cache_valid(getmtime(dst), self._evoked_mtime()):
+            if cache_valid(self._content_mtime(dst), self._evoked_mtime()):
                 ds = self.load_selected_events(data_raw=data_raw)
                 ds = ds.aggregate(model, drop_bad=True, equal_count=equal_count,
                                   drop=('i_start', 't_edf', 'T', 'index'))
@@ -4275,6 +4963,7 @@ class MneExperiment(FileTree):
         # save
         if use_cache:
             mne.write_evokeds(dst, ds_agg['evoked'])
+            self._stamp(dst)
 
         return ds_agg
 
@@ -4283,13 +4972,10 @@ class MneExperiment(FileTree):
         subject = self.get('subject')
         session = self.get('session')
         with self._temporary_state:
-            try:
-                fwd_session = self._fwd_sessions[subject][session]
-            except KeyError:
-                raise FileMissing(f"Raw data missing for {subject}, session {session}")
+            fwd_session = self._fwd_session(subject, session)
             dst = self.get('fwd-file', session=fwd_session)
             if exists(dst):
-                if cache_valid(getmtime(dst), self._fwd_mtime()):
+                if cache_valid(self._content_mtime(dst), self._fwd_mtime()):
                     return dst
             elif self.get('modality') != '':
                 raise NotImplementedError("Source reconstruction with EEG")
@@ -4312,6 +4998,7 @@ class MneExperiment(FileTree):
                     f"corrupted bem file with source outside the inner skull "
                     f"surface.")
         mne.write_forward_solution(dst, fwd, True)
+        self._stamp(dst)
         return dst
 
     def make_ica_selection(self, epoch=None, decim=None):
@@ -5566,12 +6253,13 @@ class MneExperiment(FileTree):
                 orig = self.get('src-file')
 
             if exists(dst):
-                if getmtime(dst) >= getmtime(orig):
+                if self._content_mtime(dst) >= self._content_mtime(orig):
                     return
 
             src = self.get('src')
             subjects_dir = self.get('mri-sdir')
             mne.scale_source_space(subject, src, subjects_dir=subjects_dir)
+            self._stamp(dst)
         elif exists(dst):
             return
         else:
@@ -5597,6 +6285,7 @@ class MneExperiment(FileTree):
                     subject, spacing=spacing, add_dist=True,
                     subjects_dir=self.get('mri-sdir'))
             mne.write_source_spaces(dst, sss)
+            self._stamp(dst)
 
     def _test_kwargs(self, samples, pmin, tstart, tstop, data, parc_dim):
         "Compile kwargs for testnd tests"
@@ -22,6 +22,8 @@ class RawPipe(object):
         self.name = name
         self.path = path
         self.log = log
+        # FileStamps of the experiment (set by assemble_pipeline())
+        self.stamps = None
 
     def as_dict(self):
         return {'type': self.__class__.__name__, 'name': self.name}
@@ -52,6 +54,13 @@ class RawPipe(object):
         "Modification time of anything influencing the output of load"
         raise NotImplementedError
 
+    def _file_mtime(self, path):
+        "Content mtime of a file (see file_stamps.py), None if it is missing"
+        if self.stamps is not None:
+            return self.stamps.mtime(path)
+        elif exists(path):
+            return getmtime(path)
+
 
 class RawSource(RawPipe):
     "Raw data source"
@@ -107,14 +116,13 @@ class RawSource(RawPipe):
         self.make_bad_channels(subject, session, bad_chs, redo)
 
     def mtime(self, subject, session, bad_chs=True):
-        path = self.path.format(subject=subject, session=session)
-        if exists(path):
-            mtime = getmtime(path)
+        mtime = self._file_mtime(self.path.format(subject=subject, session=session))
+        if mtime:
             if not bad_chs:
                 return mtime
-            path = self.bads_path.format(subject=subject, session=session)
-            if exists(path):
-                return max(mtime, getmtime(path))
+            bads_mtime = self._file_mtime(self.bads_path.format(subject=subject, session=session))
+            if bads_mtime:
+                return max(mtime, bads_mtime)
 
 
 class CachedRawPipe(RawPipe):
@@ -132,11 +140,18 @@ class CachedRawPipe(RawPipe):
         out['source'] = self.source.name
         return out
 
+    def is_cached(self, subject, session):
+        "Whether the cached file exists and is up to date"
+        mtime = self._file_mtime(self.path.format(subject=subject, session=session))
+        if mtime is None:
+            return False
+        input_mtime = self.mtime(subject, session, self._bad_chs_affect_cache)
+        return input_mtime is not None and mtime >= input_mtime
+
     def cache(self, subject, session):
         "Make sure the cache is up to date"
         path = self.path.format(subject=subject, session=session)
-        if (not exists(path) or getmtime(path) <
-                self.mtime(subject, session, self._bad_chs_affect_cache)):
+        if not self.is_cached(subject, session):
             from .. import __version__
             # make sure directory exists
             dir_path = dirname(path)
@@ -150,6 +165,8 @@ class CachedRawPipe(RawPipe):
                 raw = self._make(subject, session)
             # save
             raw.save(path, overwrite=True)
+            if self.stamps is not None:
+                self.stamps.update(path)
         return path
 
     def load(self, subject, session, add_bads=True, preload=False):
@@ -313,15 +330,30 @@ class RawICA(CachedRawPipe):
                                "create it." % (self.name, subject))
         return mne.preprocessing.read_ica(path)
 
+    def _load_ica_raw(self, subject):
+        "Raw data of the first session with the bad channels of all sessions"
+        raw = self.source.load(subject, self.session[0], add_bads=False)
+        raw.info['bads'] = self.load_bad_channels(subject)
+        return raw
+
+    @staticmethod
+    def _ica_matches(path, raw):
+        "Whether the ICA in ``path`` is based on the good channels of ``raw``"
+        ica = mne.preprocessing.read_ica(path)
+        picks = mne.pick_types(raw.info, ref_meg=False)
+        return ica.ch_names == [raw.ch_names[i] for i in picks]
+
+    def ica_is_cached(self, subject):
+        "Whether the ICA file exists and is up to date with the bad channels"
+        path = self.ica_path.format(subject=subject)
+        return exists(path) and self._ica_matches(path, self._load_ica_raw(subject))
+
     def make_ica(self, subject):
         path = self.ica_path.format(subject=subject)
-        raw = self.source.load(subject, self.session[0], add_bads=False)
-        bad_channels = self.load_bad_channels(subject)
-        raw.info['bads'] = bad_channels
+        raw = self._load_ica_raw(subject)
+        bad_channels = raw.info['bads']
         if exists(path):
-            ica = mne.preprocessing.read_ica(path)
-            picks = mne.pick_types(raw.info, ref_meg=False)
-            if ica.ch_names == [raw.ch_names[i] for i in picks]:
+            if self._ica_matches(path, raw):
                 return path
             self.log.info("Raw %s: ICA outdated due to change in bad channels "
                           "for %s", self.name, subject)
@@ -350,9 +382,9 @@ class RawICA(CachedRawPipe):
     def mtime(self, subject, session, bad_chs=True):
         mtime = CachedRawPipe.mtime(self, subject, session, bad_chs)
         if mtime:
-            path = self.ica_path.format(subject=subject)
-            if exists(path):
-                return max(mtime, getmtime(path))
+            ica_mtime = self._file_mtime(self.ica_path.format(subject=subject))
+            if ica_mtime:
+                return max(mtime, ica_mtime)
 
 
 class RawMaxwell(CachedRawPipe):
@@ -377,7 +409,7 @@ class RawMaxwell(CachedRawPipe):
 
 
 def assemble_pipeline(raw_dict, raw_path, bads_path, cache_path, ica_path,
-                      sessions, log):
+                      sessions, log, stamps=None):
     "Assemble preprocessing pipeline form a definition in a dict"
     raw = {}
     unassigned = raw_dict.copy()
@@ -428,6 +460,8 @@ def assemble_pipeline(raw_dict, raw_path, bads_path, cache_path, ica_path,
         raise ValueError("Preprocssing pipeline has not raw source")
     elif has_source != 'raw':
         raise NotImplementedError("The raw source must be called 'raw'")
+    for pipe in raw.values():
+        pipe.stamps = stamps
     return raw
 
 
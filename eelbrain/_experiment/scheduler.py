@@ -0,0 +1,129 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Make cache files in the order of their dependencies
+
+Used by :meth:`MneExperiment.make_all`: the experiment describes each file
+(or set of files) that needs to be made as a :class:`MakeNode`, and
+:func:`run_graph` submits nodes as soon as all their dependencies are made.
+"""
+from queue import Queue
+
+
+class MakeNode(object):
+    """A cache file that is made by calling an experiment method
+
+    Parameters
+    ----------
+    kind : str
+        Kind of file (e.g., ``'evoked'``).
+    desc : str
+        Description of the item (e.g., subject and epoch).
+    job : tuple
+        Arguments for the job function.
+    deps : sequence of tuple
+        Keys of the nodes that need to be made before this node.
+    valid : bool
+        Whether the file is already up to date.
+    """
+    def __init__(self, kind, desc, job, deps=(), valid=False):
+        self.kind = kind
+        self.desc = desc
+        self.job = job
+        self.deps = tuple(deps)
+        self.valid = valid
+        self.status = 'cached' if valid else None
+        self.error = None
+
+    def __repr__(self):
+        return f"<MakeNode {self.kind}: {self.desc} ({self.status})>"
+
+
+def run_graph(nodes, func, map_func, progress=None):
+    """Make all outdated nodes, respecting dependencies
+
+    Parameters
+    ----------
+    nodes : dict
+        ``{key: MakeNode}``; the keys of all dependencies need to be in
+        ``nodes``.
+    func : callable
+        Job function, returns ``None`` on success and an error message if
+        making the node failed.
+    map_func : callable
+        Called as ``map_func(func, jobs)``, yields ``(index, result)`` tuples
+        (see :func:`parallel_map`). ``jobs`` is fed as nodes become ready, so
+        ``map_func`` needs to request a new job only after the previous one
+        was submitted.
+    progress : tqdm
+        Progress bar to update for each node that is done.
+
+    Notes
+    -----
+    Sets the ``status`` attribute of each node to ``'cached'`` (up to date),
+    ``'made'``, ``'failed'`` (``error`` is set to the error message) or
+    ``'blocked'`` (a dependency failed).
+    """
+    todo = {key for key, node in nodes.items() if not node.valid}
+    if not todo:
+        return
+    dependents = {key: [] for key in todo}
+    waiting = {}  # {key: number of dependencies that are not made yet}
+    ready = Queue()
+    for key in todo:
+        deps = [dep for dep in nodes[key].deps if dep in todo]
+        for dep in deps:
+            dependents[dep].append(key)
+        waiting[key] = len(deps)
+    # submit in a deterministic order
+    for key in sorted(todo, key=str):
+        if not waiting[key]:
+            ready.put(key)
+
+    submitted = []
+
+    def jobs():
+        while True:
+            key = ready.get()
+            if key is None:
+                return
+            submitted.append(key)
+            yield nodes[key].job
+
+    def block(key):
+        for dependent in dependents[key]:
+            node = nodes[dependent]
+            if node.status is None:
+                node.status = 'blocked'
+                done.append(dependent)
+                block(dependent)
+
+    done = []
+    n_done = 0
+    try:
+        for index, error in map_func(func, jobs()):
+            key = submitted[index]
+            node = nodes[key]
+            done.append(key)
+            if error:
+                node.status = 'failed'
+                node.error = error
+                block(key)
+            else:
+                node.status = 'made'
+                for dependent in sorted(dependents[key], key=str):
+                    waiting[dependent] -= 1
+                    if not waiting[dependent] and nodes[dependent].status is None:
+                        ready.put(dependent)
+            if progress is not None:
+                progress.update(len(done) - n_done)
+            n_done = len(done)
+            if n_done == len(todo):
+                ready.put(None)
+    finally:
+        # release the job iterator if the map is interrupted
+        ready.put(None)
+
+
+def serial_map(func, jobs):
+    "Same interface as :func:`parallel_map` but in the current process"
+    for index, job in enumerate(jobs):
+        yield index, func(*job)
@@ -0,0 +1,65 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Cache for morphed source estimates
+
+Each source estimate :class:`NDVar` is stored in two files: the data as
+``.npy`` file, which is memory-mapped when loading, so that only the cases that
+are used are read from disk, and the remaining attributes (dimensions, info,
+name and an optional index of the cases) in a pickle file next to it.
+"""
+import os
+from os.path import splitext
+import pickle
+
+import numpy as np
+
+from .._data_obj import NDVar
+
+
+def data_path(path):
+    "Path of the data file belonging to the cache file ``path``"
+    return splitext(path)[0] + '.npy'
+
+
+def save_stc(path, ndvar, index=None):
+    """Save a source estimate to the cache
+
+    Parameters
+    ----------
+    path : str
+        Cache file (``*.pickle``).
+    ndvar : NDVar
+        Source estimate.
+    index : array
+        Index of the cases in ``ndvar`` (for aligning them with events).
+    """
+    state = {'dims': ndvar.dims, 'info': ndvar.info, 'name': ndvar.name,
+             'shape': ndvar.x.shape, 'index': index}
+    # write each file to a temporary file first; replacing the file instead of
+    # overwriting it keeps the data of memory-mapped arrays that are still open
+    # intact; the pickle file is written last, so a complete pickle file
+    # implies a complete data file
+    for dst, write in ((data_path(path), lambda fid: np.save(fid, ndvar.x)),
+                       (path, lambda fid: pickle.dump(state, fid, pickle.HIGHEST_PROTOCOL))):
+        tmp_path = f'{dst}.{os.getpid()}'
+        with open(tmp_path, 'wb') as fid:
+            write(fid)
+        os.replace(tmp_path, dst)
+
+
+def load_stc(path):
+    """Load a source estimate from the cache
+
+    Returns
+    -------
+    ndvar : NDVar
+        Source estimate, with data in a copy-on-write :class:`numpy.memmap`
+        (modifying the data does not change the file).
+    index : None | array
+        Index of the cases, if it was saved.
+    """
+    with open(path, 'rb') as fid:
+        state = pickle.load(fid)
+    x = np.load(data_path(path), mmap_mode='c')
+    if x.shape != state['shape']:
+        raise IOError(f"Data in {data_path(path)} does not match {path}")
+    return NDVar(x, state['dims'], state['info'], state['name']), state['index']
@@ -0,0 +1,79 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+import os
+import shutil
+
+from nose.tools import eq_
+
+from eelbrain._experiment.file_stamps import FileStamps
+from eelbrain._utils.testing import TempDir
+
+
+def test_file_stamps():
+    "Test content modification times"
+    tempdir = TempDir()
+    root = os.path.join(tempdir, 'root')
+    os.mkdir(root)
+    stamps_path = os.path.join(root, 'cache', 'stamps.pickle')
+    path = os.path.join(root, 'data.txt')
+    with open(path, 'w') as fid:
+        fid.write('data')
+    os.utime(path, (1000, 1000))
+
+    stamps = FileStamps(root, stamps_path)
+    eq_(stamps.mtime(path), 1000)
+    eq_(stamps.mtime(os.path.join(root, 'missing.txt')), None)
+
+    # touching the file does not change the content mtime
+    os.utime(path, (2000, 2000))
+    eq_(stamps.mtime(path), 1000)
+    eq_(FileStamps(root, stamps_path).mtime(path), 1000)
+
+    # changing the content does
+    with open(path, 'w') as fid:
+        fid.write('new data')
+    os.utime(path, (3000, 3000))
+    eq_(stamps.mtime(path), 3000)
+
+    # rewriting the same content with update()
+    os.utime(path, (4000, 4000))
+    stamps.update(path)
+    eq_(stamps.mtime(path), 4000)
+
+    # moving the root
+    new_root = os.path.join(tempdir, 'moved')
+    shutil.copytree(root, new_root)
+    new_path = os.path.join(new_root, 'data.txt')
+    os.utime(new_path, (5000, 5000))
+    stamps = FileStamps(new_root, os.path.join(new_root, 'cache', 'stamps.pickle'))
+    eq_(stamps.mtime(new_path), 4000)
+    eq_(len(stamps.hash(new_path)), 40)
+
+
+def test_file_stamps_merge():
+    "Test saving stamps from multiple instances"
+    tempdir = TempDir()
+    stamps_path = os.path.join(tempdir, 'cache', 'stamps.pickle')
+    paths = [os.path.join(tempdir, name) for name in ('a.txt', 'b.txt')]
+    for i, path in enumerate(paths):
+        with open(path, 'w') as fid:
+            fid.write(str(i))
+        os.utime(path, (1000 + i, 1000 + i))
+
+    # instances do not overwrite each other's stamps
+    stamps_1 = FileStamps(tempdir, stamps_path)
+    stamps_2 = FileStamps(tempdir, stamps_path)
+    eq_(stamps_1.mtime(paths[0]), 1000)
+    eq_(stamps_2.mtime(paths[1]), 1001)
+    stamps = FileStamps(tempdir, stamps_path)
+    eq_(sorted(stamps._stamps), ['a.txt', 'b.txt'])
+
+    # batch saves changes at the end
+    os.utime(paths[0], (2000, 2000))
+    with stamps_1.batch():
+        eq_(stamps_1.mtime(paths[0]), 1000)
+        eq_(FileStamps(tempdir, stamps_path)._stamps['a.txt'][0], 1000)
+    eq_(FileStamps(tempdir, stamps_path)._stamps['a.txt'][0], 2000)
+    # removing a file
+    os.remove(paths[1])
+    eq_(stamps_1.mtime(paths[1]), None)
+    eq_(sorted(FileStamps(tempdir, stamps_path)._stamps), ['a.txt'])
@@ -5,7 +5,7 @@ from nose.tools import eq_, ok_, assert_raises
 import numpy as np
 from numpy.testing import assert_array_equal
 
-from eelbrain import Dataset, Factor, Var, MneExperiment
+from eelbrain import Dataset, Factor, Var, MneExperiment, configure, load
 from eelbrain._utils.testing import assert_dataobj_equal, TempDir
 
 
@@ -201,6 +201,14 @@ class FileExperimentDefaults(FileExperiment):
                 'group': 'gsub'}
 
 
+class FileExperimentInstance(FileExperiment):
+    "Definitions that depend on the initialization arguments"
+
+    def __init__(self, root, subjects, **state):
+        self.groups = {'ginst': subjects}
+        FileExperiment.__init__(self, root, **state)
+
+
 def test_file_handling():
     "Test MneExperiment with actual files"
     tempdir = TempDir()
@@ -224,3 +232,42 @@ def test_file_handling():
     e = FileExperimentDefaults(tempdir)
     eq_(e.get('group'), 'gsub')
     eq_(e.get('subject'), SUBJECTS[1])
+
+    # per-subject jobs
+    e = FileExperiment(tempdir)
+    e.set(SUBJECTS[0])
+    for n_workers in (0, 2):
+        configure(n_workers=n_workers)
+        eq_(e._map_subjects('get', ('subject',), 'gsub'), SUBJECTS[1:])
+        eq_(e.get('subject'), SUBJECTS[0])
+        # workers initialize experiments like the parent
+        for subjects in (SUBJECTS[:2], SUBJECTS[1:]):
+            e_inst = FileExperimentInstance(tempdir, subjects, group='ginst')
+            e_inst.brain_plot_defaults = {'surf': subjects[0]}
+            eq_(e_inst._map_subjects('get', ('subject',)), subjects)
+            eq_(e_inst._map_subjects('__getattribute__', ('brain_plot_defaults',)),
+                [{'surf': subjects[0]}] * len(subjects))
+    configure(n_workers=True)
+
+
+def test_input_state():
+    "Test saving the input-state from concurrent experiments"
+    tempdir = TempDir()
+    for subject in SUBJECTS:
+        os.makedirs(os.path.join(tempdir, 'meg', subject))
+    e1 = BaseExperiment(tempdir)
+    e2 = BaseExperiment(tempdir)
+    subject = SUBJECTS[0]
+    for e in (e1, e2):
+        e._input_state['dig-pending'].add(subject)
+    # digitizer check in e1
+    e1._fwd_sessions[subject] = {'file': 'file'}
+    e1._input_state['dig-pending'].discard(subject)
+    e1._save_input_state()
+    # saving e2 retains the check
+    e2._save_input_state()
+    ok_(subject not in e2._input_state['dig-pending'])
+    eq_(e2._fwd_sessions[subject], {'file': 'file'})
+    input_state = load.unpickle(e2.get('input-state-file'))
+    eq_(input_state['fwd-sessions'][subject], {'file': 'file'})
+    eq_(input_state['dig-pending'], set())
@@ -1,7 +1,8 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 """Test MneExperiment using mne-python sample data"""
+import os
 from pathlib import Path
-from os.path import join
+from os.path import exists, join
 
 from nose.tools import eq_, assert_raises
 import numpy as np
@@ -189,3 +190,88 @@ def test_samples_sesssions():
     ds2 = e.load_epochs(epoch='target2')
     ds_super = e.load_epochs(epoch='super')
     assert_dataobj_equal(ds_super['meg'], combine((ds1['meg'], ds2['meg'])))
+
+    # input state: touching a raw file does not require checking it again
+    e._fwd_session('R0000', 'sample1')
+    eq_(e._input_state['dig-pending'], {'R0001'})
+    raw_file = e.get('raw-file', subject='R0000', session='sample1')
+    os.utime(raw_file)
+    e = SampleExperiment(root)
+    eq_(e._input_state['dig-pending'], {'R0001'})
+    eq_(e._fwd_session('R0000', 'sample2'), 'sample1')
+
+
+@requires_mne_sample_data
+def test_sample_source():
+    set_log_level('warning', 'mne')
+    SampleExperiment = import_attr(sample_path / 'sample_experiment.py', 'SampleExperiment')
+    tempdir = TempDir()
+    datasets.setup_samples_experiment(tempdir, 2, 1, mris=True)
+
+    class Experiment(SampleExperiment):
+        _values = {'common_brain': 'sample'}
+        epochs = SampleExperiment.epochs.copy()
+    Experiment.epochs['cov'] = {'base': 'target', 'tmax': 0}
+
+    root = join(tempdir, 'SampleExperiment')
+    e = Experiment(root)
+    e.set('R0000', rej='', cov='reg', model='modality')
+
+    # cached morphed source estimates are equivalent to computing them
+    def assert_stc_cache_equal(**kwargs):
+        ds = e.load_evoked_stc(morph_ndvar=True, **kwargs)
+        ds_ref = e.load_evoked_stc(morph_ndvar=True, keep_evoked=True, **kwargs)
+        assert_dataobj_equal(ds['srcm'], ds_ref['srcm'], decimal=10)
+        assert_dataobj_equal(ds['modality'], ds_ref['modality'])
+        ds = e.load_epochs_stc(morph=True, **kwargs)
+        ds_ref = e.load_epochs_stc(morph=True, keep_epochs=True, **kwargs)
+        assert_dataobj_equal(ds['srcm'], ds_ref['srcm'], decimal=10)
+        assert_dataobj_equal(ds['trigger'], ds_ref['trigger'])
+        return ds['srcm']
+
+    for kwargs in ({}, {'src_baseline': True}, {'cat': ('auditory',)},
+                   {'mask': True}):
+        assert_stc_cache_equal(**kwargs)
+    srcm = assert_stc_cache_equal()
+    assert os.listdir(e.get('stc-dir'))
+
+    # cache invalidated by change in bad channels
+    e.make_bad_channels(['MEG 0331'])
+    srcm_bads = assert_stc_cache_equal()
+    assert not np.allclose(srcm.x, srcm_bads.x)
+
+
+@requires_mne_sample_data
+def test_sample_make_all():
+    set_log_level('warning', 'mne')
+    SampleExperiment = import_attr(sample_path / 'sample_experiment.py', 'SampleExperiment')
+    tempdir = TempDir()
+    datasets.setup_samples_experiment(tempdir, 2, 1, mris=True)
+
+    class Experiment(SampleExperiment):
+        _values = {'common_brain': 'sample'}
+        epochs = SampleExperiment.epochs.copy()
+    Experiment.epochs['cov'] = {'base': 'target', 'tmax': 0}
+
+    root = join(tempdir, 'SampleExperiment')
+    e = Experiment(root)
+    e.set(raw='tsss', rej='', cov='reg', model='modality')
+    targets = ('evoked', 'cov', 'fwd')
+
+    ds = e.make_all(targets)
+    eq_(set(ds['kind'].cells), {'raw', 'evoked', 'cov', 'src', 'fwd'})
+    for kind in ('raw', 'evoked', 'cov', 'fwd'):
+        eq_(ds.sub(f"kind == '{kind}'").n_cases, 2)
+    for kind, item, status in ds.zip('kind', 'item', 'status'):
+        if kind == 'src':
+            assert status in ('made', 'cached'), f"{kind} {item}: {status}"
+        else:
+            eq_(status, 'made', f"{kind} {item}")
+    assert exists(e.get('evoked-file', subject='R0001'))
+    assert exists(e.get('fwd-file', subject='R0001'))
+
+    # second call finds everything up to date
+    ds_2 = e.make_all(targets)
+    eq_(list(ds_2['item']), list(ds['item']))
+    for kind, item, status in ds_2.zip('kind', 'item', 'status'):
+        eq_(status, 'cached', f"{kind} {item}")
@@ -0,0 +1,29 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+from nose.tools import eq_
+
+from eelbrain._experiment.scheduler import MakeNode, run_graph, serial_map
+
+
+def test_run_graph():
+    "Test making nodes in the order of their dependencies"
+    made = []
+
+    def make(name):
+        made.append(name)
+        if name == 'b':
+            return "Error: b"
+
+    nodes = {
+        'a': MakeNode('raw', 'a', ('a',)),
+        'b': MakeNode('raw', 'b', ('b',)),
+        'c': MakeNode('raw', 'c', ('c',), valid=True),
+        'ab': MakeNode('evoked', 'ab', ('ab',), ('a', 'b')),
+        'ac': MakeNode('evoked', 'ac', ('ac',), ('a', 'c')),
+        'test': MakeNode('test', 'test', ('test',), ('ab', 'ac')),
+    }
+    run_graph(nodes, make, serial_map)
+    eq_(made, ['a', 'b', 'ac'])
+    eq_({key: node.status for key, node in nodes.items()},
+        {'a': 'made', 'b': 'failed', 'c': 'cached', 'ab': 'blocked',
+         'ac': 'made', 'test': 'blocked'})
+    eq_(nodes['b'].error, "Error: b")
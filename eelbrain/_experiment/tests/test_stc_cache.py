@@ -0,0 +1,41 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+import os
+
+from nose.tools import eq_, ok_
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from eelbrain import NDVar, Case, UTS
+from eelbrain._experiment.stc_cache import load_stc, save_stc
+from eelbrain._utils.memmap import is_memmap
+from eelbrain._utils.testing import TempDir
+
+
+def test_stc_cache():
+    "Test saving and loading cached source estimates"
+    tempdir = TempDir()
+    path = os.path.join(tempdir, 'stc.pickle')
+    x = np.random.normal(0, 1, (5, 20))
+    y = NDVar(x, (Case, UTS(-0.1, 0.01, 20)), {'a': 1}, 'srcm')
+    index = np.arange(2, 7)
+
+    save_stc(path, y, index)
+    y2, index2 = load_stc(path)
+    ok_(is_memmap(y2.x))
+    eq_(y2.dims, y.dims)
+    eq_(y2.info, y.info)
+    eq_(y2.name, 'srcm')
+    assert_array_equal(y2.x, x)
+    assert_array_equal(index2, index)
+
+    # modifying the loaded data does not change the file
+    y2 -= 1
+    assert_array_equal(load_stc(path)[0].x, x)
+
+    # overwriting the cache does not change arrays that are still open
+    y3, _ = load_stc(path)
+    save_stc(path, y * 2)
+    assert_array_equal(y3.x, x)
+    y4, index4 = load_stc(path)
+    assert_array_equal(y4.x, x * 2)
+    eq_(index4, None)
@@ -26,6 +26,7 @@ from ._info import merge_info
 from ._stats.connectivity import Connectivity
 from ._stats.connectivity import find_peaks as _find_peaks
 from ._trf._boosting_opt import l1
+from ._trf._convolve import convolve_kernels
 
 
 def concatenate(ndvars, dim='time', name=None, tmin=0, info=None, ravel=None):
@@ -164,68 +165,39 @@ def convolve(h, x):
             raise TypeError("If h is an NDVar, x also needs to be an NDVar "
                             "(got x=%r)" % (x,))
 
-        if h.ndim == 1:
-            ht = h.get_dim('time')
-            hdim = None
-        elif h.ndim == 2:
-            hdim, ht = h.get_dims((None, 'time'))
-        else:
-            raise NotImplementedError("h must be 1 or 2 dimensional, got h=%r" % h)
-
+        ht = h.get_dim('time')
         if x.ndim == 1:
             xt = x.get_dim('time')
             xdim = None
         elif x.ndim == 2:
             xdim, xt = x.get_dims((None, 'time'))
-            if xdim != hdim:
-                raise ValueError("h %s dimension and x %s dimension do not "
-                                 "match" % (hdim.name, xdim.name))
+            if not h.has_dim(xdim.name) or h.get_dim(xdim.name) != xdim:
+                raise ValueError("h does not have the %s dimension of x "
+                                 "(h=%r)" % (xdim.name, h))
         else:
-            raise NotImplementedError("x must be 1 or 2 dimensional, got x=%r" % h)
+            raise NotImplementedError("x must be 1 or 2 dimensional, got x=%r" % x)
 
         if ht.tstep != xt.tstep:
             raise ValueError(
                 "h and x need to have same time-step (got h.time.tstep=%s, "
                 "x.time.tstep=%s)" % (ht.tstep, xt.tstep))
 
-        if h.ndim == 1:
-            data = np.convolve(h.x, x.x)
-            dims = (xt,)
-        elif x.ndim == 1:
-            xdata = x.get_data('time')
-            data = np.array(tuple(np.convolve(h_i, xdata) for h_i in
-                                  h.get_data((hdim.name, 'time'))))
-            dims = (hdim, xt)
+        # dimensions of h that are not in x are dimensions of the output
+        ydims = tuple(dim for dim in h.dims if dim is not ht and
+                      (xdim is None or dim.name != xdim.name))
+        ynames = tuple(dim.name for dim in ydims)
+        if xdim is None:
+            h_data = h.get_data(ynames + ('time',))[..., np.newaxis, :]
+            x_data = x.get_data(('time',))[np.newaxis]
         else:
-            data = None
-            for h_i, x_i in zip(h.get_data((hdim.name, 'time')),
-                                 x.get_data((xdim.name, 'time'))):
-                if data is None:
-                    data = np.convolve(h_i, x_i)
-                else:
-                    data += np.convolve(h_i, x_i)
-            dims = (xt,)
+            h_data = h.get_data(ynames + (xdim.name, 'time'))
+            x_data = x.get_data((xdim.name, 'time'))
 
         # full convolution -> decide which slice of data corresponds to x
         # i.e., if kernel tmin is positive, add zero-padding
         i_start = -int(round(ht.tmin / ht.tstep))
-        i_stop = i_start + xt.nsamples
-        if i_start < 0:
-            if data.ndim == 2:
-                pad = np.zeros((len(hdim), -i_start))
-            else:
-                pad = np.zeros(-i_start)
-            data = np.concatenate((pad, data[..., :i_stop]), -1)
-        elif i_stop > data.shape[-1]:
-            if data.ndim == 2:
-                pad = np.zeros((len(hdim), i_stop - data.shape[-1]))
-            else:
-                pad = np.zeros(i_stop - data.shape[-1])
-            data = np.concatenate((data[..., i_start:], pad), -1)
-        else:
-            data = data[..., i_start: i_stop]
-
-        return NDVar(data, dims, x.info.copy(), x.name)
+        data = convolve_kernels(h_data, x_data, i_start, i_start + xt.nsamples)
+        return NDVar(data, ydims + (xt,), x.info.copy(), x.name)
     else:
         out = None
         for h_, x_ in zip(h, x):
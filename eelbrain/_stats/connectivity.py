@@ -7,8 +7,25 @@ from .._data_obj import Dimension
 
 
 class Connectivity(object):
-    """N-dimensional connectivity"""
-    __slots__ = ('struct', 'custom', 'vector')
+    """N-dimensional connectivity
+
+    Attributes
+    ----------
+    struct : array of bool
+        Structuring element for grid connectivity (:func:`scipy.ndimage.label`).
+    custom : dict
+        ``{axis: (edges, edge_start, edge_stop)}`` for the axis with custom
+        connectivity.
+    grid : array of int8 (n_dims,)
+        For each axis, whether adjacent elements are connected.
+    edge_start : array of int (n_vertices + 1,)
+        Compressed sparse row representation of the custom connectivity on
+        the first axis (empty without custom connectivity): the neighbors of
+        vertex ``i`` are ``edge_dst[edge_start[i]: edge_start[i + 1]]``.
+    edge_dst : array of int
+        Neighbors of each vertex (edges in both directions).
+    """
+    __slots__ = ('struct', 'custom', 'vector', 'grid', 'edge_start', 'edge_dst')
 
     def __init__(self, dims, parc=None):
         types = [dim._connectivity_type for dim in dims]
@@ -53,13 +70,32 @@ class Connectivity(object):
         for i, ctype in enumerate(types):
             if ctype != 'grid':
                 self.struct[(slice(None),) * i + (slice(None, None, 2),)] = False
+        self._init_graph()
+
+    def _init_graph(self):
+        "Graph representation for :mod:`.connectivity_opt` functions"
+        struct = self.struct
+        self.grid = np.array([struct[(1,) * i + (0,) + (1,) * (struct.ndim - i - 1)]
+                              for i in range(struct.ndim)], np.int8)
+        if self.custom:
+            edges, edge_start, _ = self.custom[0]
+            n_vert = len(edge_start)
+            src = np.concatenate((edges[:, 0], edges[:, 1])).astype(np.int64)
+            dst = np.concatenate((edges[:, 1], edges[:, 0])).astype(np.int64)
+            index = np.argsort(src, kind='mergesort')
+            self.edge_dst = dst[index]
+            self.edge_start = np.zeros(n_vert + 1, np.int64)
+            np.cumsum(np.bincount(src, minlength=n_vert), out=self.edge_start[1:])
+        else:
+            self.edge_start = self.edge_dst = np.empty(0, np.int64)
 
     def __getstate__(self):
-        return {k: getattr(self, k) for k in self.__slots__}
+        return {k: getattr(self, k) for k in ('struct', 'custom', 'vector')}
 
     def __setstate__(self, state):
         for k, v in state.items():
             setattr(self, k, v)
+        self._init_graph()
 
 
 def find_peaks(x, connectivity, out=None):
@@ -6,127 +6,358 @@ import numpy as np
 cimport numpy as np
 
 
+ctypedef np.int8_t INT8
+ctypedef np.uint8_t UINT8
 ctypedef np.uint32_t UINT32
 ctypedef np.int64_t INT64
 ctypedef np.float64_t FLOAT64
 
-def merge_labels(np.ndarray[UINT32, ndim=2] cmap,
-                 long n_labels_in,
-                 np.ndarray[UINT32, ndim=2] edges,
-                 np.ndarray[INT64, ndim=1] edge_start,
-                 np.ndarray[INT64, ndim=1] edge_stop):
-    """Merge adjacent labels with non-standard connectivity
+
+cdef Py_ssize_t uf_find(INT64 *parent, Py_ssize_t i) nogil:
+    "Find the root of ``i`` (with path halving)"
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+cdef inline void uf_union(INT64 *parent, Py_ssize_t i, Py_ssize_t j) nogil:
+    "Merge the sets of ``i`` and ``j``; the smaller index becomes the root"
+    i = uf_find(parent, i)
+    j = uf_find(parent, j)
+    if i < j:
+        parent[j] = i
+    elif j < i:
+        parent[i] = j
+
+
+def label_chunk(np.ndarray[UINT8, ndim=1] bin_map,
+                np.ndarray[INT64, ndim=1] parent,
+                np.ndarray[INT64, ndim=1] shape,
+                np.ndarray[INT8, ndim=1] grid,
+                np.ndarray[INT64, ndim=1] edge_start,
+                np.ndarray[INT64, ndim=1] edge_dst,
+                Py_ssize_t start,
+                Py_ssize_t stop):
+    """Find connected components in a chunk of a binary map
+
+    Elements are linked to the root of their component in ``parent``. The
+    chunk consists of the slices ``start:stop`` along the second axis;
+    connections to elements outside the chunk are ignored (see
+    :func:`merge_chunks`). Different chunks can be processed concurrently.
 
     Parameters
     ----------
-    cmap : array of int, ndim=2
-        Array with labels, labels are merged along the second axis; cmap is
-        modified in-place.
-    n_labels_in : int
-        Number of labels in cmap.
-    edges : array of int (n_edges, 2)
-        Edges of the connectivity graph.
+    bin_map : array of uint8 (n_elements,)
+        Flat binary map.
+    parent : array of int (n_elements,)
+        Union-find parent of each element (modified in place; only defined
+        for elements in ``bin_map``).
+    shape : array of int
+        Shape of the map.
+    grid : array of int8
+        For each axis, whether adjacent elements are connected.
+    edge_start : array of int (n_vertices + 1,)
+        Start of each vertex's edges in ``edge_dst`` (custom connectivity on
+        the first axis; empty for no custom connectivity).
+    edge_dst : array of int
+        Neighbors of each vertex (in both directions).
+    start, stop : int
+        Range of the chunk along the second axis (``0, 1`` for 1-d maps).
     """
-    n_labels_in += 1
-
-    cdef unsigned int slice_i, i, dst_i, edge_i
-    cdef unsigned int n_vert = cmap.shape[0]
-    cdef unsigned int n_slices = cmap.shape[1]
-    cdef unsigned int label, connected_label, src, dst
-    cdef unsigned int relabel_src, relabel_dst
-
-    cdef unsigned int* relabel = <unsigned int*> malloc(sizeof(unsigned int) * n_labels_in)
-    for i in range(n_labels_in):
-        relabel[i] = i
-
-    # find targets for relabeling
-    for slice_i in range(n_slices):
-        for src in range(n_vert):
-            label = cmap[src, slice_i]
-            if label == 0:
-                continue
-
-            for edge_i in range(edge_start[src], edge_stop[src]):
-                dst = edges[edge_i, 1]
-                connected_label = cmap[dst, slice_i]
-                if connected_label == 0:
-                    continue
+    cdef Py_ssize_t v, t, k, ax, i, j, e, w, coord
+    cdef Py_ssize_t n_ax = shape.shape[0]
+    cdef Py_ssize_t n_vert = shape[0]
+    cdef Py_ssize_t n_t = shape[1] if n_ax > 1 else 1
+    cdef Py_ssize_t n_inner = 1
+    cdef bint custom = edge_start.shape[0] > 0
+    cdef UINT8 *bin_ = <UINT8*> bin_map.data
+    cdef INT64 *parent_ = <INT64*> parent.data
+    cdef INT64 *shape_ = <INT64*> shape.data
+    cdef INT8 *grid_ = <INT8*> grid.data
+    cdef INT64 *edge_start_ = <INT64*> edge_start.data
+    cdef INT64 *edge_dst_ = <INT64*> edge_dst.data
+    for ax in range(2, n_ax):
+        n_inner *= shape[ax]
+    cdef Py_ssize_t stride_vert = n_t * n_inner
+    cdef INT64 *strides = <INT64*> malloc(sizeof(INT64) * max(n_ax, 1))
+
+    with nogil:
+        j = 1
+        for ax in range(n_ax - 1, -1, -1):
+            strides[ax] = j
+            j *= shape_[ax]
+
+        # link each element to its preceding neighbors
+        for v in range(n_vert):
+            for t in range(start, stop):
+                i = (v * n_t + t) * n_inner
+                for k in range(n_inner):
+                    if bin_[i]:
+                        parent_[i] = i
+                        # first axis
+                        if custom:
+                            for e in range(edge_start_[v], edge_start_[v + 1]):
+                                w = edge_dst_[e]
+                                if w < v:
+                                    j = i - (v - w) * stride_vert
+                                    if bin_[j]:
+                                        uf_union(parent_, i, j)
+                        elif grid_[0] and v > 0:
+                            j = i - stride_vert
+                            if bin_[j]:
+                                uf_union(parent_, i, j)
+                        # second axis (within the chunk)
+                        if n_ax > 1 and grid_[1] and t > start:
+                            j = i - n_inner
+                            if bin_[j]:
+                                uf_union(parent_, i, j)
+                        # remaining axes
+                        for ax in range(2, n_ax):
+                            if grid_[ax]:
+                                coord = (k // strides[ax]) % shape_[ax]
+                                if coord > 0:
+                                    j = i - strides[ax]
+                                    if bin_[j]:
+                                        uf_union(parent_, i, j)
+                    i += 1
+
+    free(strides)
+
 
-                while relabel[label] < label:
-                    label = relabel[label]
+def merge_chunks(np.ndarray[UINT8, ndim=1] bin_map,
+                 np.ndarray[INT64, ndim=1] parent,
+                 np.ndarray[INT64, ndim=1] shape,
+                 np.ndarray[INT64, ndim=1] starts):
+    """Merge components across the boundaries of chunks (see :func:`label_chunk`)
 
-                while relabel[connected_label] < connected_label:
-                    connected_label = relabel[connected_label]
+    Parameters
+    ----------
+    bin_map : array of uint8 (n_elements,)
+        Flat binary map.
+    parent : array of int (n_elements,)
+        Union-find parent of each element (modified in place).
+    shape : array of int
+        Shape of the map.
+    starts : array of int
+        First index on the second axis of each chunk except the first one.
+    """
+    cdef Py_ssize_t v, k, b, i, j, ax
+    cdef Py_ssize_t n_vert = shape[0]
+    cdef Py_ssize_t n_t = shape[1]
+    cdef Py_ssize_t n_inner = 1
+    for ax in range(2, shape.shape[0]):
+        n_inner *= shape[ax]
+    cdef UINT8 *bin_ = <UINT8*> bin_map.data
+    cdef INT64 *parent_ = <INT64*> parent.data
+
+    with nogil:
+        for b in range(starts.shape[0]):
+            for v in range(n_vert):
+                i = (v * n_t + starts[b]) * n_inner
+                for k in range(n_inner):
+                    j = i - n_inner
+                    if bin_[i] and bin_[j]:
+                        uf_union(parent_, i, j)
+                    i += 1
+
+
+def relabel_components(np.ndarray[UINT8, ndim=1] bin_map,
+                       np.ndarray[INT64, ndim=1] parent,
+                       np.ndarray[UINT32, ndim=1] cmap):
+    """Assign consecutive labels to connected components
+
+    Components are numbered in the order of their first element.
+
+    Parameters
+    ----------
+    bin_map : array of uint8 (n_elements,)
+        Flat binary map.
+    parent : array of int (n_elements,)
+        Union-find parent of each element.
+    cmap : array of uint32 (n_elements,)
+        Container for the labels (0 outside of components).
 
-                if label > connected_label:
-                    relabel_src = label
-                    relabel_dst = connected_label
+    Returns
+    -------
+    n : int
+        Number of components.
+    """
+    cdef Py_ssize_t i, root
+    cdef Py_ssize_t n = 0
+    cdef Py_ssize_t n_elements = bin_map.shape[0]
+    cdef UINT8 *bin_ = <UINT8*> bin_map.data
+    cdef INT64 *parent_ = <INT64*> parent.data
+    cdef UINT32 *cmap_ = <UINT32*> cmap.data
+
+    with nogil:
+        for i in range(n_elements):
+            if bin_[i]:
+                # roots are the smallest index of their component
+                root = uf_find(parent_, i)
+                if root == i:
+                    n += 1
+                    cmap_[i] = n
                 else:
-                    relabel_src = connected_label
-                    relabel_dst = label
-
-                relabel[relabel_src] = relabel_dst
-
-    # find lowest labels
-    cdef int n_labels_out = -1
-    for i in range(n_labels_in):
-        relabel_dst = relabel[i]
-        if relabel_dst == i:
-            n_labels_out += 1
-        else:
-            while relabel[relabel_dst] < relabel_dst:
-                relabel_dst = relabel[relabel_dst]
-            relabel[i] = relabel_dst
-
-    # relabel cmap
-    for i in range(n_vert):
-        for slice_i in range(n_slices):
-            label = cmap[i, slice_i]
-            if label != 0:
-                relabel_dst = relabel[label]
-                if relabel_dst != label:
-                    cmap[i, slice_i] = relabel_dst
-
-    # find all label ids in cmap
-    cdef np.ndarray[UINT32, ndim=1] out = np.empty(n_labels_out, dtype=np.uint32)
-    dst_i = 0
-    for i in range(1, n_labels_in):
-        if i == relabel[i]:
-            out[dst_i] = i
-            dst_i += 1
-
-    free(relabel)
-    return out
-
-
-def tfce_increment(np.ndarray[UINT32, ndim=1] labels,
-                   np.ndarray[UINT32, ndim=1] label_image,
-                   np.ndarray[FLOAT64, ndim=1] image,
-                   double e, double h_factor):
-    cdef unsigned int i, cid
-    cdef unsigned int n = image.shape[0]
-    cdef unsigned int n_labels = labels.max() + 1
-
-    cdef double* area = <double*> malloc(sizeof(double) * n_labels)
-
-    # initialize area
-    for i in range(n_labels):
-        area[i] = 0.
-
-    # determine area
-    for i in range(n):
-        cid = label_image[i]
-        if cid > 0:
-            area[cid] += 1.
-
-    # determine TFCE value
-    for cid in labels:
-        area[cid] = area[cid] ** e * h_factor
-
-    # update TFCE image
-    for i in range(n):
-        cid = label_image[i]
-        if cid > 0:
-            image[i] += area[cid]
+                    cmap_[i] = cmap_[root]
+            else:
+                cmap_[i] = 0
+    return n
+
+
+cdef Py_ssize_t find_root(INT64 *parent, double *delta, INT64 *path, Py_ssize_t i) nogil:
+    "Find the root of ``i`` with path compression, preserving the sum of ``delta`` along paths"
+    cdef Py_ssize_t root = i
+    cdef Py_ssize_t n_path = 0
+    cdef double acc = 0
+    while parent[root] != root:
+        path[n_path] = root
+        n_path += 1
+        root = parent[root]
+    while n_path > 0:
+        n_path -= 1
+        i = path[n_path]
+        acc += delta[i]
+        delta[i] = acc
+        parent[i] = root
+    return root
+
+
+cdef inline void flush_root(Py_ssize_t root, Py_ssize_t k, INT64 *since, double *delta,
+                            double *area, double e, double *weight_cumsum) nogil:
+    "Add the contribution of heights above ``k`` to a cluster's ``delta``"
+    if since[root] != k:
+        delta[root] += area[root] ** e * (weight_cumsum[since[root] + 1] - weight_cumsum[k + 1])
+        since[root] = k
+
+
+def tfce_union_find(np.ndarray[FLOAT64, ndim=1] out,
+                    np.ndarray[INT64, ndim=1] order,
+                    np.ndarray[INT64, ndim=1] n_levels,
+                    np.ndarray[FLOAT64, ndim=1] weight_cumsum,
+                    double e,
+                    np.ndarray[INT64, ndim=1] shape,
+                    np.ndarray[INT8, ndim=1] grid,
+                    np.ndarray[INT64, ndim=1] edge_start,
+                    np.ndarray[INT64, ndim=1] edge_dst):
+    """Add the TFCE integral for one tail to ``out``
+
+    Elements are added in order of decreasing height, growing clusters with a
+    union-find structure. The contribution of each cluster is accumulated
+    lazily on the root of the cluster: each time a cluster changes, the
+    contribution of the heights since its last change is added to the root's
+    ``delta``. The TFCE value of an element is the sum of ``delta`` on the
+    path to its root.
+
+    Parameters
+    ----------
+    out : array of float (n_elements,)
+        Flat TFCE map, values are added in place.
+    order : array of int
+        Elements exceeding the lowest height, sorted by decreasing
+        ``n_levels``.
+    n_levels : array of int (n_elements,)
+        For each element, the number of heights at which it is included.
+    weight_cumsum : array of float (n_heights + 1,)
+        Cumulative sum of ``height ** h``, starting with 0.
+    e : scalar
+        Exponent for cluster extent.
+    shape : array of int
+        Shape of the map.
+    grid : array of int8
+        For each axis, whether adjacent elements are connected.
+    edge_start : array of int (n_vertices + 1,)
+        Start of each vertex's edges in ``edge_dst`` (custom connectivity on
+        the first axis; empty for no custom connectivity).
+    edge_dst : array of int
+        Neighbors of each vertex (in both directions).
+    """
+    cdef Py_ssize_t i, j, k, v, u, ax, root_v, root_u, stride, coord, vert, rest
+    cdef Py_ssize_t n = out.shape[0]
+    cdef Py_ssize_t n_ax = shape.shape[0]
+    cdef Py_ssize_t n_order = order.shape[0]
+    cdef Py_ssize_t n_vert = edge_start.shape[0] - 1
+    cdef Py_ssize_t stride_vert = n // shape[0] if n_vert > 0 else 0
+    cdef INT64 *parent = <INT64*> malloc(sizeof(INT64) * n)
+    cdef INT64 *since = <INT64*> malloc(sizeof(INT64) * n)
+    cdef INT64 *path = <INT64*> malloc(sizeof(INT64) * n)
+    cdef INT64 *neighbors = <INT64*> malloc(sizeof(INT64) * (2 * n_ax + max(edge_dst.shape[0], 1)))
+    cdef INT64 *strides = <INT64*> malloc(sizeof(INT64) * n_ax)
+    cdef double *delta = <double*> malloc(sizeof(double) * n)
+    cdef double *area = <double*> malloc(sizeof(double) * n)
+    cdef Py_ssize_t n_neighbors
+
+    with nogil:
+        stride = 1
+        for ax in range(n_ax - 1, -1, -1):
+            strides[ax] = stride
+            stride *= shape[ax]
+
+        for i in range(n_order):
+            v = order[i]
+            parent[v] = -1
+        for i in range(n_order):
+            v = order[i]
+            k = n_levels[v] - 1
+            parent[v] = v
+            delta[v] = 0
+            area[v] = 1
+            since[v] = k
+
+            # collect neighbors
+            n_neighbors = 0
+            for ax in range(n_ax):
+                if grid[ax]:
+                    coord = (v // strides[ax]) % shape[ax]
+                    if coord > 0:
+                        neighbors[n_neighbors] = v - strides[ax]
+                        n_neighbors += 1
+                    if coord < shape[ax] - 1:
+                        neighbors[n_neighbors] = v + strides[ax]
+                        n_neighbors += 1
+            if n_vert > 0:
+                vert = v // stride_vert
+                rest = v % stride_vert
+                for j in range(edge_start[vert], edge_start[vert + 1]):
+                    neighbors[n_neighbors] = edge_dst[j] * stride_vert + rest
+                    n_neighbors += 1
+
+            # merge with active neighbors
+            for j in range(n_neighbors):
+                u = neighbors[j]
+                if n_levels[u] <= k or parent[u] == -1:
+                    continue
+                root_u = find_root(parent, delta, path, u)
+                root_v = find_root(parent, delta, path, v)
+                if root_u == root_v:
+                    continue
+                # add contributions of heights above the current one
+                flush_root(root_u, k, since, delta, area, e, &weight_cumsum[0])
+                flush_root(root_v, k, since, delta, area, e, &weight_cumsum[0])
+                # attach smaller cluster to larger cluster
+                if area[root_v] > area[root_u]:
+                    root_u, root_v = root_v, root_u
+                parent[root_v] = root_u
+                delta[root_v] -= delta[root_u]
+                area[root_u] += area[root_v]
+
+        # add contributions down to the lowest height
+        for i in range(n_order):
+            v = order[i]
+            if parent[v] == v:
+                delta[v] += area[v] ** e * (weight_cumsum[since[v] + 1] - weight_cumsum[0])
+        for i in range(n_order):
+            v = order[i]
+            root_v = find_root(parent, delta, path, v)
+            if root_v == v:
+                out[v] += delta[v]
+            else:
+                out[v] += delta[v] + delta[root_v]
 
+    free(parent)
+    free(since)
+    free(path)
+    free(neighbors)
+    free(strides)
+    free(delta)
     free(area)
@@ -354,7 +354,7 @@ class _NDANOVA(object):
         # find result container
         if self._flat_f_map is None:
             shape = (self.n_effects,) + y.shape[1:]
-            f_map = np.empty(shape)
+            f_map = np.empty(shape, y.dtype)
             flat_f_map = f_map.reshape((self.n_effects, -1))
         else:
             f_map = None
@@ -369,6 +369,44 @@ class _NDANOVA(object):
     def _map(self, y, flat_f_map, perm):
         raise NotImplementedError
 
+    def map_batch(self, y, perms, out):
+        """Fit the model to a block of permutations at once
+
+        Parameters
+        ----------
+        y : np.array (n_cases, n_tests)
+            Dependent measurement.
+        perms : array of int (n_perm, n_cases)
+            Permutation index for each row of ``out`` (as ``perm`` in
+            :meth:`.map`).
+        out : array (n_perm, n_effects, n_tests)
+            Container for the F-maps.
+
+        Returns
+        -------
+        f_maps : array (n_perm, n_effects, n_tests)
+            ``out``.
+
+        Notes
+        -----
+        The model matrix of every permutation is stacked so that regression
+        coefficients for all permutations are computed in a single matrix
+        multiplication. Sums of squares are then computed from the
+        coefficients as ``b' X'X b``, where ``X'X`` is invariant under
+        permutation.
+        """
+        if y.shape[0] != self._n_obs:
+            raise ValueError("y has wrong number of observations (%i, model "
+                             "has %i)" % (y.shape[0], self._n_obs))
+        # All models contain an intercept, so centering y does not affect sums
+        # of squares, but it improves numerical accuracy
+        y = y - y.mean(0)
+        self._map_batch(y, perms, out)
+        return out
+
+    def _map_batch(self, y, perms, out):
+        raise NotImplementedError
+
     def p_maps(self, f_maps):
         """Convert F-maps for uncorrected p-maps
 
@@ -387,7 +425,7 @@ class _NDANOVA(object):
             p_maps[i] = ftest_p(f_maps[i], self.dfs_nom[i], self.dfs_denom[i])
         return p_maps
 
-    def preallocate(self, y_shape):
+    def preallocate(self, y_shape, dtype=np.float64):
         """Pre-allocate an output array container.
 
         Parameters
@@ -395,6 +433,8 @@ class _NDANOVA(object):
         y_shape : tuple
             Data shape (excluding case), will allow preallocation of containers
             for results.
+        dtype : numpy dtype
+            Data type of ``y`` (float64 or float32).
 
         Returns
         -------
@@ -404,7 +444,7 @@ class _NDANOVA(object):
             anything)
         """
         shape = (self.n_effects,) + y_shape
-        f_map = np.empty(shape)
+        f_map = np.empty(shape, dtype)
         self._flat_f_map = f_map.reshape((self.n_effects, -1))
         return f_map
 
@@ -417,6 +457,11 @@ class _BalancedNDANOVA(_NDANOVA):
         self._effect_to_beta = x._effect_to_beta
         self._x_full_perm = None
         self._x_proj_perm = None
+        # X'X for the full model and for each effect (for map_batch)
+        x_full = self.p.x
+        self._g = x_full.T.dot(x_full)
+        self._g_effects = [x_full[:, i:i + df].T.dot(x_full[:, i:i + df])
+                           for i, df in self._effect_to_beta]
 
     def _map(self, y, flat_f_map, perm):
         if perm is None:
@@ -434,6 +479,24 @@ class _BalancedNDANOVA(_NDANOVA):
     def _map_balanced(self, y, flat_f_map, x_full, xsinv):
         raise NotImplementedError
 
+    def _map_batch(self, y, perms, out):
+        zero_var = np.all(y == y[0], 0)
+        # center data to avoid cancellation in residual sums of squares (the
+        # model includes an intercept, so effects are not affected)
+        y = y - y.mean(0)
+        betas = _betas_batch(self.p.projector, y, perms)
+        ms_effects = np.empty((len(self._g_effects),) + out[:, 0].shape, out.dtype)
+        for ms, (i, df), g in zip(ms_effects, self._effect_to_beta, self._g_effects):
+            _ss_batch(betas[:, i:i + df], g, ms)
+            ms /= df
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._map_balanced_batch(y, betas, ms_effects, out)
+        # zero variance
+        out[..., zero_var] = 0
+
+    def _map_balanced_batch(self, y, betas, ms_effects, out):
+        raise NotImplementedError
+
 
 class _BalancedFixedNDANOVA(_BalancedNDANOVA):
     "For balanced but not fully specified models"
@@ -452,6 +515,13 @@ class _BalancedFixedNDANOVA(_BalancedNDANOVA):
         anova_fmaps(y, x_full, xsinv, flat_f_map, self._effect_to_beta,
                     self.df_error)
 
+    def _map_balanced_batch(self, y, betas, ms_effects, out):
+        ms_res = _ss_batch(betas, self._g)
+        np.subtract(np.einsum('ij,ij->j', y, y), ms_res, ms_res)
+        ms_res /= self.df_error
+        for i, ms in enumerate(ms_effects):
+            np.divide(ms, ms_res, out[:, i])
+
 
 class _BalancedMixedNDANOVA(_BalancedNDANOVA):
     """For balanced, fully specified models.
@@ -480,6 +550,15 @@ class _BalancedMixedNDANOVA(_BalancedNDANOVA):
         anova_full_fmaps(y, x_full, xsinv, flat_f_map, self._effect_to_beta,
                          self._e_ms_array)
 
+    def _map_balanced_batch(self, y, betas, ms_effects, out):
+        i_fmap = 0
+        for ms, e_ms in zip(ms_effects, self._e_ms_array):
+            if not e_ms.any():
+                continue
+            ms_denom = ms_effects[e_ms > 0].sum(0)
+            np.divide(ms, ms_denom, out[:, i_fmap])
+            i_fmap += 1
+
 
 class _IncrementalNDANOVA(_NDANOVA):
     def __init__(self, x):
@@ -492,6 +571,7 @@ class _IncrementalNDANOVA(_NDANOVA):
         self._SS_res = None
 
         self._x_orig = {}
+        self._g = {}  # X'X for map_batch
         self._full_ss_i = -1
         for m, i in comparisons.relevant_models:
             if m is None:  # intercept only
@@ -500,26 +580,27 @@ class _IncrementalNDANOVA(_NDANOVA):
             else:
                 p = m._parametrize()
                 self._x_orig[i] = (p.x, p.projector)
+                self._g[i] = p.x.T.dot(p.x)
         if comparisons.mixed and self._full_ss_i == -1:
             # need full SS
             self._x_orig[-1] = None
         self._x_perm = None
 
-    def preallocate(self, y_shape):
-        f_map = _NDANOVA.preallocate(self, y_shape)
+    def preallocate(self, y_shape, dtype=np.float64):
+        f_map = _NDANOVA.preallocate(self, y_shape, dtype)
 
         shape = self._flat_f_map.shape[1]
-        self._SS_diff = np.empty(shape)
-        self._MS_e = np.empty(shape)
-        self._SS_res = {i: np.empty(shape) for i in self._x_orig.keys()}
+        self._SS_diff = np.empty(shape, dtype)
+        self._MS_e = np.empty(shape, dtype)
+        self._SS_res = {i: np.empty(shape, dtype) for i in self._x_orig.keys()}
         return f_map
 
     def _map(self, y, flat_f_map, perm):
         if self._SS_diff is None:
             shape = y.shape[1]
-            SS_diff = MS_diff = np.empty(shape)
-            MS_e = np.empty(shape)
-            SS_res = {i: np.empty(shape) for i in self._x_orig.keys()}
+            SS_diff = MS_diff = np.empty(shape, y.dtype)
+            MS_e = np.empty(shape, y.dtype)
+            SS_res = {i: np.empty(shape, y.dtype) for i in self._x_orig.keys()}
         else:
             SS_diff = MS_diff = self._SS_diff
             MS_e = self._MS_e
@@ -551,7 +632,28 @@ class _IncrementalNDANOVA(_NDANOVA):
                 x_full, xsinv = x
                 lm_res_ss(y, x_full, xsinv, SS_res[i])
 
-        # incremental comparisons
+        self._f_maps(SS_res, flat_f_map, SS_diff, MS_e)
+
+    def _map_batch(self, y, perms, out):
+        # center data to avoid cancellation in residual sums of squares (all
+        # models include an intercept); ss_total is then the residual SS of
+        # the intercept-only model
+        y = y - y.mean(0)
+        ss_total = np.einsum('ij,ij->j', y, y)
+        SS_res = {}
+        for i, x in self._x_orig.items():
+            if x is None:
+                SS_res[i] = np.repeat(ss_total[None], len(perms), 0)
+            else:
+                betas = _betas_batch(x[1], y, perms)
+                SS_res[i] = _ss_batch(betas, self._g[i])
+                np.subtract(ss_total, SS_res[i], SS_res[i])
+        shape = out[:, 0].shape
+        self._f_maps(SS_res, out.swapaxes(0, 1), np.empty(shape, out.dtype), np.empty(shape, out.dtype))
+
+    def _f_maps(self, SS_res, f_maps, SS_diff, MS_e):
+        "F-maps from residual sums of squares of the compared models"
+        MS_diff = SS_diff
         if not self._comparisons.mixed:
             np.divide(SS_res[0], self.x.df_error, MS_e)
         for i, (i_test, (i1, i0)) in enumerate(self._comparisons.comparisons.items()):
@@ -562,7 +664,49 @@ class _IncrementalNDANOVA(_NDANOVA):
             df_diff = self._comparisons.x.effects[i_test].df
             np.subtract(SS_res[i0], SS_res[i1], SS_diff)
             np.divide(SS_diff, df_diff, MS_diff)
-            np.divide(MS_diff, MS_e, flat_f_map[i])
+            np.divide(MS_diff, MS_e, f_maps[i])
+
+
+def _betas_batch(xsinv, y, perms):
+    """Regression coefficients for a block of permutations
+
+    Parameters
+    ----------
+    xsinv : array (n_betas, n_cases)
+        Projector of the model.
+    y : array (n_cases, n_tests)
+        Dependent measurement.
+    perms : array of int (n_perm, n_cases)
+        Permutations of the model.
+
+    Returns
+    -------
+    betas : array (n_perm, n_betas, n_tests)
+        Coefficients for each permutation.
+    """
+    n_perm, n_cases = perms.shape
+    n_betas = xsinv.shape[0]
+    xsinv_perm = xsinv[:, perms].swapaxes(0, 1).reshape((n_perm * n_betas, n_cases))
+    xsinv_perm = xsinv_perm.astype(y.dtype, copy=False)
+    return xsinv_perm.dot(y).reshape((n_perm, n_betas, y.shape[1]))
+
+
+def _ss_batch(betas, g, out=None):
+    """Sum of squares of the prediction ``X b`` computed as ``b' X'X b``
+
+    Parameters
+    ----------
+    betas : array (n_perm, n_betas, n_tests)
+        Coefficients.
+    g : array (n_betas, n_betas)
+        ``X'X`` for the model matrix ``X``.
+    out : array (n_perm, n_tests)
+        Container for output.
+    """
+    g = g.astype(betas.dtype, copy=False)
+    if out is None:
+        return np.einsum('kbm,kbm->km', np.matmul(g, betas), betas)
+    return np.einsum('kbm,kbm->km', np.matmul(g, betas), betas, out=out)
 
 
 def effect_id(effects):
@@ -1,7 +1,10 @@
 # optimized statistics functions
+# Data and output arrays can be float64 or float32; sums are accumulated in
+# double precision.
 #cython: boundscheck=False, wraparound=False
 
 cimport cython
+from cython cimport floating
 from cython.view cimport array as cvarray
 from libc.stdlib cimport malloc, free
 import numpy as np
@@ -12,10 +15,10 @@ ctypedef cnp.int64_t INT64
 ctypedef cnp.float64_t FLOAT64
 
 
-def anova_full_fmaps(cnp.ndarray[FLOAT64, ndim=2] y,
+def anova_full_fmaps(cnp.ndarray[floating, ndim=2] y,
                      cnp.ndarray[FLOAT64, ndim=2] x,
                      cnp.ndarray[FLOAT64, ndim=2] xsinv,
-                     cnp.ndarray[FLOAT64, ndim=2] f_map,
+                     cnp.ndarray[floating, ndim=2] f_map,
                      cnp.ndarray[INT64, ndim=2] effects,
                      cnp.ndarray[INT8, ndim=2] e_ms):
     """Compute f-maps for a balanced, fully specified ANOVA model
@@ -83,10 +86,10 @@ def anova_full_fmaps(cnp.ndarray[FLOAT64, ndim=2] y,
     free(mss)
 
 
-def anova_fmaps(cnp.ndarray[FLOAT64, ndim=2] y,
+def anova_fmaps(cnp.ndarray[floating, ndim=2] y,
                 cnp.ndarray[FLOAT64, ndim=2] x,
                 cnp.ndarray[FLOAT64, ndim=2] xsinv,
-                cnp.ndarray[FLOAT64, ndim=2] f_map,
+                cnp.ndarray[floating, ndim=2] f_map,
                 cnp.ndarray[INT64, ndim=2] effects,
                 int df_res):
     """Compute f-maps for a balanced ANOVA model with residuals
@@ -156,8 +159,8 @@ def anova_fmaps(cnp.ndarray[FLOAT64, ndim=2] y,
     free(betas)
 
 
-def sum_square(cnp.ndarray[FLOAT64, ndim=2] y,
-               cnp.ndarray[FLOAT64, ndim=1] out):
+def sum_square(cnp.ndarray[floating, ndim=2] y,
+               cnp.ndarray[floating, ndim=1] out):
     """Compute the Sum Square of the data
 
     Parameters
@@ -182,8 +185,8 @@ def sum_square(cnp.ndarray[FLOAT64, ndim=2] y,
         out[i] = ss
 
 
-def ss(cnp.ndarray[FLOAT64, ndim=2] y,
-       cnp.ndarray[FLOAT64, ndim=1] out):
+def ss(cnp.ndarray[floating, ndim=2] y,
+       cnp.ndarray[floating, ndim=1] out):
     """Compute sum squares in the data (after subtracting the intercept)
 
     Parameters
@@ -215,7 +218,7 @@ def ss(cnp.ndarray[FLOAT64, ndim=2] y,
         out[i] = ss_
 
 
-cdef int zero_variance(cnp.ndarray[FLOAT64, ndim=2] y,
+cdef int zero_variance(cnp.ndarray[floating, ndim=2] y,
                             unsigned long i):
     """Check whether a column of y has zero variance"""
     cdef unsigned int case
@@ -227,7 +230,7 @@ cdef int zero_variance(cnp.ndarray[FLOAT64, ndim=2] y,
     return 1
 
 
-cdef void _lm_betas(cnp.ndarray[FLOAT64, ndim=2] y,
+cdef void _lm_betas(cnp.ndarray[floating, ndim=2] y,
                     unsigned long i,
                     cnp.ndarray[FLOAT64, ndim=2] xsinv,
                     double *betas):
@@ -262,7 +265,7 @@ cdef void _lm_betas(cnp.ndarray[FLOAT64, ndim=2] y,
         betas[i_beta] = beta
 
 
-cdef double _lm_res_ss(cnp.ndarray[FLOAT64, ndim=2] y,
+cdef double _lm_res_ss(cnp.ndarray[floating, ndim=2] y,
                        int i,
                        cnp.ndarray[FLOAT64, ndim=2] x,
                        int df_x,
@@ -366,10 +369,10 @@ def lm_res(cnp.ndarray[FLOAT64, ndim=2] y,
     free(betas)
 
 
-def lm_res_ss(cnp.ndarray[FLOAT64, ndim=2] y,
+def lm_res_ss(cnp.ndarray[floating, ndim=2] y,
               cnp.ndarray[FLOAT64, ndim=2] x,
               cnp.ndarray[FLOAT64, ndim=2] xsinv,
-              cnp.ndarray[FLOAT64, ndim=1] ss):
+              cnp.ndarray[floating, ndim=1] ss):
     """Fit a linear model and compute the residual sum squares
 
     Parameters
@@ -397,8 +400,8 @@ def lm_res_ss(cnp.ndarray[FLOAT64, ndim=2] y,
     free(betas)
 
 
-def t_1samp(cnp.ndarray[FLOAT64, ndim=2] y,
-            cnp.ndarray[FLOAT64, ndim=1] out):
+def t_1samp(cnp.ndarray[floating, ndim=2] y,
+            cnp.ndarray[floating, ndim=1] out):
     """T-values for 1-sample t-test
 
     Parameters
@@ -435,8 +438,8 @@ def t_1samp(cnp.ndarray[FLOAT64, ndim=2] y,
             out[i] = 0
 
 
-def t_1samp_perm(cnp.ndarray[FLOAT64, ndim=2] y,
-                 cnp.ndarray[FLOAT64, ndim=1] out, 
+def t_1samp_perm(cnp.ndarray[floating, ndim=2] y,
+                 cnp.ndarray[floating, ndim=1] out, 
                  cnp.ndarray[INT8, ndim=1] sign):
     """T-values for 1-sample t-test
 
@@ -478,8 +481,8 @@ def t_1samp_perm(cnp.ndarray[FLOAT64, ndim=2] y,
             out[i] = 0
 
 
-def t_ind(cnp.ndarray[FLOAT64, ndim=2] y,
-          cnp.ndarray[FLOAT64, ndim=1] out,
+def t_ind(cnp.ndarray[floating, ndim=2] y,
+          cnp.ndarray[floating, ndim=1] out,
           cnp.ndarray[INT8, ndim=1] group):
     "Indpendent-samples t-test, assuming equal variance"
     cdef unsigned long i, case
@@ -527,7 +530,7 @@ def t_ind(cnp.ndarray[FLOAT64, ndim=2] y,
         out[i] = (mean1 - mean0) / (var * var_mult) ** 0.5
 
 
-def has_zero_variance(cnp.ndarray[FLOAT64, ndim=2] y):
+def has_zero_variance(cnp.ndarray[floating, ndim=2] y):
     "True if any data-columns have zero variance"
     cdef double value
     cdef unsigned long case, i
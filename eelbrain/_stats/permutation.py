@@ -1,17 +1,29 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
-from itertools import repeat
-from math import ceil
+from math import ceil, log
 import random
 
 import numpy as np
 
 from .._data_obj import NDVar, Var, NestedEffect
 from .._utils import intervals
+from .permutation_opt import permute_order_block
 
 
 _YIELD_ORIGINAL = 0
 # for testing purposes, yield original order instead of permutations
 
+# default number of permutations per block
+BLOCK_SIZE = 1000
+# maximum number of permutations for adaptive tests (``samples='adaptive'``)
+ADAPTIVE_MAX_SAMPLES = 10000
+
+
+def _max_samples(samples):
+    "Number of permutations to generate for a ``samples`` parameter"
+    if samples == 'adaptive':
+        return ADAPTIVE_MAX_SAMPLES
+    return int(samples)
+
 
 def _resample_params(N, samples):
     """Decide whether to do permutations or random resampling
@@ -20,21 +32,23 @@ def _resample_params(N, samples):
     ----------
     N : int
         Number of observations.
-    samples : int
+    samples : int | 'adaptive'
         ``samples`` parameter (number of resampling iterations, or < 0 to
         sample all permutations).
 
     Returns
     -------
-    actual_n_samples : int
+    actual_n_samples : int | 'adaptive'
         Adapted number of resamplings that will be done.
-    samples_param : int
+    samples_param : int | 'adaptive'
         Samples parameter for the resample function (-1 to do all permutations,
         otherwise same as n_samples).
     """
     n_perm = 2 ** N
-    if n_perm - 1 <= samples:
+    if n_perm - 1 <= _max_samples(samples):
         samples = -1
+    elif samples == 'adaptive':
+        return samples, samples
 
     if samples < 0:
         n_samples = n_perm - 1
@@ -76,42 +90,102 @@ def permute_order(n, samples=10000, replacement=False, unit=None, seed=0):
         err = "Complete permutation for resampling through reordering"
         raise NotImplementedError(err)
 
-    if _YIELD_ORIGINAL:
-        original = np.arange(n)
+    if replacement and not _YIELD_ORIGINAL:
+        if unit is not None and unit is not False:
+            raise NotImplementedError("Replacement and units")
+        if seed is not None:
+            np.random.seed(seed)
         for _ in range(samples):
-            yield original
+            yield np.random.randint(n, n)
+        return
+
+    for block in permute_order_blocks(n, samples, unit, seed):
+        yield from block
+
+
+def permute_order_blocks(n, samples=10000, unit=None, seed=0,
+                         block_size=BLOCK_SIZE):
+    """Generate blocks of indices to shuffle n items
+
+    Yields the same permutations as :func:`permute_order` (without
+    replacement), but stacked in 2-dimensional arrays.
+
+    Parameters
+    ----------
+    n : int
+        Number of cases.
+    samples : int | 'adaptive'
+        Number of samples to yield (``'adaptive'`` for the maximum number of
+        samples of an adaptive test).
+    unit : categorial
+        Factor specifying unit of measurement (e.g. subject). If unit is
+        specified, values are shuffled within units only.
+    seed : None | int
+        Seed the random state of :mod:`numpy.random` to make replication
+        possible. None to skip seeding (default 0).
+    block_size : int
+        Maximum number of permutations per block.
+
+    Yields
+    ------
+    index : array of int  (n_perm, n)
+        Block of permutations (``n_perm <= block_size``; the same array object
+        may be reused in subsequent iterations).
+    """
+    n = int(n)
+    samples = _max_samples(samples)
+    if samples < 0:
+        err = "Complete permutation for resampling through reordering"
+        raise NotImplementedError(err)
+    block_size = max(1, min(samples, block_size))
+
+    if _YIELD_ORIGINAL:
+        block = np.tile(np.arange(n), (block_size, 1))
+        for start, stop in _block_intervals(samples, block_size):
+            yield block[:stop - start]
         return
 
     if seed is not None:
         np.random.seed(seed)
 
+    index = np.arange(n)
+    empty = np.empty(0, np.int64)
     if unit is None or unit is False:
-        if replacement:
-            for _ in range(samples):
-                yield np.random.randint(n, n)
-        else:
-            index = np.arange(n)
-            for _ in range(samples):
-                np.random.shuffle(index)
-                yield index
+        unit_flat = unit_start = unit_order = empty
+        n_draws = n - 1
     else:
-        if replacement:
-            raise NotImplementedError("Replacement and units")
-        idx_orig = np.arange(n)
-        idx_perm = np.empty_like(idx_orig)
         unit_idxs = [np.flatnonzero(unit == cell) for cell in unit.cells]
+        unit_flat = np.concatenate(unit_idxs).astype(np.int64)
+        unit_start = np.cumsum([0] + [len(idx) for idx in unit_idxs], dtype=np.int64)
         if isinstance(unit, NestedEffect):
-            dst_idxs_iter = ((unit_idxs[i] for i in order)
-                             for order in permute_order(len(unit_idxs), samples, seed=None))
+            unit_order = np.arange(len(unit_idxs))
         else:
-            dst_idxs_iter = repeat(unit_idxs, samples)
-
-        for dst_idxs in dst_idxs_iter:
-            for src, dst in zip(unit_idxs, dst_idxs):
-                v = idx_orig[src]
-                np.random.shuffle(v)
-                idx_perm[dst] = v
-            yield idx_perm
+            unit_order = empty
+        n_draws = n + len(unit_order) - len(unit_idxs)
+
+    # Draw raw random values in chunks, then rewind the random state to
+    # exactly the values consumed by completed permutations
+    out = np.empty((block_size, n), np.int64)
+    for start, stop in _block_intervals(samples, block_size):
+        block = out[:stop - start]
+        i = 0
+        factor = 2  # rejection sampling needs < 2 draws per value on average
+        while i < len(block):
+            state = np.random.get_state()
+            n_raw = factor * n_draws * (len(block) - i) + 10
+            raw = np.random.randint(0, 2 ** 32, n_raw, np.uint32)
+            n_done, n_used = permute_order_block(raw, block[i:], index, unit_flat, unit_start, unit_order)
+            if n_used < n_raw:
+                np.random.set_state(state)
+                np.random.randint(0, 2 ** 32, n_used, np.uint32)
+            i += n_done
+            factor *= 2
+        yield block
+
+
+def _block_intervals(samples, block_size):
+    "(start, stop) of consecutive blocks"
+    return intervals(list(range(0, samples, block_size)) + [samples])
 
 
 def permute_sign_flip(n, samples=10000, seed=0, out=None):
@@ -137,39 +211,102 @@ def permute_sign_flip(n, samples=10000, seed=0, out=None):
         but its content modified in every iteration).
     """
     n = int(n)
-    if seed is not None:
-        random.seed(seed)
-
     if out is None:
         out = np.empty(n, np.int8)
     else:
         assert out.shape == (n,)
 
-    if n > 62:  # Python 2 limit for xrange
+    for block in permute_sign_flip_blocks(n, samples, seed):
+        for sign in block:
+            out[:] = sign
+            yield out
+
+
+def permute_sign_flip_blocks(n, samples=10000, seed=0, block_size=BLOCK_SIZE):
+    """Generate blocks of sign flips
+
+    Yields the same sign flips as :func:`permute_sign_flip`, but stacked in
+    2-dimensional arrays.
+
+    Parameters
+    ----------
+    n : int
+        Number of cases.
+    samples : int | 'adaptive'
+        Number of samples to yield. If < 0, all possible permutations are
+        performed (``'adaptive'`` for the maximum number of samples of an
+        adaptive test).
+    seed : None | int
+        Seed the random state of the :mod:`random` module to make replication
+        possible. ``None`` to skip seeding (default 0).
+    block_size : int
+        Maximum number of permutations per block.
+
+    Yields
+    ------
+    sign : array of int8  (n_perm, n)
+        Sign for each case (``1`` or ``-1``; the same array object may be
+        reused in subsequent iterations).
+    """
+    n = int(n)
+    samples = _max_samples(samples)
+    if seed is not None:
+        random.seed(seed)
+
+    # Each group of up to 62 cases is encoded as a sequence of int64
+    if n > 62:
         if samples < 0:
             raise NotImplementedError("All possibilities for more than 62 cases")
         n_groups = ceil(n / 62.)
         group_size = int(ceil(n / n_groups))
-        out_parts = list(range(0, n, group_size)) + [n]
-        for _ in zip(*(permute_sign_flip(stop - start, samples, None, out[start: stop])
-                       for start, stop in intervals(out_parts))):
-            yield out
-        return
+        groups = tuple(intervals(list(range(0, n, group_size)) + [n]))
+    else:
+        groups = ((0, n),)
 
-    # determine possible number of permutations
-    n_perm_possible = 2 ** n
     if samples < 0:
         # do all permutations
-        sample_sequences = range(1, n_perm_possible)
+        sequences = [np.arange(1, 2 ** n, dtype=np.int64)]
     else:
         # random resampling
-        sample_sequences = random.sample(range(1, n_perm_possible), samples)
+        sequences = [np.array(random.sample(range(1, 2 ** (stop - start)), samples), np.int64)
+                     for start, stop in groups]
+
+    n_samples = len(sequences[0])
+    block_size = max(1, min(n_samples, block_size))
+    out = np.empty((block_size, n), np.int8)
+    bits = [np.arange(stop - start, dtype=np.int64) for start, stop in groups]
+    for start, stop in _block_intervals(n_samples, block_size):
+        block = out[:stop - start]
+        for (i0, i1), seqs, bits_ in zip(groups, sequences, bits):
+            flip = (seqs[start:stop, None] >> bits_) & 1
+            np.subtract(1, 2 * flip, block[:, i0:i1], casting='unsafe')
+        yield block
+
+
+def sign_flip_sampling(n, samples):
+    """Algorithm used for drawing the sign flips of :func:`permute_sign_flip`
+
+    Sign flips are drawn with :func:`random.sample`, which uses one of two
+    algorithms depending on the number of samples. With the same algorithm,
+    the first permutations of a test with fewer samples are the same as those
+    of a test with more samples, which is required for extending a permutation
+    distribution.
 
-    for seq in sample_sequences:
-        out.fill(1)
-        for i in (i for i, s in enumerate(bin(seq)[-1:1:-1]) if s == '1'):
-            out[i] = -1
-        yield out
+    Returns
+    -------
+    sampling : str
+        ``'all'`` (all permutations), ``'pool'`` or ``'set'``.
+    """
+    samples = _max_samples(samples)
+    if samples < 0:
+        return 'all'
+    n = min(int(n), 62)  # groups for n > 62 have more than 2 ** 31 members
+    population = 2 ** n - 1
+    # same criterion as random.sample()
+    setsize = 21
+    if samples > 5:
+        setsize += 4 ** ceil(log(samples * 3, 4))
+    return 'pool' if population <= setsize else 'set'
 
 
 def resample(y, samples=10000, replacement=False, unit=None, seed=0):
@@ -220,8 +357,9 @@ def random_seeds(samples, seed=0):
 
     Parameters
     ----------
-    samples : int
-        Number of samples to yield.
+    samples : int | 'adaptive'
+        Number of samples to yield (``'adaptive'`` for the maximum number of
+        samples of an adaptive test).
     seed : None | int
         Seed the random state of the :mod:`random` module to make replication
         possible. ``None`` to skip seeding (default 0).
@@ -234,4 +372,4 @@ def random_seeds(samples, seed=0):
     """
     if seed is not None:
         np.random.seed(seed)
-    return np.random.randint(2**32, size=samples, dtype=np.uint32)
+    return np.random.randint(2**32, size=_max_samples(samples), dtype=np.uint32)
@@ -0,0 +1,127 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+#cython: boundscheck=False, wraparound=False
+"""Generate blocks of permutations
+
+Shuffling is done with the same algorithm as :func:`numpy.random.shuffle`
+(Fisher-Yates with masked rejection sampling), operating on raw 32 bit values
+drawn from :mod:`numpy.random`, so that permutations are identical to calling
+:func:`numpy.random.shuffle` in a loop.
+"""
+from libc.stdlib cimport malloc, free
+import numpy as np
+cimport numpy as np
+
+
+ctypedef np.uint32_t UINT32
+ctypedef np.int64_t INT64
+
+
+cdef int shuffle(INT64 *x, Py_ssize_t n, UINT32[:] raw, Py_ssize_t *pos) nogil:
+    "Shuffle ``x`` in place; return 1 if ``raw`` is exhausted"
+    cdef Py_ssize_t i
+    cdef unsigned long mask, j
+    cdef INT64 tmp
+    for i in range(n - 1, 0, -1):
+        mask = i
+        mask |= mask >> 1
+        mask |= mask >> 2
+        mask |= mask >> 4
+        mask |= mask >> 8
+        mask |= mask >> 16
+        while True:
+            if pos[0] >= raw.shape[0]:
+                return 1
+            j = raw[pos[0]] & mask
+            pos[0] += 1
+            if j <= i:
+                break
+        tmp = x[i]
+        x[i] = x[j]
+        x[j] = tmp
+    return 0
+
+
+def permute_order_block(UINT32[:] raw,
+                        INT64[:, :] out,
+                        INT64[:] index,
+                        INT64[:] unit_flat,
+                        INT64[:] unit_start,
+                        INT64[:] unit_order):
+    """Fill ``out`` with permutations
+
+    Parameters
+    ----------
+    raw : array of uint32
+        Raw values from the random number generator.
+    out : array of int (n_perm, n_cases)
+        Container for the permutations.
+    index : array of int (n_cases,)
+        Without units: state of the cumulative shuffle (modified in place).
+    unit_flat : array of int (n_cases,)
+        Concatenated indexes of all units (empty to permute without units).
+    unit_start : array of int (n_units + 1,)
+        Start of each unit in ``unit_flat`` (and end of the last unit).
+    unit_order : array of int (n_units,)
+        For nested units: state of the cumulative shuffle of units (modified in
+        place; empty for non-nested units).
+
+    Returns
+    -------
+    n_done : int
+        Number of permutations completed before ``raw`` was exhausted.
+    n_used : int
+        Number of values from ``raw`` consumed by the completed permutations.
+    """
+    cdef Py_ssize_t i, k, u, src, dst, n
+    cdef Py_ssize_t pos = 0
+    cdef Py_ssize_t pos_done = 0
+    cdef Py_ssize_t n_perm = out.shape[0]
+    cdef Py_ssize_t n_cases = out.shape[1]
+    cdef Py_ssize_t n_units = unit_start.shape[0] - 1
+    cdef Py_ssize_t n_order = unit_order.shape[0]
+    cdef INT64 *buf = <INT64*> malloc(sizeof(INT64) * n_cases)
+    cdef INT64 *order = <INT64*> malloc(sizeof(INT64) * (n_order + 1))
+
+    with nogil:
+        for k in range(n_perm):
+            if unit_flat.shape[0] == 0:
+                for i in range(n_cases):
+                    buf[i] = index[i]
+                if shuffle(buf, n_cases, raw, &pos):
+                    break
+                for i in range(n_cases):
+                    index[i] = buf[i]
+                    out[k, i] = buf[i]
+            else:
+                for u in range(n_order):
+                    order[u] = unit_order[u]
+                if shuffle(order, n_order, raw, &pos):
+                    break
+                for u in range(n_units):
+                    src = unit_start[u]
+                    n = unit_start[u + 1] - src
+                    for i in range(n):
+                        buf[src + i] = unit_flat[src + i]
+                    if shuffle(buf + src, n, raw, &pos):
+                        break
+                else:
+                    for u in range(n_units):
+                        src = unit_start[u]
+                        if n_order:
+                            dst = unit_start[order[u]]
+                        else:
+                            dst = src
+                        for i in range(unit_start[u + 1] - src):
+                            out[k, unit_flat[dst + i]] = buf[src + i]
+                    for u in range(n_order):
+                        unit_order[u] = order[u]
+                    pos_done = pos
+                    continue
+                break
+            pos_done = pos
+        else:
+            k = n_perm
+
+    free(buf)
+    free(order)
+    return k, pos_done
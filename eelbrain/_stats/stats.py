@@ -85,6 +85,32 @@ def corr(y, x, out=None, perm=None):
     return out
 
 
+def corr_batch(y, x, out, perms):
+    """Correlation parameter maps for a block of permutations
+
+    Parameters
+    ----------
+    y : array, shape = (n_cases, n_tests)
+        Dependent variable with case in the first axis and case mean zero.
+    x : array, shape = (n_cases, )
+        Covariate.
+    out : array, shape = (n_perm, n_tests)
+        Container for output.
+    perms : array of int, shape = (n_perm, n_cases)
+        Permutation index for each row of ``out`` (as ``perm`` in
+        :func:`corr`).
+    """
+    n = len(x)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z_y = scipy.stats.zscore(y, ddof=1)
+    np.nan_to_num(z_y, copy=False)
+    z_x = scipy.stats.zscore(x, ddof=1).astype(y.dtype, copy=False)
+    np.dot(z_x[perms], z_y, out)
+    out /= n - 1
+    np.nan_to_num(out, copy=False)
+    return out
+
+
 def lm_betas_se_1d(y, b, p):
     """Regression coefficient standard errors
 
@@ -308,6 +334,96 @@ def t_ind(y, group, out=None, perm=None):
     return out
 
 
+def t_1samp_perm_batch(y, out, signs):
+    """T-values for a block of sign-flip permutations
+
+    Parameters
+    ----------
+    y : array, shape = (n_cases, n_tests)
+        Dependent measurement.
+    out : array, shape = (n_perm, n_tests)
+        Container for output.
+    signs : array of int8, shape = (n_perm, n_cases)
+        Sign of each case in each permutation.
+
+    Notes
+    -----
+    The means for all permutations are computed with a single matrix
+    multiplication. To avoid cancellation in the variance when the data have
+    a large offset, the data are centered first (``y = c + e``); the sum of
+    squares of the sign-flipped data around their mean is then::
+
+        SS = ss(e) - n q**2 + n c**2 (1 - sbar**2) + 2 n c (mean(e) - sbar q)
+
+    with ``sbar`` the mean of the signs and ``q = mean(sign * e)``.
+    """
+    n_cases = len(y)
+    c = y.mean(0)
+    e = y - c
+    e_mean = e.mean(0)
+    ss = np.einsum('ij,ij->j', e, e)
+    # sign statistics are computed exactly from the number of negative signs
+    n_neg = np.count_nonzero(signs < 0, 1)[:, None]
+    sbar = ((n_cases - 2 * n_neg) / n_cases).astype(y.dtype)
+    sbar_var = (4 * n_neg * (n_cases - n_neg) / n_cases ** 2).astype(y.dtype)
+    q = np.dot(signs.astype(y.dtype), e)
+    q /= n_cases
+    # SS around the sign-flipped mean
+    var = sbar * q
+    np.subtract(e_mean, var, var)
+    var *= 2 * c
+    var += sbar_var * c ** 2
+    var -= q ** 2
+    var *= n_cases
+    var += ss
+    np.maximum(var, 0, var)
+    # sign-flipped mean
+    mean = np.multiply(sbar, c, out)
+    mean += q
+    var /= (n_cases - 1) * n_cases
+    np.sqrt(var, var)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.divide(mean, var, out)
+    out[var == 0] = 0
+    return out
+
+
+def t_ind_batch(y, group, out, perms):
+    """T-values for independent samples t-test for a block of permutations
+
+    Parameters
+    ----------
+    y : array, shape = (n_cases, n_tests)
+        Dependent measurement.
+    group : array of int8, shape = (n_cases,)
+        Group membership (1 for the first group, 0 for the second group).
+    out : array, shape = (n_perm, n_tests)
+        Container for output.
+    perms : array of int, shape = (n_perm, n_cases)
+        Permutation index for each row of ``out`` (as ``perm`` in
+        :func:`t_ind`).
+    """
+    n_cases = len(y)
+    n1 = np.count_nonzero(group)
+    n0 = n_cases - n1
+    zero_var = np.all(y == y[0], 0)
+    # center data for numerical stability
+    y = y - y.mean(0)
+    ss = np.einsum('ij,ij->j', y, y)
+    sum1 = np.dot(group[perms].astype(y.dtype), y)
+    # sum0 = -sum1 because y is centered
+    var = ss - sum1 ** 2 * (1. / n1 + 1. / n0)
+    np.maximum(var, 0, var)
+    var *= (1. / n0 + 1. / n1) / (n_cases - 2)
+    np.sqrt(var, var)
+    np.multiply(sum1, 1. / n1 + 1. / n0, out)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out /= var
+    out[var == 0] = 0
+    out[:, zero_var] = 0
+    return out
+
+
 def ftest_f(p, df_num, df_den):
     "F values for given probabilities."
     p = np.asanyarray(p)
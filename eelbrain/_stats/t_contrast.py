@@ -55,7 +55,7 @@ class TContrastRel(object):
 
     def map(self, y):
         "Apply contrast without retainig data buffers"
-        buff = np.empty((self._n_buffers,) + y.shape[1:])
+        buff = np.empty((self._n_buffers,) + y.shape[1:], y.dtype)
         data = _t_contrast_rel_data(y, self.indexes, self._pcells, self._mcells)
         tmap = _t_contrast_rel(self._ast, data, buff)
         return tmap
@@ -64,7 +64,7 @@ class TContrastRel(object):
         "Apply contrast to permutation of the data, storing and recycling data buffers"
         buffer_shape = (self._n_buffers,) + y.shape[1:]
         if self._buffer_shape != buffer_shape:
-            self._buffer = np.empty(buffer_shape)
+            self._buffer = np.empty(buffer_shape, y.dtype)
             self._y_perm = np.empty_like(y)
             self._buffer_shape = buffer_shape
         self._y_perm[perm] = y
@@ -21,15 +21,14 @@ n_samples : None | int
     number of permutations that constitute the complete set.
 '''
 from datetime import datetime, timedelta
+import hashlib
 from itertools import chain, repeat
 from math import ceil, pi
-from multiprocessing import Process, Event, SimpleQueue
-from multiprocessing.sharedctypes import RawArray
 import logging
 import operator
 import os
+import pickle
 import re
-import signal
 import socket
 from time import time as current_time
 from warnings import warn
@@ -37,7 +36,7 @@ from warnings import warn
 import numpy as np
 import scipy.stats
 from scipy import ndimage
-from tqdm import trange
+from tqdm import tqdm
 
 from .. import fmtxt, _info
 from .._celltable import Celltable
@@ -51,12 +50,14 @@ from .._exceptions import OldVersionError, ZeroVariance
 from .._report import enumeration, format_timewindow, ms
 from .._utils import LazyProperty, user_activity
 from .._utils.numpy_utils import FULL_AXIS_SLICE
+from .._utils.parallel import SharedArray, get_thread_pool, parallel_map, thread_count
 from . import opt, stats, vector
 from .connectivity import Connectivity, find_peaks
-from .connectivity_opt import merge_labels, tfce_increment
+from .connectivity_opt import label_chunk, merge_chunks, relabel_components, tfce_union_find
 from .glm import _nd_anova
 from .permutation import (
-    _resample_params, permute_order, permute_sign_flip, random_seeds)
+    ADAPTIVE_MAX_SAMPLES, _max_samples, _resample_params, permute_order_blocks,
+    permute_sign_flip_blocks, random_seeds, sign_flip_sampling)
 from .t_contrast import TContrastRel
 from .test import star, star_factor
 from functools import reduce
@@ -64,6 +65,15 @@ from functools import reduce
 
 __test__ = False
 
+# Approximate number of values in the stat-map buffers of batched permutations
+PERMUTATION_BATCH_BUFFER = 2 ** 21
+# Maximum number of permutations per job sent to worker processes
+PERMUTATION_JOB_SIZE = 100
+# Minimum interval (in seconds) between saving permutation checkpoints
+CHECKPOINT_INTERVAL = 60
+# Minimum number of elements for labeling clusters in multiple threads
+PARALLEL_LABEL_SIZE = 2 ** 17
+
 
 def check_variance(x):
     if x.ndim != 2:
@@ -326,6 +336,8 @@ class NDTest(object):
         # n samples
         if self.samples == -1:
             l.add_item("In all %s possible permutations" % self.n_samples)
+        elif self.samples == 'adaptive':
+            l.add_item("In %s random permutations (adaptive)" % self.n_samples)
         else:
             l.add_item("In %s random permutations" % self.samples)
 
@@ -337,7 +349,7 @@ class NDTest(object):
 
     @property
     def n_samples(self):
-        if self.samples == -1:
+        if self.samples == -1 or self.samples == 'adaptive':
             return self._first_cdist.samples
         else:
             return self.samples
@@ -373,8 +385,11 @@ class t_contrast_rel(NDTest):
         0: both (two-tailed);
         1: upper tail (one-tailed);
         -1: lower tail (one-tailed).
-    samples : int
-        Number of samples for permutation test (default 0).
+    samples : int | 'adaptive'
+        Number of samples for permutation test (default 0). With
+        ``'adaptive'``, permutations stop as soon as all p-values are
+        clearly above or below 0.05 (at most 10000 permutations; see the
+        ``adaptive_*`` options in :func:`configure`).
     pmin : None | scalar (0 < pmin < 1)
         Threshold for forming clusters:  use a t-value equivalent to an
         uncorrected p-value for a related samples t-test (with df =
@@ -396,6 +411,11 @@ class t_contrast_rel(NDTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    checkpoint : str
+        Path for saving the permutation distribution periodically while it is
+        computed. If the file exists and matches the test, the permutations
+        saved in it are reused, so that an interrupted test can be resumed,
+        or a test can be extended to more samples.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -439,7 +459,8 @@ class t_contrast_rel(NDTest):
     @user_activity
     def __init__(self, y, x, contrast, match=None, sub=None, ds=None, tail=0,
                  samples=0, pmin=None, tmin=None, tfce=False, tstart=None,
-                 tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstop=None, parc=None, force_permutation=False, checkpoint=None,
+                 **criteria):
         if match is None:
             raise TypeError("The `match` parameter needs to be specified for "
                             "repeated measures test t_contrast_rel")
@@ -469,10 +490,10 @@ class t_contrast_rel(NDTest):
 
             cdist = NDPermutationDistribution(
                 ct.y, samples, threshold, tfce, tail, 't', "t-contrast",
-                tstart, tstop, criteria, parc, force_permutation)
+                tstart, tstop, criteria, parc, force_permutation, checkpoint)
             cdist.add_original(tmap)
             if cdist.do_permutation:
-                iterator = permute_order(len(ct.y), samples, unit=ct.match)
+                iterator = permute_order_blocks(len(ct.y), samples, unit=ct.match, seed=cdist.seed)
                 run_permutation(t_contrast, cdist, iterator)
 
         # NDVar map of t-values
@@ -525,8 +546,11 @@ class corr(NDTest):
     ds : None | Dataset
         If a Dataset is specified, all data-objects can be specified as
         names of Dataset variables.
-    samples : int
-        Number of samples for permutation test (default 0).
+    samples : int | 'adaptive'
+        Number of samples for permutation test (default 0). With
+        ``'adaptive'``, permutations stop as soon as all p-values are
+        clearly above or below 0.05 (at most 10000 permutations; see the
+        ``adaptive_*`` options in :func:`configure`).
     pmin : None | scalar (0 < pmin < 1)
         Threshold for forming clusters:  use an r-value equivalent to an
         uncorrected p-value.
@@ -548,6 +572,11 @@ class corr(NDTest):
         Collect permutation extrema for all regions of the parcellation of
         this dimension. For threshold-based test, the regions are
         disconnected.
+    checkpoint : str
+        Path for saving the permutation distribution periodically while it is
+        computed. If the file exists and matches the test, the permutations
+        saved in it are reused, so that an interrupted test can be resumed,
+        or a test can be extended to more samples.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -573,7 +602,7 @@ class corr(NDTest):
     @user_activity
     def __init__(self, y, x, norm=None, sub=None, ds=None, samples=0,
                  pmin=None, rmin=None, tfce=False, tstart=None, tstop=None,
-                 match=None, parc=None, **criteria):
+                 match=None, parc=None, checkpoint=None, **criteria):
         sub = assub(sub, ds)
         y = asndvar(y, sub=sub, ds=ds, dtype=np.float64)
         if not y.has_case:
@@ -620,11 +649,12 @@ class corr(NDTest):
 
             cdist = NDPermutationDistribution(
                 y, samples, threshold, tfce, 0, 'r', name,
-                tstart, tstop, criteria, parc)
+                tstart, tstop, criteria, parc, checkpoint=checkpoint)
             cdist.add_original(rmap)
             if cdist.do_permutation:
-                iterator = permute_order(n, samples, unit=match)
-                run_permutation(stats.corr, cdist, iterator, x.x)
+                iterator = permute_order_blocks(n, samples, unit=match, seed=cdist.seed)
+                run_permutation(stats.corr, cdist, iterator, x.x,
+                                batch_func=stats.corr_batch)
 
         # compile results
         info = _info.for_stat_map('r', threshold)
@@ -693,8 +723,14 @@ class ttest_1samp(NDTest):
         0: both (two-tailed);
         1: upper tail (one-tailed);
         -1: lower tail (one-tailed).
-    samples : int
-        Number of samples for permutation test (default 0).
+    samples : int | 'adaptive'
+        Number of samples for permutation test (default 0). With
+        ``'adaptive'``, permutations stop as soon as all p-values are
+        clearly above or below 0.05 (at most 10000 permutations; see the
+        ``adaptive_*`` options in :func:`configure`). With 16 or fewer
+        cases, the sign flips of an adaptive test are drawn for the maximum
+        number of permutations, and a test with ``samples=n_samples`` may
+        draw different sign flips (``samples=10000`` reproduces them).
     pmin : None | scalar (0 < pmin < 1)
         Threshold for forming clusters:  use a t-value equivalent to an
         uncorrected p-value.
@@ -715,6 +751,11 @@ class ttest_1samp(NDTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    checkpoint : str
+        Path for saving the permutation distribution periodically while it is
+        computed. If the file exists and matches the test, the permutations
+        saved in it are reused, so that an interrupted test can be resumed,
+        or a test can be extended to more samples.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -748,7 +789,8 @@ class ttest_1samp(NDTest):
     @user_activity
     def __init__(self, y, popmean=0, match=None, sub=None, ds=None, tail=0,
                  samples=0, pmin=None, tmin=None, tfce=False, tstart=None,
-                 tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstop=None, parc=None, force_permutation=False, checkpoint=None,
+                 **criteria):
         ct = Celltable(y, match=match, sub=sub, ds=ds, coercion=asndvar,
                        dtype=np.float64)
 
@@ -784,11 +826,13 @@ class ttest_1samp(NDTest):
             n_samples, samples = _resample_params(len(y_perm), samples)
             cdist = NDPermutationDistribution(
                 y_perm, n_samples, threshold, tfce, tail, 't', '1-Sample t-Test',
-                tstart, tstop, criteria, parc, force_permutation)
+                tstart, tstop, criteria, parc, force_permutation, checkpoint)
             cdist.add_original(tmap)
             if cdist.do_permutation:
-                iterator = permute_sign_flip(n, samples)
-                run_permutation(opt.t_1samp_perm, cdist, iterator)
+                cdist.sampling = sign_flip_sampling(n, samples)
+                iterator = permute_sign_flip_blocks(n, samples, cdist.seed)
+                run_permutation(opt.t_1samp_perm, cdist, iterator,
+                                batch_func=stats.t_1samp_perm_batch)
 
         # NDVar map of t-values
         info = _info.for_stat_map('t', threshold, tail=tail, old=ct.y.info)
@@ -872,8 +916,11 @@ class ttest_ind(NDTest):
         0: both (two-tailed);
         1: upper tail (one-tailed);
         -1: lower tail (one-tailed).
-    samples : int
-        Number of samples for permutation test (default 0).
+    samples : int | 'adaptive'
+        Number of samples for permutation test (default 0). With
+        ``'adaptive'``, permutations stop as soon as all p-values are
+        clearly above or below 0.05 (at most 10000 permutations; see the
+        ``adaptive_*`` options in :func:`configure`).
     pmin : None | scalar (0 < pmin < 1)
         Threshold p value for forming clusters. None for threshold-free
         cluster enhancement.
@@ -894,6 +941,11 @@ class ttest_ind(NDTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    checkpoint : str
+        Path for saving the permutation distribution periodically while it is
+        computed. If the file exists and matches the test, the permutations
+        saved in it are reused, so that an interrupted test can be resumed,
+        or a test can be extended to more samples.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -930,7 +982,8 @@ class ttest_ind(NDTest):
     @user_activity
     def __init__(self, y, x, c1=None, c0=None, match=None, sub=None, ds=None,
                  tail=0, samples=0, pmin=None, tmin=None, tfce=False,
-                 tstart=None, tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstart=None, tstop=None, parc=None, force_permutation=False, checkpoint=None,
+                 **criteria):
         ct = Celltable(y, x, match, sub, cat=(c1, c0), ds=ds, coercion=asndvar,
                        dtype=np.float64)
         c1, c0 = ct.cat
@@ -958,11 +1011,12 @@ class ttest_ind(NDTest):
 
             cdist = NDPermutationDistribution(
                 ct.y, samples, threshold, tfce, tail, 't', 'Independent Samples t-Test',
-                tstart, tstop, criteria, parc, force_permutation)
+                tstart, tstop, criteria, parc, force_permutation, checkpoint)
             cdist.add_original(tmap)
             if cdist.do_permutation:
-                iterator = permute_order(n, samples)
-                run_permutation(stats.t_ind, cdist, iterator, groups)
+                iterator = permute_order_blocks(n, samples, seed=cdist.seed)
+                run_permutation(stats.t_ind, cdist, iterator, groups,
+                                batch_func=stats.t_ind_batch)
 
         # NDVar map of t-values
         info = _info.for_stat_map('t', threshold, tail=tail, old=ct.y.info)
@@ -1080,8 +1134,14 @@ class ttest_rel(NDTest):
         0: both (two-tailed, default);
         1: upper tail (one-tailed);
         -1: lower tail (one-tailed).
-    samples : int
-        Number of samples for permutation test (default 0).
+    samples : int | 'adaptive'
+        Number of samples for permutation test (default 0). With
+        ``'adaptive'``, permutations stop as soon as all p-values are
+        clearly above or below 0.05 (at most 10000 permutations; see the
+        ``adaptive_*`` options in :func:`configure`). With 16 or fewer
+        cases, the sign flips of an adaptive test are drawn for the maximum
+        number of permutations, and a test with ``samples=n_samples`` may
+        draw different sign flips (``samples=10000`` reproduces them).
     pmin : None | scalar (0 < pmin < 1)
         Threshold for forming clusters:  use a t-value equivalent to an
         uncorrected p-value.
@@ -1102,6 +1162,11 @@ class ttest_rel(NDTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    checkpoint : str
+        Path for saving the permutation distribution periodically while it is
+        computed. If the file exists and matches the test, the permutations
+        saved in it are reused, so that an interrupted test can be resumed,
+        or a test can be extended to more samples.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -1140,7 +1205,8 @@ class ttest_rel(NDTest):
     @user_activity
     def __init__(self, y, x, c1=None, c0=None, match=None, sub=None, ds=None,
                  tail=0, samples=0, pmin=None, tmin=None, tfce=False,
-                 tstart=None, tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstart=None, tstop=None, parc=None, force_permutation=False, checkpoint=None,
+                 **criteria):
         if isinstance(x, NDVar) or isinstance(x, str) and x in ds and isinstance(ds[x], NDVar):
             assert c1 is None
             assert c0 is None
@@ -1192,11 +1258,13 @@ class ttest_rel(NDTest):
             n_samples, samples = _resample_params(len(diff), samples)
             cdist = NDPermutationDistribution(
                 diff, n_samples, threshold, tfce, tail, 't', 'Related Samples t-Test',
-                tstart, tstop, criteria, parc, force_permutation)
+                tstart, tstop, criteria, parc, force_permutation, checkpoint)
             cdist.add_original(tmap)
             if cdist.do_permutation:
-                iterator = permute_sign_flip(n, samples)
-                run_permutation(opt.t_1samp_perm, cdist, iterator)
+                cdist.sampling = sign_flip_sampling(n, samples)
+                iterator = permute_sign_flip_blocks(n, samples, cdist.seed)
+                run_permutation(opt.t_1samp_perm, cdist, iterator,
+                                batch_func=stats.t_1samp_perm_batch)
 
         # NDVar map of t-values
         info = _info.for_stat_map('t', threshold, tail=tail, old=y1.info)
@@ -1452,8 +1520,11 @@ class anova(MultiEffectNDTest):
     ds : None | Dataset
         If a Dataset is specified, all data-objects can be specified as
         names of Dataset variables.
-    samples : int
-        Number of samples for permutation test (default 0).
+    samples : int | 'adaptive'
+        Number of samples for permutation test (default 0). With
+        ``'adaptive'``, permutations stop as soon as all p-values are
+        clearly above or below 0.05 (at most 10000 permutations; see the
+        ``adaptive_*`` options in :func:`configure`).
     pmin : None | scalar (0 < pmin < 1)
         Threshold for forming clusters:  use an f-value equivalent to an
         uncorrected p-value.
@@ -1481,6 +1552,11 @@ class anova(MultiEffectNDTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    checkpoint : str
+        Path for saving the permutation distribution periodically while it is
+        computed. If the file exists and matches the test, the permutations
+        saved in it are reused, so that an interrupted test can be resumed,
+        or a test can be extended to more samples.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -1513,7 +1589,8 @@ class anova(MultiEffectNDTest):
     @user_activity
     def __init__(self, y, x, sub=None, ds=None, samples=0, pmin=None,
                  fmin=None, tfce=False, tstart=None, tstop=None, match=None,
-                 parc=None, force_permutation=False, **criteria):
+                 parc=None, force_permutation=False, checkpoint=None,
+                 **criteria):
         x_arg = x
         sub_arg = sub
         sub = assub(sub, ds)
@@ -1554,7 +1631,7 @@ class anova(MultiEffectNDTest):
             cdists = [
                 NDPermutationDistribution(
                     y, samples, thresh, tfce, 1, 'F', e.name,
-                    tstart, tstop, criteria, parc, force_permutation)
+                    tstart, tstop, criteria, parc, force_permutation, checkpoint)
                 for e, thresh in zip(effects, thresholds)]
 
             # Find clusters in the actual data
@@ -1564,7 +1641,7 @@ class anova(MultiEffectNDTest):
                 do_permutation += cdist.do_permutation
 
             if do_permutation:
-                iterator = permute_order(len(y), samples, unit=match)
+                iterator = permute_order_blocks(len(y), samples, unit=match, seed=cdists[0].seed)
                 run_permutation_me(lm, cdists, iterator)
 
         # create ndvars
@@ -1672,8 +1749,11 @@ class Vector(NDTest):
     ds : None | Dataset
         If a Dataset is specified, all data-objects can be specified as
         names of Dataset variables
-    samples : int
-        Number of samples for permutation test (default 0).
+    samples : int | 'adaptive'
+        Number of samples for permutation test (default 0). With
+        ``'adaptive'``, permutations stop as soon as all p-values are
+        clearly above or below 0.05 (at most 10000 permutations; see the
+        ``adaptive_*`` options in :func:`configure`).
     vmin : scalar
         Threshold value for forming clusters.
     tfce : bool | scalar
@@ -1691,6 +1771,11 @@ class Vector(NDTest):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    checkpoint : str
+        Path for saving the permutation distribution periodically while it is
+        computed. If the file exists and matches the test, the permutations
+        saved in it are reused, so that an interrupted test can be resumed,
+        or a test can be extended to more samples.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -1719,15 +1804,18 @@ class Vector(NDTest):
     @user_activity
     def __init__(self, y, match=None, sub=None, ds=None,
                  samples=10000, vmin=None, tfce=False, tstart=None,
-                 tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstop=None, parc=None, force_permutation=False, checkpoint=None,
+                 **criteria):
         ct = Celltable(y, match=match, sub=sub, ds=ds, coercion=asndvar,
                        dtype=np.float64)
 
         n = len(ct.y)
         n_samples, samples = _resample_params(n, samples)
+        # vector kernels only support float64
         cdist = NDPermutationDistribution(
             ct.y, n_samples, vmin, tfce, 1, 'norm', 'Vector Test',
-            tstart, tstop, criteria, parc, force_permutation)
+            tstart, tstop, criteria, parc, force_permutation, checkpoint,
+            np.float64)
 
         v_dim = ct.y.dimnames[cdist._vector_ax + 1]
         v_mean = ct.y.mean('case')
@@ -1735,7 +1823,7 @@ class Vector(NDTest):
         cdist.add_original(v_mean_norm.x if v_mean.ndim > 1 else v_mean_norm)
 
         if cdist.do_permutation:
-            iterator = random_seeds(samples)
+            iterator = (random_seeds(samples, cdist.seed),)
             run_permutation(self._vector_mean_norm_perm, cdist, iterator)
 
         # store attributes
@@ -1778,30 +1866,6 @@ class Vector(NDTest):
         return vector.mean_norm_rotated(y, rotation, out)
 
 
-def flatten(array, connectivity):
-    """Reshape SPM buffer array to 2-dimensional map for connectivity processing
-
-    Parameters
-    ----------
-    array : ndarray
-        N-dimensional array (with non-adjacent dimension at first position).
-    connectivity : Connectivity
-        N-dimensional connectivity.
-
-    Returns
-    -------
-    flat_array : ndarray
-        The input array reshaped if necessary, making sure that input and output
-        arrays share the same underlying data buffer.
-    """
-    if array.ndim == 2 or not connectivity.custom:
-        return array
-    else:
-        out = array.reshape((array.shape[0], -1))
-        assert out.base is array
-        return out
-
-
 def flatten_1d(array):
     if array.ndim == 1:
         return array
@@ -1830,21 +1894,18 @@ def label_clusters(stat_map, threshold, tail, connectivity, criteria):
     """
     cmap = np.empty(stat_map.shape, np.uint32)
     bin_buff = np.empty(stat_map.shape, np.bool8)
-    cmap_flat = flatten(cmap, connectivity)
-
     if tail == 0:
         int_buff = np.empty(stat_map.shape, np.uint32)
-        int_buff_flat = flatten(int_buff, connectivity)
     else:
-        int_buff = int_buff_flat = None
+        int_buff = None
 
     cids = _label_clusters(stat_map, threshold, tail, connectivity, criteria,
-                           cmap, cmap_flat, bin_buff, int_buff, int_buff_flat)
+                           cmap, bin_buff, int_buff)
     return cmap, cids
 
 
-def _label_clusters(stat_map, threshold, tail, conn, criteria, cmap, cmap_flat,
-                    bin_buff, int_buff, int_buff_flat):
+def _label_clusters(stat_map, threshold, tail, conn, criteria, cmap, bin_buff,
+                    int_buff):
     """Find clusters on a statistical parameter map
 
     Parameters
@@ -1864,17 +1925,14 @@ def _label_clusters(stat_map, threshold, tail, conn, criteria, cmap, cmap_flat,
     # compute clusters
     if tail >= 0:
         bin_map_above = np.greater(stat_map, threshold, bin_buff)
-        cids = _label_clusters_binary(bin_map_above, cmap, cmap_flat, conn,
-                                      criteria)
+        cids = _label_clusters_binary(bin_map_above, cmap, conn, criteria)
 
     if tail <= 0:
         bin_map_below = np.less(stat_map, -threshold, bin_buff)
         if tail < 0:
-            cids = _label_clusters_binary(bin_map_below, cmap, cmap_flat, conn,
-                                          criteria)
+            cids = _label_clusters_binary(bin_map_below, cmap, conn, criteria)
         else:
-            cids_l = _label_clusters_binary(bin_map_below, int_buff,
-                                            int_buff_flat, conn, criteria)
+            cids_l = _label_clusters_binary(bin_map_below, int_buff, conn, criteria)
             x = cmap.max()
             int_buff[bin_map_below] += x
             cids_l += x
@@ -1904,12 +1962,11 @@ def label_clusters_binary(bin_map, connectivity, criteria=None):
         Sorted identifiers of the clusters that survive the selection criteria.
     """
     cmap = np.empty(bin_map.shape, np.uint32)
-    cmap_flat = flatten(cmap, connectivity)
-    cids = _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria)
+    cids = _label_clusters_binary(bin_map, cmap, connectivity, criteria)
     return cmap, cids
 
 
-def _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria):
+def _label_clusters_binary(bin_map, cmap, connectivity, criteria):
     """Label clusters in a binary array
 
     Parameters
@@ -1919,8 +1976,6 @@ def _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria):
         cluster (non-adjacent dimension on the first axis).
     cmap : np.ndarray
         Array in which to label the clusters.
-    cmap_flat : np.ndarray
-        Flat copy of cmap (ndim=2, only used when all_adjacent==False)
     connectivity : Connectivity
         Connectivity.
     criteria : None | list
@@ -1933,17 +1988,19 @@ def _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria):
         Sorted identifiers of the clusters that survive the selection criteria.
     """
     # find clusters
-    n = ndimage.label(bin_map, connectivity.struct, cmap)
-    if n <= 1:
-        # in older versions, n is 1 even when no cluster is found
-        if n == 0 or cmap.max() == 0:
-            return np.array((), np.uint32)
-        else:
-            cids = np.array((1,), np.uint32)
-    elif connectivity.custom:
-        cids = merge_labels(cmap_flat, n, *connectivity.custom[0])
-    else:
+    if connectivity.custom:
+        n = label_components(bin_map, cmap, connectivity)
         cids = np.arange(1, n + 1, 1, np.uint32)
+    else:
+        n = ndimage.label(bin_map, connectivity.struct, cmap)
+        if n <= 1:
+            # in older versions, n is 1 even when no cluster is found
+            if n == 0 or cmap.max() == 0:
+                return np.array((), np.uint32)
+            else:
+                cids = np.array((1,), np.uint32)
+        else:
+            cids = np.arange(1, n + 1, 1, np.uint32)
 
     # apply minimum cluster size criteria
     if criteria and cids.size:
@@ -1957,48 +2014,116 @@ def _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria):
     return cids
 
 
-def tfce(stat_map, tail, connectivity, dh=0.1):
-    tfce_im = np.empty(stat_map.shape, np.float64)
-    tfce_im_1d = flatten_1d(tfce_im)
-    bin_buff = np.empty(stat_map.shape, np.bool8)
-    int_buff = np.empty(stat_map.shape, np.uint32)
-    int_buff_flat = flatten(int_buff, connectivity)
-    int_buff_1d = flatten_1d(int_buff)
-    return _tfce(stat_map, tail, connectivity, tfce_im, tfce_im_1d, bin_buff, int_buff,
-                 int_buff_flat, int_buff_1d, dh)
+def label_components(bin_map, cmap, connectivity, n_threads=None):
+    """Label connected components with custom connectivity on the first axis
 
+    Parameters
+    ----------
+    bin_map : array of bool
+        Binary map (custom connectivity on the first axis).
+    cmap : array of uint32
+        C-contiguous container for the labels (same shape as ``bin_map``).
+    connectivity : Connectivity
+        Connectivity corresponding to ``bin_map``.
+    n_threads : int
+        Number of threads (default: one per CPU for maps with at least
+        ``PARALLEL_LABEL_SIZE`` elements, except in worker processes).
 
-def _tfce(stat_map, tail, conn, out, out_1d, bin_buff, int_buff,
-          int_buff_flat, int_buff_1d, dh=0.1, e=0.5, h=2.0):
-    "Threshold-free cluster enhancement"
-    out.fill(0)
+    Returns
+    -------
+    n : int
+        Number of components; components are labeled ``1`` to ``n`` in the
+        order of their first element.
 
-    # determine slices
-    if tail == 0:
-        hs = chain(np.arange(-dh, stat_map.min(), -dh),
-                   np.arange(dh, stat_map.max(), dh))
-    elif tail < 0:
-        hs = np.arange(-dh, stat_map.min(), -dh)
+    Notes
+    -----
+    Components are found with a union-find structure over the flat map,
+    using the compressed sparse row representation of the custom
+    connectivity (:attr:`Connectivity.edge_start`). Maps with more than one
+    dimension are split into chunks along the second axis (usually time),
+    which are labeled in concurrent threads and then merged.
+    """
+    shape = np.array(bin_map.shape, np.int64)
+    bin_flat = np.ascontiguousarray(bin_map).view(np.uint8).ravel()
+    parent = np.empty(len(bin_flat), np.int64)
+    args = (bin_flat, parent, shape, connectivity.grid, connectivity.edge_start,
+            connectivity.edge_dst)
+    n_slices = bin_map.shape[1] if bin_map.ndim > 1 else 1
+    if n_threads is None:
+        if bin_flat.size < PARALLEL_LABEL_SIZE:
+            n_threads = 1
+        else:
+            n_threads = thread_count()
+    n_chunks = min(n_threads, n_slices)
+    if n_chunks > 1:
+        bounds = np.linspace(0, n_slices, n_chunks + 1).round().astype(np.int64)
+        pool = get_thread_pool()
+        futures = [pool.submit(label_chunk, *args, start, stop)
+                   for start, stop in zip(bounds[:-1], bounds[1:])]
+        for future in futures:
+            future.result()
+        if connectivity.grid[1]:
+            merge_chunks(bin_flat, parent, shape, bounds[1:-1])
     else:
-        hs = np.arange(dh, stat_map.max(), dh)
+        label_chunk(*args, 0, n_slices)
+    return relabel_components(bin_flat, parent, cmap.ravel())
+
+
+def tfce(stat_map, tail, connectivity, dh=0.1):
+    out = np.empty(stat_map.shape, np.float64)
+    return _tfce(stat_map, tail, connectivity, out, dh)
 
-    # label clusters in slices at different heights
-    # fill each cluster with total section value
-    # each point's value is the vertical sum
-    for h_ in hs:
-        if h_ > 0:
-            np.greater_equal(stat_map, h_, bin_buff)
-            h_factor = h_ ** h
-        else:
-            np.less_equal(stat_map, h_, bin_buff)
-            h_factor = (-h_) ** h
 
-        c_ids = _label_clusters_binary(bin_buff, int_buff, int_buff_flat, conn, None)
-        tfce_increment(c_ids, int_buff_1d, out_1d, e, h_factor)
+def _tfce(stat_map, tail, connectivity, out, dh=0.1, e=0.5, h=2.0):
+    """Threshold-free cluster enhancement
 
+    Clusters are grown from the highest to the lowest height with a
+    union-find structure, so that each element is visited once per tail
+    instead of labeling the map once per height.
+
+    Parameters
+    ----------
+    stat_map : array
+        Statistical map.
+    tail : 0 | 1 | -1
+        Tail(s) to enhance.
+    connectivity : Connectivity
+        Connectivity corresponding to ``stat_map``.
+    out : array of float
+        Container for the output (same shape as ``stat_map``).
+    """
+    out.fill(0)
+    out_1d = flatten_1d(out)
+    x = stat_map.ravel()
+    shape = np.array(stat_map.shape, np.int64)
+    grid = connectivity.grid
+    edge_start = connectivity.edge_start
+    edge_dst = connectivity.edge_dst
+
+    if tail <= 0:
+        hs = -np.arange(-dh, stat_map.min(), -dh)
+        _tfce_tail(-x, hs, out_1d, shape, grid, edge_start, edge_dst, e, h)
+    if tail >= 0:
+        hs = np.arange(dh, stat_map.max(), dh)
+        _tfce_tail(x, hs, out_1d, shape, grid, edge_start, edge_dst, e, h)
     return out
 
 
+def _tfce_tail(x, hs, out, shape, grid, edge_start, edge_dst, e, h):
+    "Add TFCE for positive values in ``x`` to ``out``"
+    if len(hs) == 0:
+        return
+    n_levels = np.searchsorted(hs, x, 'right')
+    order = np.flatnonzero(n_levels)
+    if len(order) == 0:
+        return
+    order = order[np.argsort(-n_levels[order], kind='mergesort')]
+    weight_cumsum = np.zeros(len(hs) + 1)
+    np.cumsum(hs ** h, out=weight_cumsum[1:])
+    tfce_union_find(out, order, n_levels.astype(np.int64, copy=False),
+                    weight_cumsum, e, shape, grid, edge_start, edge_dst)
+
+
 class StatMapProcessor(object):
 
     def __init__(self, tail, max_axes, parc):
@@ -2029,20 +2154,11 @@ class TFCEProcessor(StatMapProcessor):
         self.connectivity = connectivity
         self.dh = dh
 
-        # Pre-allocate memory buffers used for cluster processing
-        self._bin_buff = np.empty(shape, np.bool8)
-        self._int_buff = np.empty(shape, np.uint32)
         self._tfce_im = np.empty(shape, np.float64)
-        self._tfce_im_1d = flatten_1d(self._tfce_im)
-        self._int_buff_flat = flatten(self._int_buff, connectivity)
-        self._int_buff_1d = flatten_1d(self._int_buff)
 
     def max_stat(self, stat_map):
-        v = _tfce(
-            stat_map, self.tail, self.connectivity, self._tfce_im, self._tfce_im_1d,
-            self._bin_buff, self._int_buff, self._int_buff_flat, self._int_buff_1d,
-            self.dh,
-        ).max(self.max_axes)
+        v = _tfce(stat_map, self.tail, self.connectivity, self._tfce_im, self.dh
+                  ).max(self.max_axes)
         if self.parc is None:
             return v
         else:
@@ -2063,22 +2179,18 @@ class ClusterProcessor(StatMapProcessor):
         self._bin_buff = np.empty(shape, np.bool8)
 
         self._cmap = np.empty(shape, np.uint32)
-        self._cmap_flat = flatten(self._cmap, connectivity)
-
         if tail == 0:
             self._int_buff = np.empty(shape, np.uint32)
-            self._int_buff_flat = flatten(self._int_buff, connectivity)
         else:
-            self._int_buff = self._int_buff_flat = None
+            self._int_buff = None
 
     def max_stat(self, stat_map, threshold=None):
         if threshold is None:
             threshold = self.threshold
         cmap = self._cmap
         cids = _label_clusters(stat_map, threshold, self.tail, self.connectivity,
-                               self.criteria, cmap, self._cmap_flat,
-                               self._bin_buff, self._int_buff,
-                               self._int_buff_flat)
+                               self.criteria, cmap, self._bin_buff,
+                               self._int_buff)
         if self.parc is not None:
             v = []
             for idx in self.parc:
@@ -2131,15 +2243,17 @@ class NDPermutationDistribution(object):
     internal shape: [non-adjacent, ] ...
     """
     def __init__(self, y, samples, threshold, tfce=False, tail=0, meas='?', name=None,
-                 tstart=None, tstop=None, criteria={}, parc=None, force_permutation=False):
+                 tstart=None, tstop=None, criteria={}, parc=None, force_permutation=False,
+                 checkpoint=None, dtype=None):
         """Accumulate information on a cluster statistic.
 
         Parameters
         ----------
         y : NDVar
             Dependent variable.
-        samples : int
-            Number of permutations.
+        samples : int | 'adaptive'
+            Number of permutations. With ``'adaptive'``, permutations stop
+            once all p-values are decided (see :meth:`.is_decided`).
         threshold : scalar > 0
             Threshold-based clustering.
         tfce : bool | scalar
@@ -2164,6 +2278,12 @@ class NDPermutationDistribution(object):
             disconnected.
         force_permutation : bool
             Conduct permutations regardless of whether there are any clusters.
+        checkpoint : str
+            Path for periodically saving the partial permutation distribution
+            (see :class:`PermutationCheckpoint`).
+        dtype : numpy dtype
+            Data type for computing permutations (default from
+            ``configure(stat_dtype=...)``).
         """
         assert y.has_case
         assert parc is None or isinstance(parc, str)
@@ -2258,7 +2378,14 @@ class NDPermutationDistribution(object):
             criteria_ = None
 
         # prepare distribution
-        samples = int(samples)
+        if samples == 'adaptive':
+            adaptive = {'p': CONFIG['adaptive_p'],
+                        'confidence': CONFIG['adaptive_confidence'],
+                        'step': CONFIG['adaptive_step'],
+                        'max_samples': ADAPTIVE_MAX_SAMPLES}
+        else:
+            adaptive = None
+        samples = _max_samples(samples)
         if parc:
             for parc_ax, parc_dim in enumerate(swapped_dims):
                 if parc_dim.name == parc:
@@ -2304,6 +2431,7 @@ class NDPermutationDistribution(object):
         self.shape = shape  # internal stat map shape
         self._connectivity = connectivity
         self.samples = samples
+        self.adaptive = adaptive
         self.dist_shape = dist_shape
         self._dist_dims = dist_dims
         self._max_axes = max_axes
@@ -2328,6 +2456,11 @@ class NDPermutationDistribution(object):
         self._init_time = current_time()
         self._host = socket.gethostname()
         self.force_permutation = force_permutation
+        self.checkpoint = checkpoint
+        self.dtype = np.dtype(CONFIG['stat_dtype'] if dtype is None else dtype)
+        self.seed = 0
+        # algorithm for sampling sign flips (see sign_flip_sampling())
+        self.sampling = None
 
         from .. import __version__
         self._version = __version__
@@ -2389,22 +2522,11 @@ class NDPermutationDistribution(object):
             self._create_dist()
             self.do_permutation = True
         else:
-            self.dist_array = None
             self.finalize()
 
     def _create_dist(self):
         "Create the distribution container"
-        if CONFIG['n_workers']:
-            n = reduce(operator.mul, self.dist_shape)
-            dist_array = RawArray('d', n)
-            dist = np.frombuffer(dist_array, np.float64, n)
-            dist.shape = self.dist_shape
-        else:
-            dist_array = None
-            dist = np.zeros(self.dist_shape)
-
-        self.dist_array = dist_array
-        self.dist = dist
+        self.dist = np.zeros(self.dist_shape)
 
     def _aggregate_dist(self, **sub):
         """Aggregate permutation distribution to one value per permutation
@@ -2457,13 +2579,13 @@ class NDPermutationDistribution(object):
             name: getattr(self, name) for name in (
                 'name', 'meas', '_version', '_host', '_init_time',
                 # settings ...
-                'kind', 'threshold', 'tfce', 'tail', 'criteria', 'samples', 'tstart', 'tstop', 'parc',
+                'kind', 'threshold', 'tfce', 'tail', 'criteria', 'samples', 'adaptive', 'tstart', 'tstop', 'parc', 'seed', 'sampling',
                 # data properties ...
                 'dims', 'shape', '_nad_ax', '_vector_ax', '_criteria', '_connectivity',
                 # results ...
                 'dt_original', 'dt_perm', 'n_clusters', '_dist_dims', 'dist', '_original_param_map', '_original_cluster_map', '_cids',
             )}
-        state['version'] = 3
+        state['version'] = 6
         return state
 
     def __setstate__(self, state):
@@ -2509,6 +2631,12 @@ class NDPermutationDistribution(object):
             state['_vector_ax'] = None
         if version < 3:
             state['tfce'] = ['kind'] == 'tfce'
+        if version < 4:
+            state['seed'] = 0
+        if version < 5:
+            state['adaptive'] = None
+        if version < 6:
+            state['sampling'] = None
 
         for k, v in state.items():
             setattr(self, k, v)
@@ -2590,7 +2718,8 @@ class NDPermutationDistribution(object):
         Parameters
         ----------
         raw : bool
-            Return a RawArray and a shape tuple instead of a numpy array.
+            Return a :class:`SharedArray` (for worker processes) and the
+            stat-map shape instead of a numpy array.
         """
         # get data in the right shape
         x = self.y_perm.x
@@ -2610,13 +2739,19 @@ class NDPermutationDistribution(object):
         n_flat = 1 if x.ndim == ndims else reduce(operator.mul, x.shape[ndims:])
         y_flat_shape = x.shape[:ndims] + (n_flat,)
 
-        if not raw:
+        if raw:
+            out = SharedArray(y_flat_shape, self.dtype)
+            y = out.x
+        elif x.dtype == self.dtype and x.flags.c_contiguous:
             return x.reshape(y_flat_shape)
-
-        n = reduce(operator.mul, y_flat_shape)
-        ra = RawArray('d', n)
-        ra[:] = x.ravel()  # OPT: don't copy data
-        return ra, y_flat_shape, x.shape[ndims:]
+        else:
+            y = np.empty(y_flat_shape, self.dtype)
+        # convert while copying, without an intermediate copy in the original
+        # dtype (reshaping x after swapping axes would copy it)
+        y.reshape(x.shape)[...] = x
+        if raw:
+            return out, x.shape[ndims:]
+        return y
 
     def _cluster_properties(self, cluster_map, cids):
         """Create a Dataset with cluster properties
@@ -2935,6 +3070,42 @@ class NDPermutationDistribution(object):
         else:
             return cpmap
 
+    def is_decided(self, n):
+        """Whether all p-values are decided after ``n`` permutations
+
+        Used for adaptive tests (``samples='adaptive'``): a p-value is decided
+        when its Clopper-Pearson confidence interval (at the confidence level
+        ``adaptive['confidence']``) excludes ``adaptive['p']``. For
+        threshold-based tests, the p-values of the original clusters are
+        considered, otherwise the p-values of all elements of the map.
+        """
+        if self.kind == 'cluster':
+            if not self.n_clusters:
+                return True
+            values = np.abs(ndimage.sum(self._original_param_map,
+                                        self._original_cluster_map, self._cids))
+        elif self.kind == 'tfce':
+            values = self._original_cluster_map
+        elif self.tail == 0:
+            values = np.abs(self._original_param_map)
+        elif self.tail > 0:
+            values = self._original_param_map
+        else:
+            values = -self._original_param_map
+        dist = self.dist[:n]
+        if dist.ndim > 1:
+            dist = dist.max(tuple(range(1, dist.ndim)))
+        # number of permutations with a statistic at least as large
+        n_larger = n - np.searchsorted(np.sort(dist), np.ravel(values))
+        k = np.unique(n_larger)
+        alpha = 1 - self.adaptive['confidence']
+        with np.errstate(invalid='ignore'):
+            lower = np.nan_to_num(scipy.stats.beta.ppf(alpha / 2, k, n - k + 1))
+            upper = scipy.stats.beta.ppf(1 - alpha / 2, k + 1, n - k)
+        upper[k == n] = 1
+        p = self.adaptive['p']
+        return bool(np.all((upper < p) | (lower > p)))
+
     def masked_parameter_map(self, pmin=0.05, name=None, **sub):
         """Create a copy of the parameter map masked by significance
 
@@ -3000,6 +3171,21 @@ class NDPermutationDistribution(object):
                        .strftime('%y-%m-%d %H:%M'))
         l.add_item("Original time:  %s" % timedelta(seconds=round(self.dt_original)))
         l.add_item("Permutation time:  %s" % timedelta(seconds=round(self.dt_perm)))
+        if self.adaptive:
+            a = self.adaptive
+            if self.samples < a['max_samples']:
+                stop = "stopped after %i permutations" % self.samples
+            else:
+                stop = "maximum of %i permutations reached" % self.samples
+            l.add_item("Adaptive stopping:  %s (stop when the %s%% confidence "
+                       "intervals of all p-values exclude p=%s, evaluated "
+                       "every %i permutations)" %
+                       (stop, a['confidence'] * 100, a['p'], a['step']))
+            if self.sampling == 'pool':
+                l.add_item("Sign flips were drawn for the maximum of %i "
+                           "permutations; a test with a fixed number of "
+                           "permutations reproduces them only with samples=%i"
+                           % (a['max_samples'], a['max_samples']))
         return l
 
 
@@ -3049,216 +3235,489 @@ class _MergedTemporalClusterDist:
         return clusters
 
 
-def distribution_worker(dist_array, dist_shape, in_queue, kill_beacon):
-    "Worker that accumulates values and places them into the distribution"
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    n = reduce(operator.mul, dist_shape)
-    dist = np.frombuffer(dist_array, np.float64, n)
-    dist.shape = dist_shape
-    samples = dist_shape[0]
-    for i in trange(samples, desc="Permutation test", unit=' permutations',
-                    disable=CONFIG['tqdm']):
-        dist[i] = in_queue.get()
-        if kill_beacon.is_set():
-            return
+class PermutationJob(object):
+    """Compute the maximum statistic for blocks of permutations
 
+    Job function for the worker pool (see :func:`run_permutation`). Called
+    with the index of the first permutation and a block of permutations, it
+    writes the maximum statistics directly to the shared distribution
+    ``dist`` and returns the number of permutations in the block.
+    """
+    def __init__(self, y, stat_map_shape, test_func, args, map_args, dist):
+        self._init_args = (y, stat_map_shape, test_func, args, map_args, dist)
+        self.y = y
+        self.stat_map_shape = stat_map_shape
+        self.test_func = test_func
+        self.args = args
+        self.map_args = map_args
+        self.dist = dist
+        self._map_processor = None
 
-def permutation_worker(in_queue, out_queue, y, y_flat_shape, stat_map_shape,
-                       test_func, args, map_args, kill_beacon):
-    "Worker for 1 sample t-test"
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    if CONFIG['nice']:
-        os.nice(CONFIG['nice'])
-
-    n = reduce(operator.mul, y_flat_shape)
-    y = np.frombuffer(y, np.float64, n).reshape(y_flat_shape)
-    stat_map = np.empty(stat_map_shape)
-    stat_map_flat = stat_map.ravel()
-    map_processor = get_map_processor(*map_args)
-    while not kill_beacon.is_set():
-        perm = in_queue.get()
-        if perm is None:
-            break
-        test_func(y, *args, stat_map_flat, perm)
-        max_v = map_processor.max_stat(stat_map)
-        out_queue.put(max_v)
-
-
-def run_permutation(test_func, dist, iterator, *args):
-    if CONFIG['n_workers']:
-        workers, out_queue, kill_beacon = setup_workers(test_func, dist, args)
-
-        try:
-            for perm in iterator:
-                out_queue.put(perm)
-
-            for _ in range(len(workers) - 1):
-                out_queue.put(None)
-
-            logger = logging.getLogger(__name__)
-            for w in workers:
-                w.join()
-                logger.debug("worker joined")
-        except KeyboardInterrupt:
-            kill_beacon.set()
-            raise
-    else:
-        y = dist.data_for_permutation(False)
-        map_processor = get_map_processor(*dist.map_args)
-        stat_map = np.empty(dist.shape)
-        stat_map_flat = stat_map.ravel()
-        for i, perm in enumerate(iterator):
-            test_func(y, *args, stat_map_flat, perm)
-            dist.dist[i] = map_processor.max_stat(stat_map)
-    dist.finalize()
+    def __getstate__(self):
+        return self._init_args
 
+    def __setstate__(self, state):
+        self.__init__(*state)
 
-def setup_workers(test_func, dist, func_args):
-    "Initialize workers for permutation tests"
-    logger = logging.getLogger(__name__)
-    logger.debug("Setting up %i worker processes..." % CONFIG['n_workers'])
-    permutation_queue = SimpleQueue()
-    dist_queue = SimpleQueue()
-    kill_beacon = Event()
+    def _allocate(self):
+        self._map_processor = get_map_processor(*self.map_args)
+        self._stat_map = np.empty(self.stat_map_shape, self.y.dtype)
+        self._stat_map_flat = self._stat_map.ravel()
 
-    # permutation workers
-    y, y_flat_shape, stat_map_shape = dist.data_for_permutation()
-    args = (permutation_queue, dist_queue, y, y_flat_shape, stat_map_shape,
-            test_func, func_args, dist.map_args, kill_beacon)
-    workers = []
-    for _ in range(CONFIG['n_workers']):
-        w = Process(target=permutation_worker, args=args)
-        w.start()
-        workers.append(w)
+    def _max_stat(self, y, perm):
+        self.test_func(y, *self.args, self._stat_map_flat, perm)
+        return self._map_processor.max_stat(self._stat_map)
 
-    # distribution worker
-    args = (dist.dist_array, dist.dist_shape, dist_queue, kill_beacon)
-    w = Process(target=distribution_worker, args=args)
-    w.start()
-    workers.append(w)
+    def _write(self, start, max_stats):
+        self.dist.x[start: start + len(max_stats)] = max_stats
 
-    return workers, permutation_queue, kill_beacon
+    def __call__(self, start, perms):
+        if self._map_processor is None:
+            self._allocate()
+        y = self.y.x
+        self._write(start, [self._max_stat(y, perm) for perm in perms])
+        return len(perms)
 
 
-def run_permutation_me(test, dists, iterator):
-    dist = dists[0]
-    if dist.kind == 'cluster':
-        thresholds = tuple(d.threshold for d in dists)
-    else:
-        thresholds = None
+class PermutationJobME(PermutationJob):
+    """Compute the maximum statistic of each effect for blocks of permutations
 
-    if CONFIG['n_workers']:
-        workers, out_queue, kill_beacon = setup_workers_me(test, dists, thresholds)
+    Job function for the worker pool (see :func:`run_permutation_me`);
+    ``test_func`` is the ANOVA object, ``args`` are the cluster forming
+    thresholds for each effect (or ``None``), and ``dist`` is a list with
+    the shared distribution for each effect (``None`` for effects without
+    permutations).
+    """
+    def _allocate(self):
+        self._map_processor = get_map_processor(*self.map_args)
+        self._stat_maps = self.test_func.preallocate(self.stat_map_shape, self.y.dtype)
+
+    def _max_stat(self, y, perm):
+        self.test_func.map(y, perm)
+        if self.args:
+            return [self._map_processor.max_stat(m, t) for m, t in zip(self._stat_maps, self.args)]
+        else:
+            return [self._map_processor.max_stat(m) for m in self._stat_maps]
 
-        try:
-            for perm in iterator:
-                out_queue.put(perm)
+    def _write(self, start, max_stats):
+        for dist, max_stats_d in zip(self.dist, zip(*max_stats)):
+            if dist is not None:
+                dist.x[start: start + len(max_stats_d)] = max_stats_d
 
-            for _ in range(len(workers) - 1):
-                out_queue.put(None)
 
-            logger = logging.getLogger(__name__)
-            for w in workers:
-                w.join()
-                logger.debug("worker joined")
-        except KeyboardInterrupt:
-            kill_beacon.set()
-            raise
-    else:
-        y = dist.data_for_permutation(False)
-        map_processor = get_map_processor(*dist.map_args)
+def permutation_blocks(iterator, block_size):
+    """Regroup blocks of permutations into blocks of ``block_size``
+
+    Parameters
+    ----------
+    iterator : iterator over array
+        Blocks of permutations (arrays with permutations in the first axis,
+        as generated by :func:`permute_order_blocks`).
+    block_size : int
+        Number of permutations per block.
+
+    Yields
+    ------
+    block : array  (n_perm, ...)
+        Array with permutations in the first axis (``n_perm <= block_size``).
+        The same buffer may be reused in every iteration.
+    """
+    block = None
+    i = 0
+    for perms in iterator:
+        if i == 0 and len(perms) == block_size:
+            yield perms
+            continue
+        elif block is None:
+            block = np.empty((block_size,) + perms.shape[1:], perms.dtype)
+        start = 0
+        while start < len(perms):
+            n = min(block_size - i, len(perms) - start)
+            block[i: i + n] = perms[start: start + n]
+            i += n
+            start += n
+            if i == block_size:
+                yield block
+                i = 0
+    if i:
+        yield block[:i]
+
+
+def permutation_block_size(n_tests, samples, n_buffers=1):
+    "Number of permutations to compute at once in batched mode"
+    block_size = PERMUTATION_BATCH_BUFFER // (n_tests * n_buffers)
+    return max(1, min(samples, block_size))
+
+
+def parallel_permutations(job, iterator, samples, start=0):
+    """Apply ``job`` to blocks of permutations in the worker pool
+
+    Each job covers a contiguous range of permutations and writes its results
+    directly to the shared distribution (see :class:`PermutationJob`).
+
+    Parameters
+    ----------
+    job : PermutationJob
+        Job function.
+    iterator : iterator
+        Blocks of permutations.
+    samples : int
+        Number of permutations.
+    start : int
+        Index of the first permutation in ``iterator``.
+
+    Yields
+    ------
+    i : int
+        Index of the first permutation in a completed block.
+    n : int
+        Number of permutations in the block.
+    """
+    block_size = samples // (4 * CONFIG['n_workers'])
+    block_size = max(1, min(PERMUTATION_JOB_SIZE, block_size))
+    jobs = ((start + i * block_size, perms) for i, perms in
+            enumerate(permutation_blocks(iterator, block_size)))
+    with tqdm(desc="Permutation test", total=samples, unit=' permutations',
+              disable=CONFIG['tqdm']) as pbar:
+        for i, n in parallel_map(job, jobs):
+            pbar.update(n)
+            yield start + i * block_size, n
+
+
+def skip_permutations(iterator, n):
+    "Skip the first ``n`` permutations in an iterator over blocks of permutations"
+    for perms in iterator:
+        if n >= len(perms):
+            n -= len(perms)
+            continue
+        yield perms[n:]
+        n = 0
+
+
+class PermutationCheckpoint(object):
+    """Periodically save the partial permutation distribution of a test
+
+    Parameters
+    ----------
+    path : str | None
+        Checkpoint file (``None`` to disable checkpoints).
+    dists : list of NDPermutationDistribution
+        Distributions computed from the same permutations.
+
+    Notes
+    -----
+    The checkpoint file contains the maximum statistics for the first
+    ``n_done`` permutations, the seed for the permutations, and a key for the
+    original data and test settings. Since permutations are generated
+    deterministically from the seed, the permutations in a checkpoint are
+    identical to the first permutations of a test with more samples. A
+    checkpoint can thus be used to resume an interrupted test, or to extend a
+    test to more samples.
+    """
+    def __init__(self, path, dists):
+        self.path = path
+        self.dists = dists
+        self.n_done = 0
+        self._pending = {}
+        self._t_saved = current_time()
+
+    @LazyProperty
+    def key(self):
+        return checkpoint_key(self.dists)
+
+    def load(self):
+        "Load the permutations saved in the checkpoint file (if it matches)"
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as fid:
+            state = pickle.load(fid)
+        if state['key'] != self.key:
+            logging.getLogger(__name__).warning(
+                "Ignoring permutation checkpoint that does not match the test: "
+                "%s", self.path)
+            return
+        n = min(state['n_done'], self.dists[0].samples)
+        for dist, x in zip(self.dists, state['dists']):
+            if dist.dist is not None:
+                dist.dist[:n] = x[:n]
+        self.n_done = n
+        logging.getLogger(__name__).info(
+            "Resuming permutations from checkpoint (%i done): %s", n, self.path)
+
+    def update(self, start, n):
+        "Register permutations ``start`` to ``start + n`` as completed"
+        self._pending[start] = n
+        while self.n_done in self._pending:
+            self.n_done += self._pending.pop(self.n_done)
+        if current_time() - self._t_saved > CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        "Save the completed permutations"
+        if self.path is None:
+            return
+        state = {
+            'key': self.key,
+            'seed': self.dists[0].seed,
+            'n_done': self.n_done,
+            'dists': [None if d.dist is None else d.dist[:self.n_done] for d in self.dists],
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as fid:
+            pickle.dump(state, fid, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._t_saved = current_time()
+
+    def remove(self):
+        "Remove the checkpoint file"
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def checkpoint_key(dists):
+    "Key identifying the data, settings and seed of permutation distributions"
+    key = hashlib.sha1()
+    for dist in dists:
+        settings = (dist.kind, dist.threshold, dist.tfce, dist.tail, dist.tstart,
+                    dist.tstop, dist.parc, dist.criteria, dist.shape, dist.seed,
+                    dist.dist is None)
+        if dist.sampling is not None:
+            # sign flips drawn with different algorithms are not compatible
+            settings += (dist.sampling,)
+        key.update(repr(settings).encode())
+        key.update(np.ascontiguousarray(dist._original_param_map).tobytes())
+    return key.hexdigest()
+
+
+def save_checkpoint(path, res):
+    """Save the permutations of a test result as checkpoint
+
+    A test with the same data and settings that is computed with
+    ``checkpoint=path`` reuses these permutations, which allows extending a
+    test to more samples.
+
+    Parameters
+    ----------
+    path : str
+        Checkpoint file.
+    res : NDTest
+        Test result with permutation distribution.
+
+    Returns
+    -------
+    saved : bool
+        Whether a checkpoint was saved (``res`` may not contain permutations).
+    """
+    dists = res._cdist if isinstance(res._cdist, list) else [res._cdist]
+    if dists[0] is None or all(dist.dist is None for dist in dists):
+        return False
+    checkpoint = PermutationCheckpoint(path, dists)
+    checkpoint.n_done = dists[0].samples
+    checkpoint.save()
+    return True
+
+
+class AdaptiveStop(object):
+    """Stopping rule for adaptive tests (``samples='adaptive'``)
+
+    Calling the object with the number of completed permutations returns
+    whether all p-values are decided (evaluated every ``adaptive['step']``
+    permutations).
+    """
+    def __init__(self, dists):
+        self.dists = [d for d in dists if d.adaptive and d.dist is not None]
+        self.step = min((d.adaptive['step'] for d in self.dists), default=0)
+        self._next = self.step
+
+    def __call__(self, n):
+        if not self.dists or n < self._next:
+            return False
+        self._next = n + self.step
+        return all(d.is_decided(n) for d in self.dists)
+
 
-        stat_maps = test.preallocate(dist.shape)
-        if thresholds:
-            stat_maps_iter = tuple(zip(stat_maps, thresholds, dists))
+def share_dists(dists):
+    """Move permutation distributions to shared memory for worker processes
+
+    While the permutations are computed, ``dist.dist`` is a view of the
+    shared memory, so that partial results can be used for checkpoints and
+    adaptive stopping.
+    """
+    shared = []
+    for dist in dists:
+        if dist.dist is None:
+            shared.append(None)
         else:
-            stat_maps_iter = tuple(zip(stat_maps, dists))
+            shared_dist = SharedArray.from_array(dist.dist)
+            dist.dist = shared_dist.x
+            shared.append(shared_dist)
+    return shared
 
-        for i, perm in enumerate(iterator):
-            test.map(y, perm)
-            if thresholds:
-                for m, t, d in stat_maps_iter:
-                    if d.do_permutation:
-                        d.dist[i] = map_processor.max_stat(m, t)
-            else:
-                for m, d in stat_maps_iter:
-                    if d.do_permutation:
-                        d.dist[i] = map_processor.max_stat(m)
 
-    for d in dists:
-        if d.do_permutation:
-            d.finalize()
+def unshare_dists(dists, shared):
+    "Copy permutation distributions back from shared memory"
+    for dist, shared_dist in zip(dists, shared):
+        if shared_dist is not None:
+            dist.dist = np.array(shared_dist.x)
+            shared_dist.close()
+
+
+def truncate_dists(dists, n):
+    "Keep only the first ``n`` permutations (after stopping an adaptive test)"
+    for dist in dists:
+        if dist.dist is not None:
+            dist.dist = dist.dist[:n].copy()
+        dist.samples = n
 
 
-def setup_workers_me(test_func, dists, thresholds):
-    "Initialize workers for permutation tests"
-    logger = logging.getLogger(__name__)
-    logger.debug("Setting up %i worker processes..." % CONFIG['n_workers'])
-    permutation_queue = SimpleQueue()
-    dist_queue = SimpleQueue()
-    kill_beacon = Event()
+def run_permutation(test_func, dist, iterator, *args, batch_func=None):
+    """Compute the permutation distribution
 
-    # permutation workers
+    Parameters
+    ----------
+    test_func : callable
+        ``test_func(y, *args, out, perm)`` computes the stat-map for a single
+        permutation.
+    dist : NDPermutationDistribution
+        Distribution to which the permutations are added.
+    iterator : iterator
+        Blocks of permutations (see :func:`permutation_blocks`).
+    ...
+        Additional arguments for ``test_func``.
+    batch_func : callable
+        Batched version of ``test_func``: ``batch_func(y, *args, out, perms)``,
+        with ``perms`` stacking multiple permutations in the first axis, and
+        ``out`` an array of shape ``(n_perm, n_tests)``. Used in the
+        single-process mode, where it allows computing stat-maps for many
+        permutations with a single matrix multiplication.
+    """
+    checkpoint = PermutationCheckpoint(dist.checkpoint, [dist])
+    checkpoint.load()
+    stop = AdaptiveStop([dist])
+    i0 = checkpoint.n_done
+    samples = dist.samples - i0
+    iterator = skip_permutations(iterator, i0)
+    try:
+        if samples == 0:
+            pass
+        elif CONFIG['n_workers']:
+            y, stat_map_shape = dist.data_for_permutation()
+            shared = share_dists([dist])
+            job = PermutationJob(y, stat_map_shape, test_func, args, dist.map_args, shared[0])
+            try:
+                results = parallel_permutations(job, iterator, samples, i0)
+                for i, n in results:
+                    checkpoint.update(i, n)
+                    if stop(checkpoint.n_done):
+                        results.close()
+                        break
+            finally:
+                unshare_dists([dist], shared)
+                y.close()
+        elif batch_func is None:
+            y = dist.data_for_permutation(False)
+            map_processor = get_map_processor(*dist.map_args)
+            stat_map = np.empty(dist.shape, y.dtype)
+            stat_map_flat = stat_map.ravel()
+            for i, perm in enumerate(chain.from_iterable(iterator), i0):
+                test_func(y, *args, stat_map_flat, perm)
+                dist.dist[i] = map_processor.max_stat(stat_map)
+                checkpoint.update(i, 1)
+                if stop(checkpoint.n_done):
+                    break
+        else:
+            y = dist.data_for_permutation(False)
+            map_processor = get_map_processor(*dist.map_args)
+            n_tests = y.shape[1]
+            block_size = permutation_block_size(n_tests, samples)
+            if dist.adaptive:
+                block_size = min(block_size, stop.step)
+            stat_maps = np.empty((block_size, n_tests), y.dtype)
+            i = i0
+            for perms in permutation_blocks(iterator, block_size):
+                n = len(perms)
+                batch_func(y, *args, stat_maps[:n], perms)
+                for stat_map in stat_maps[:n]:
+                    dist.dist[i] = map_processor.max_stat(stat_map.reshape(dist.shape))
+                    i += 1
+                checkpoint.update(i - n, n)
+                if stop(checkpoint.n_done):
+                    break
+    except BaseException:
+        checkpoint.save()
+        raise
+    checkpoint.remove()
+    if checkpoint.n_done < dist.samples:
+        truncate_dists([dist], checkpoint.n_done)
+    dist.finalize()
+
+
+def run_permutation_me(test, dists, iterator):
     dist = dists[0]
-    y, y_flat_shape, stat_map_shape = dist.data_for_permutation()
-    args = (permutation_queue, dist_queue, y, y_flat_shape, stat_map_shape,
-            test_func, dist.map_args, thresholds, kill_beacon)
-    workers = []
-    for _ in range(CONFIG['n_workers']):
-        w = Process(target=permutation_worker_me, args=args)
-        w.start()
-        workers.append(w)
-
-    # distribution worker
-    args = ([d.dist_array for d in dists], dist.dist_shape, dist_queue, kill_beacon)
-    w = Process(target=distribution_worker_me, args=args)
-    w.start()
-    workers.append(w)
-
-    return workers, permutation_queue, kill_beacon
-
-
-def permutation_worker_me(in_queue, out_queue, y, y_flat_shape, stat_map_shape,
-                          test, map_args, thresholds, kill_beacon):
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    if CONFIG['nice']:
-        os.nice(CONFIG['nice'])
-
-    n = reduce(operator.mul, y_flat_shape)
-    y = np.frombuffer(y, np.float64, n).reshape(y_flat_shape)
-    iterator = test.preallocate(stat_map_shape)
-    if thresholds:
-        iterator = tuple(zip(iterator, thresholds))
+    if dist.kind == 'cluster':
+        thresholds = tuple(d.threshold for d in dists)
     else:
-        iterator = tuple(iterator)
-    map_processor = get_map_processor(*map_args)
-    while not kill_beacon.is_set():
-        perm = in_queue.get()
-        if perm is None:
-            break
-        test.map(y, perm)
-
-        if thresholds:
-            max_v = [map_processor.max_stat(m, t) for m, t in iterator]
-        else:
-            max_v = [map_processor.max_stat(m) for m in iterator]
-        out_queue.put(max_v)
-
-
-def distribution_worker_me(dist_arrays, dist_shape, in_queue, kill_beacon):
-    "Worker that accumulates values and places them into the distribution"
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    n = reduce(operator.mul, dist_shape)
-    dists = [d if d is None else np.frombuffer(d, np.float64, n).reshape(dist_shape)
-             for d in dist_arrays]
-    samples = dist_shape[0]
-    for i in trange(samples, desc="Permutation test", unit=' permutations',
-                    disable=CONFIG['tqdm']):
-        for dist, v in zip(dists, in_queue.get()):
-            if dist is not None:
-                dist[i] = v
-        if kill_beacon.is_set():
-            return
+        thresholds = None
+
+    checkpoint = PermutationCheckpoint(dist.checkpoint, dists)
+    checkpoint.load()
+    stop = AdaptiveStop(dists)
+    i0 = checkpoint.n_done
+    samples = dist.samples - i0
+    iterator = skip_permutations(iterator, i0)
+    try:
+        if samples == 0:
+            pass
+        elif CONFIG['n_workers']:
+            y, stat_map_shape = dist.data_for_permutation()
+            shared = share_dists(dists)
+            job = PermutationJobME(y, stat_map_shape, test, thresholds, dist.map_args, shared)
+            try:
+                results = parallel_permutations(job, iterator, samples, i0)
+                for i, n in results:
+                    checkpoint.update(i, n)
+                    if stop(checkpoint.n_done):
+                        results.close()
+                        break
+            finally:
+                unshare_dists(dists, shared)
+                y.close()
+        else:
+            y = dist.data_for_permutation(False)
+            map_processor = get_map_processor(*dist.map_args)
+            n_tests = y.shape[1]
+            n_buffers = test.p.x.shape[1] + test.n_effects
+            block_size = permutation_block_size(n_tests, samples, n_buffers)
+            if dist.adaptive:
+                block_size = min(block_size, stop.step)
+            f_maps = np.empty((block_size, test.n_effects, n_tests), y.dtype)
+            i = i0
+            for perms in permutation_blocks(iterator, block_size):
+                n = len(perms)
+                test.map_batch(y, perms, f_maps[:n])
+                for stat_maps in f_maps[:n]:
+                    for i_effect, (m, d) in enumerate(zip(stat_maps, dists)):
+                        if not d.do_permutation:
+                            continue
+                        m = m.reshape(dist.shape)
+                        if thresholds:
+                            d.dist[i] = map_processor.max_stat(m, thresholds[i_effect])
+                        else:
+                            d.dist[i] = map_processor.max_stat(m)
+                    i += 1
+                checkpoint.update(i - n, n)
+                if stop(checkpoint.n_done):
+                    break
+    except BaseException:
+        checkpoint.save()
+        raise
+    checkpoint.remove()
+    if checkpoint.n_done < dist.samples:
+        truncate_dists(dists, checkpoint.n_done)
+
+    for d in dists:
+        if d.do_permutation:
+            d.finalize()
 
 
 # Backwards compatibility for pickling
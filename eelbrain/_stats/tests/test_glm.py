@@ -226,6 +226,25 @@ def test_anova_perm():
         assert_allclose(r2, r1, 1e-6, 1e-6)
 
 
+def test_anova_perm_batch():
+    "Test ANOVA for blocks of permutations"
+    ds = datasets.get_uts()
+    y = ds['uts'].x
+    n_cases, n_tests = y.shape
+    perms = np.array(list(map(tuple, permute_order(n_cases, 4))))
+    for x, sub in (('A*B', None), ('A*B*rm', None), ('A*B', slice(1, None))):
+        if sub is None:
+            y_ = y
+            perms_ = perms
+        else:
+            y_ = y[sub]
+            perms_ = np.array(list(map(tuple, permute_order(len(y_), 4))))
+        aov = glm._nd_anova(ds[sub].eval(x) if sub else ds.eval(x))
+        f_batch = aov.map_batch(y_, perms_, np.empty((4, aov.n_effects, n_tests)))
+        for perm, f in zip(perms_, f_batch):
+            assert_allclose(f, aov.map(y_, perm), 1e-6, 1e-6)
+
+
 def test_anova_r_adler():
     """Test ANOVA accuracy by comparing with R (Adler dataset of car package)
 
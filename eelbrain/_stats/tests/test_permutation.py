@@ -3,10 +3,12 @@ import sys
 
 from nose.tools import eq_, ok_, assert_not_equal
 import numpy as np
+from numpy.testing import assert_array_equal
 
-from eelbrain import Factor, Var
+from eelbrain import Factor, Var, datasets
 from eelbrain._stats.permutation import (
-    resample, permute_order, permute_sign_flip)
+    resample, permute_order, permute_order_blocks, permute_sign_flip,
+    permute_sign_flip_blocks, sign_flip_sampling)
 
 
 def test_permutation():
@@ -58,3 +60,58 @@ def test_permutation_sign_flip():
     else:
         target = [(-1, 1, -1, -1), (-1, -1, 1, -1), (1, -1, -1, 1)]
     eq_(list(map(tuple, permute_sign_flip(4, 3))), target)
+
+
+def test_permutation_sequences():
+    "Test that permutations are the same as in previous versions"
+    eq_(list(map(tuple, permute_order(8, 3))),
+        [(6, 2, 1, 7, 3, 0, 5, 4), (2, 5, 7, 4, 6, 3, 1, 0),
+         (3, 7, 4, 6, 0, 2, 1, 5)])
+    unit = Factor('abc', tile=3)
+    eq_(list(map(tuple, permute_order(9, 3, unit=unit))),
+        [(6, 7, 2, 3, 1, 8, 0, 4, 5), (6, 7, 5, 0, 4, 2, 3, 1, 8),
+         (3, 1, 2, 6, 4, 5, 0, 7, 8)])
+    eq_(list(map(tuple, permute_sign_flip(8, 3))),
+        [(-1, 1, 1, -1, -1, 1, -1, -1), (-1, -1, 1, 1, 1, -1, -1, 1),
+         (-1, -1, 1, 1, 1, 1, -1, -1)])
+    # blocks
+    for block in permute_order_blocks(9, 3, unit=unit):
+        eq_(list(map(tuple, block))[1], (6, 7, 5, 0, 4, 2, 3, 1, 8))
+    for block in permute_sign_flip_blocks(8, 3):
+        eq_(tuple(block[2]), (-1, -1, 1, 1, 1, 1, -1, -1))
+
+
+def test_permutation_sign_flip_sequences():
+    "Test that sign flips are the same as with random.sample()"
+    # (n, samples): first three and last sign flip, encoded as integers
+    targets = {
+        (12, 1000): ([3459, 1578, 3105], 631),
+        (14, 10000): ([13836, 6312, 12419], 8234),
+        (16, 10000): ([55341, 25248, 49674], 42581),
+        (20, 10000): ([885441, 403959, 794773], 472039),
+    }
+    for (n, samples), (first, last) in targets.items():
+        signs = np.vstack(list(map(np.copy, permute_sign_flip_blocks(n, samples))))
+        eq_(signs.shape, (samples, n))
+        seqs = ((signs == -1) * 2 ** np.arange(n)).sum(1)
+        eq_(list(seqs[:3]), first)
+        eq_(seqs[-1], last)
+    eq_(sign_flip_sampling(12, 1000), 'pool')
+    eq_(sign_flip_sampling(16, 10000), 'pool')
+    eq_(sign_flip_sampling(20, 10000), 'set')
+    eq_(sign_flip_sampling(20, -1), 'all')
+
+
+def test_permutation_blocks():
+    "Test that blocks of permutations match individual permutations"
+    ds = datasets.get_uts(nrm=True)
+    for unit in (None, ds['rm'], ds.eval('nrm(A)')):
+        perms = np.array(list(map(tuple, permute_order(60, 25, unit=unit))))
+        blocks = list(map(np.copy, permute_order_blocks(60, 25, unit=unit, block_size=10)))
+        eq_([len(block) for block in blocks], [10, 10, 5])
+        assert_array_equal(np.vstack(blocks), perms)
+
+    for n, samples in ((6, -1), (20, 25), (130, 25)):
+        signs = np.array(list(map(tuple, permute_sign_flip(n, samples))))
+        blocks = list(map(np.copy, permute_sign_flip_blocks(n, samples, block_size=10)))
+        assert_array_equal(np.vstack(blocks), signs)
@@ -8,7 +8,7 @@ import scipy.stats
 
 from eelbrain import datasets
 from eelbrain._stats import stats
-from eelbrain._stats.permutation import permute_order
+from eelbrain._stats.permutation import permute_order, permute_sign_flip
 
 
 def test_corr():
@@ -40,6 +40,12 @@ def test_corr():
             r_sp, _ = scipy.stats.pearsonr(y_perm[:, i], x)
             assert_almost_equal(corr[i], r_sp)
 
+    # batch
+    perms = np.array(list(map(tuple, permute_order(n_cases, 5))))
+    corr_batch = stats.corr_batch(y, x, np.empty((5, y.shape[1])), perms)
+    for perm, corr_ in zip(perms, corr_batch):
+        assert_allclose(corr_, stats.corr(y, x, perm=perm))
+
 
 def test_lm():
     "Test linear model function against scipy lstsq"
@@ -115,6 +121,20 @@ def test_t_1samp():
     t = scipy.stats.ttest_1samp(y, 0, 0)[0]
     assert_allclose(stats.t_1samp(y), t, 10)
 
+    # batch
+    y = ds['uts'].x
+    signs = np.array(list(map(tuple, permute_sign_flip(len(y), 5))), np.int8)
+    t_batch = stats.t_1samp_perm_batch(y, np.empty((5, y.shape[1])), signs)
+    for sign, t_ in zip(signs, t_batch):
+        assert_allclose(t_, stats.t_1samp(y * sign[:, None]))
+    # single precision with a large offset
+    y = ds['uts'].x + 1000
+    t_batch = stats.t_1samp_perm_batch(y.astype(np.float32), np.empty((5, y.shape[1]), np.float32), signs)
+    for sign, t_ in zip(signs, t_batch):
+        t_ref = stats.t_1samp(y * sign[:, None])
+        # t can be close to 0, so the error is relative to the largest t
+        assert_allclose(t_, t_ref, 0, 1e-3 * np.abs(t_ref).max())
+
 
 def test_t_ind():
     "Test independent samples t-test"
@@ -139,3 +159,11 @@ def test_t_ind():
         y_perm[perm] = y
         t_sp, _ = scipy.stats.ttest_ind(y_perm[:n], y_perm[n:])
         assert_allclose(t, t_sp)
+
+    # batch
+    y = y.reshape((n_cases, -1))
+    y[:, 0] = 1  # zero variance
+    perms = np.array(list(map(tuple, permute_order(n_cases, 5))))
+    t_batch = stats.t_ind_batch(y, groups, np.empty((5, y.shape[1])), perms)
+    for perm, t_ in zip(perms, t_batch):
+        assert_allclose(t_, stats.t_ind(y, groups, perm=perm))
@@ -1,7 +1,8 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
-from itertools import product
+from itertools import chain, product
 import pickle
 import logging
+import os
 import sys
 
 from nose.tools import (
@@ -10,15 +11,20 @@ from nose.tools import (
     assert_raises)
 import numpy as np
 from numpy.testing import assert_array_equal, assert_allclose
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 import eelbrain
 from eelbrain import (Dataset, NDVar, Categorial, Scalar, UTS, Sensor, configure,
                       datasets, test, testnd, set_log_level, cwt_morlet)
 from eelbrain._exceptions import ZeroVariance
 from eelbrain._stats.testnd import (Connectivity, NDPermutationDistribution, label_clusters,
-                                    _MergedTemporalClusterDist, find_peaks)
+                                    _MergedTemporalClusterDist, find_peaks,
+                                    label_clusters_binary, label_components, save_checkpoint,
+                                    tfce)
 from eelbrain._utils.system import IS_WINDOWS
-from eelbrain._utils.testing import (assert_dataobj_equal, assert_dataset_equal,
+from eelbrain._utils.testing import (TempDir, assert_dataobj_equal, assert_dataset_equal,
                                      requires_mne_sample_data)
 
 
@@ -154,6 +160,46 @@ def test_anova():
     assert [p.min() for p in res.p] == [0.0, 0.6, 0.9]
 
 
+def test_adaptive_samples():
+    "Test adaptive number of permutations"
+    ds = datasets.get_uts(True)
+    results = []
+    for n_workers in (0, True):
+        configure(n_workers=n_workers)
+        res = testnd.ttest_rel('uts', 'A', match='rm', ds=ds, samples='adaptive', pmin=0.05)
+        eq_(res.samples, 'adaptive')
+        assert_less(res.n_samples, 10000)
+        eq_(res._cdist.dist.shape, (res.n_samples,))
+        assert res._cdist.is_decided(res.n_samples)
+        assert_in("Adaptive stopping", str(res.info_list()))
+        results.append(res)
+        # multiple effects
+        res = testnd.anova('utsnd', 'A*B*rm', ds=ds, samples='adaptive', pmin=0.05)
+        for cdist in res._cdist:
+            eq_(cdist.samples, res.n_samples)
+    configure(n_workers=True)
+    # same permutations with and without multiprocessing
+    res, res_mp = results
+    eq_(res_mp.n_samples, res.n_samples)
+    assert_allclose(res_mp._cdist.dist, res._cdist.dist)
+    assert_dataset_equal(res_mp.clusters, res.clusters)
+    # with 15 subjects, sign flips are drawn for the maximum number of
+    # permutations, which a fixed number of samples only reproduces with 10000
+    assert_in("reproduces them only with samples=10000", str(res.info_list()))
+    res_fixed = testnd.ttest_rel('uts', 'A', match='rm', ds=ds, samples=10000, pmin=0.05)
+    assert_allclose(res._cdist.dist, res_fixed._cdist.dist[:res.n_samples])
+    # custom stopping rule
+    configure(adaptive_p=0.01, adaptive_confidence=0.99, adaptive_step=50)
+    try:
+        res = testnd.ttest_rel('uts', 'A', match='rm', ds=ds, samples='adaptive', pmin=0.05)
+    finally:
+        configure(adaptive_p=0.05, adaptive_confidence=0.999, adaptive_step=100)
+    eq_(res._cdist.adaptive['p'], 0.01)
+    eq_(res._cdist.adaptive['confidence'], 0.99)
+    assert res._cdist.is_decided(res.n_samples)
+    assert_in("exclude p=0.01", str(res.info_list()))
+
+
 def test_anova_incremental():
     "Test testnd.anova() with incremental f-tests"
     ds = datasets.get_uts()
@@ -393,6 +439,34 @@ def test_corr():
     assert_dataobj_equal(res.p, res_.p)
 
 
+def test_permutation_checkpoint():
+    "Test resuming and extending permutation distributions"
+    ds = datasets.get_uts(True)
+    tempdir = TempDir()
+    path = os.path.join(tempdir, 'test.checkpoint')
+    for n_workers in (0, True):
+        configure(n_workers=n_workers)
+        res = testnd.ttest_rel('uts', 'A', match='rm', ds=ds, samples=20, pmin=0.05)
+        res_short = testnd.ttest_rel('uts', 'A', match='rm', ds=ds, samples=5, pmin=0.05)
+        ok_(save_checkpoint(path, res_short))
+        res_ext = testnd.ttest_rel('uts', 'A', match='rm', ds=ds, samples=20, pmin=0.05, checkpoint=path)
+        assert_allclose(res_ext._cdist.dist, res._cdist.dist)
+        assert not os.path.exists(path)
+        # checkpoint from a different test is ignored
+        res_short = testnd.ttest_rel('uts', 'A', match='rm', ds=ds, samples=5, pmin=0.1)
+        save_checkpoint(path, res_short)
+        res_ext = testnd.ttest_rel('uts', 'A', match='rm', ds=ds, samples=20, pmin=0.05, checkpoint=path)
+        assert_allclose(res_ext._cdist.dist, res._cdist.dist)
+        # multi-effect test
+        res = testnd.anova('utsnd', 'A*B*rm', ds=ds, samples=10, tfce=True)
+        res_short = testnd.anova('utsnd', 'A*B*rm', ds=ds, samples=4, tfce=True)
+        save_checkpoint(path, res_short)
+        res_ext = testnd.anova('utsnd', 'A*B*rm', ds=ds, samples=10, tfce=True, checkpoint=path)
+        for cdist, cdist_ext in zip(res._cdist, res_ext._cdist):
+            assert_allclose(cdist_ext.dist, cdist.dist)
+    configure(n_workers=True)
+
+
 def test_t_contrast():
     ds = datasets.get_uts()
 
@@ -457,6 +531,94 @@ def test_labeling():
     assert_equal(len(cids), 6)
     assert_array_equal(cmap > 0, np.abs(pmap) > 2)
 
+    # labeling in multiple threads
+    ds = datasets.get_uts(True)
+    conn = Connectivity(ds['utsnd'].dims[1:])
+    src, dst = conn.custom[0][0].T
+    np.random.seed(0)
+    for _ in range(10):
+        bin_map = np.random.random((5, 100)) > 0.4
+        cmap = np.empty(bin_map.shape, np.uint32)
+        n = label_components(bin_map, cmap, conn, 1)
+        # reference: connected components of the graph of active elements
+        index = np.arange(bin_map.size).reshape(bin_map.shape)
+        a = np.concatenate((index[src].ravel(), index[:, :-1].ravel()))
+        b = np.concatenate((index[dst].ravel(), index[:, 1:].ravel()))
+        active = bin_map.ravel()[a] & bin_map.ravel()[b]
+        graph = coo_matrix((np.ones(active.sum()), (a[active], b[active])),
+                           (bin_map.size, bin_map.size))
+        _, ref = connected_components(graph, False)
+        ref = ref.reshape(bin_map.shape)
+        eq_(n, len(np.unique(ref[bin_map])))
+        eq_(len(set(zip(ref[bin_map], cmap[bin_map]))), n)
+        assert_array_equal(cmap[~bin_map], 0)
+        for n_threads in (2, 3, 7):
+            cmap_t = np.empty(bin_map.shape, np.uint32)
+            eq_(label_components(bin_map, cmap_t, conn, n_threads), n)
+            assert_array_equal(cmap_t, cmap)
+
+
+def test_stat_dtype():
+    "Test computing permutations in single precision"
+    ds = datasets.get_uts(True)
+    # data with a large offset relative to their variance
+    ds['offset'] = ds['utsnd'] + 1000
+    tests = (
+        (lambda: testnd.ttest_rel('utsnd', 'A', match='rm', ds=ds, samples=20), 1e-4),
+        (lambda: testnd.ttest_ind('utsnd', 'A', ds=ds, samples=20, tfce=True), 1e-4),
+        (lambda: testnd.corr('utsnd', 'Y', ds=ds, samples=20), 1e-4),
+        (lambda: testnd.anova('utsnd', 'A*B*rm', ds=ds, samples=20, tfce=True), 1e-4),
+        (lambda: testnd.anova('utsnd', 'A*B', ds=ds[3:], samples=20), 1e-4),
+        # the offset is retained in float32 with a precision of ~1e-4
+        (lambda: testnd.ttest_1samp('offset', ds=ds, samples=20), 1e-3),
+        (lambda: testnd.anova('offset', 'A*B*rm', ds=ds, samples=20), 1e-3),
+        (lambda: testnd.anova('offset', 'A*B', ds=ds, samples=20), 1e-3),
+        (lambda: testnd.anova('offset', 'A*B', ds=ds[3:], samples=20), 1e-3),
+    )
+    for n_workers in (0, True):
+        configure(n_workers=n_workers)
+        for test_func, rtol in tests:
+            configure(stat_dtype='float64')
+            res = test_func()
+            configure(stat_dtype='float32')
+            res_32 = test_func()
+            dists = res._cdist if isinstance(res._cdist, list) else [res._cdist]
+            dists_32 = res_32._cdist if isinstance(res_32._cdist, list) else [res_32._cdist]
+            for dist, dist_32 in zip(dists, dists_32):
+                eq_(dist_32.dtype, np.float32)
+                assert_allclose(dist_32.dist, dist.dist, rtol)
+                # statistics for the actual data are always float64
+                assert_array_equal(dist_32._original_param_map, dist._original_param_map)
+    configure(n_workers=True, stat_dtype='float64')
+    assert_raises(ValueError, configure, stat_dtype='int32')
+
+
+def test_tfce():
+    "Test TFCE against labeling clusters at each height"
+    def tfce_reference(x, conn, dh=0.1, e=0.5, h=2.0):
+        out = np.zeros(x.shape)
+        for h_ in chain(np.arange(-dh, x.min(), -dh), np.arange(dh, x.max(), dh)):
+            bin_map = x >= h_ if h_ > 0 else x <= h_
+            cmap, cids = label_clusters_binary(bin_map, conn)
+            for cid in cids:
+                index = cmap == cid
+                out[index] += np.sum(index) ** e * abs(h_) ** h
+        return out
+
+    # grid connectivity
+    np.random.seed(0)
+    x = ndimage.gaussian_filter(np.random.normal(0, 10, (20, 30)), 1)
+    conn = Connectivity((Scalar('dim', range(20)), UTS(0, 0.01, 30)))
+    assert_allclose(tfce(x, 0, conn), tfce_reference(x, conn))
+    assert_allclose(tfce(x, 1, conn), tfce_reference(x.clip(0), conn))
+    assert_allclose(tfce(x, -1, conn), tfce_reference(x.clip(max=0), conn))
+
+    # custom connectivity
+    ds = datasets.get_uts(True)
+    x = ds[0, 'utsnd'].x * 3
+    conn = Connectivity(ds['utsnd'].dims[1:])
+    assert_allclose(tfce(x, 0, conn), tfce_reference(x, conn))
+
 
 def test_ttest_1samp():
     "Test testnd.ttest_1samp()"
@@ -11,25 +11,31 @@ x2 = ds['x2']
 %prun -s cumulative res = boosting(y, x1, 0, 1)
 
 """
+from collections import Counter
+from functools import partial
 import inspect
 from itertools import product
 from math import floor
-from multiprocessing import Process, Queue
-from multiprocessing.sharedctypes import RawArray
-import os
-import signal
+from threading import Event, Semaphore
 import time
-from threading import Event, Thread
 
 import numpy as np
+from scipy.ndimage import convolve1d
+from scipy.signal import get_window
 from scipy.stats import spearmanr
 from tqdm import tqdm
 
+from .. import fmtxt
 from .._config import CONFIG
-from .._data_obj import NDVar
+from .._data_obj import NDVar, dataobj_repr
 from .._utils import LazyProperty, user_activity
-from ._boosting_opt import l1, l2, generate_options, update_error
-from .shared import RevCorrData
+from .._utils.parallel import SharedArray, parallel_map, thread_map
+from ._boosting_opt import (
+    l1, l2, generate_options, update_error,
+    l2_correlation, l2_xcorr, l2_update_correlation, generate_options_l2,
+)
+from ._convolve import convolve_kernels
+from .shared import RevCorrData, SparseKernel
 
 
 # BoostingResult version
@@ -38,15 +44,23 @@ VERSION = 6
 # cross-validation
 N_SEGS = 10
 
-# process messages
-JOB_TERMINATE = -1
-
 # error functions
 ERROR_FUNC = {'l2': l2, 'l1': l1}
 DELTA_ERROR_FUNC = {'l2': 2, 'l1': 1}
 
 DELTA_REDUCTION_STEP = (None, None, None)
 
+# diagnostics for each boosting run
+STOP_REASONS = ('validation error', 'mindelta', 'oscillation')
+STOP_VALIDATION, STOP_MINDELTA, STOP_OSCILLATION = range(3)
+DIAGNOSTICS_DTYPE = np.dtype([
+    ('iterations', np.int32),
+    ('best_iteration', np.int32),
+    ('delta_reductions', np.int32),
+    ('time', np.float32),
+    ('stop', np.int8),
+])
+
 
 class BoostingResult(object):
     """Result from boosting a temporal response function
@@ -66,6 +80,9 @@ class BoostingResult(object):
     r : float | NDVar
         Correlation between the measured response and the response predicted
         with ``h``. Type depends on the ``y`` parameter to :func:`boosting`.
+        With ``test=True``, correlation between the measured response and the
+        prediction from the kernels that were estimated without the test
+        partitions.
     spearmanr : float | NDVar
         As ``r``, the Spearman rank correlation.
     t_run : float
@@ -89,12 +106,44 @@ class BoostingResult(object):
         Mean that was subtracted from ``x``.
     x_scale : NDVar | scalar | tuple
         Scale by which ``x`` was divided.
+    incremental : bool
+        Incremental parameter used.
+    partitions : None | int | tuple
+        Partitions parameter used.
+    test : bool
+        Test parameter used.
+    diagnostics : array (n_y, n_partitions)
+        Record array with one entry for each boosting run (signals in ``y``
+        are flattened): ``iterations``, ``best_iteration`` (the iteration
+        whose kernel was kept), ``delta_reductions`` (number of times that
+        ``delta`` was halved), ``time`` (in seconds) and ``stop`` (index into
+        :attr:`STOP_REASONS`). See :meth:`timing_report` for a summary.
+    basis : scalar
+        Basis parameter used.
+    basis_window : str
+        Basis_window parameter used.
+    init : None | str
+        Description of the kernels used to initialize boosting (the ``init``
+        parameter).
+
+    Notes
+    -----
+    The kernel is stored as its non-zero coefficients (see
+    :class:`SparseKernel`), and ``h`` is expanded when it is first accessed.
     """
+    STOP_REASONS = STOP_REASONS
+
     def __init__(self, h, r, isnan, t_run, version, delta, mindelta, error,
                  spearmanr, fit_error, scale_data, y_mean, y_scale, x_mean,
                  x_scale, y=None, x=None, tstart=None, tstop=None,
-                 **experimental_parameters):
-        self.h = h
+                 incremental=False, partitions=None, test=False,
+                 diagnostics=None, basis=0, basis_window='hamming',
+                 init=None, **experimental_parameters):
+        if isinstance(h, SparseKernel):
+            self._h_sparse = h
+        else:
+            self._h_sparse = None
+            self.h = h
         self.r = r
         self.isnan = isnan
         self.t_run = t_run
@@ -113,12 +162,21 @@ class BoostingResult(object):
         self.x = x
         self.tstart = tstart
         self.tstop = tstop
+        self.incremental = incremental
+        self.partitions = partitions
+        self.test = test
+        self.diagnostics = diagnostics
+        self.basis = basis
+        self.basis_window = basis_window
+        self.init = init
         self._experimental_parameters = experimental_parameters
 
     def __getstate__(self):
         state = {attr: getattr(self, attr) for attr, param in
                  inspect.signature(self.__class__).parameters.items()
-                 if param.kind is not inspect.Parameter.VAR_KEYWORD}
+                 if param.kind is not inspect.Parameter.VAR_KEYWORD and
+                 attr != 'h'}
+        state['h'] = self.h if self._h_sparse is None else self._h_sparse
         state.update(self._experimental_parameters)
         return state
 
@@ -140,6 +198,10 @@ class BoostingResult(object):
                 items.append('%s=%r' % (name, value))
         return '<%s>' % ', '.join(items)
 
+    @LazyProperty
+    def h(self):
+        return self._h_sparse.expand()
+
     @LazyProperty
     def h_scaled(self):
         if self.y_scale is None:
@@ -157,6 +219,81 @@ class BoostingResult(object):
         else:
             return self.h[0].time
 
+    def timing_report(self):
+        """Summarize iterations and timing of the boosting runs
+
+        Returns
+        -------
+        table : fmtxt.Table
+            Number of runs, mean number of iterations and delta reductions,
+            and time for each reason for stopping.
+        """
+        if self.diagnostics is None:
+            raise RuntimeError("BoostingResult does not contain diagnostics; "
+                               "it was estimated with an older version")
+        d = self.diagnostics.ravel()
+        table = fmtxt.Table('lrrrrr')
+        table.cells('Stop', 'Runs', 'Iterations', 'Delta reductions',
+                    'Time (s)', 'ms/iteration')
+        table.midrule()
+        rows = [(reason, d[d['stop'] == i]) for i, reason in enumerate(STOP_REASONS)]
+        rows.append(('total', d))
+        for reason, d_ in rows:
+            if len(d_) == 0:
+                continue
+            elif reason == 'total':
+                table.midrule()
+            iterations = d_['iterations'].sum()
+            t = d_['time'].sum(dtype=np.float64)
+            table.cell(reason)
+            table.cell(len(d_))
+            table.cell(fmtxt.stat(iterations / len(d_), '%.1f'))
+            table.cell(fmtxt.stat(d_['delta_reductions'].mean(), '%.1f'))
+            table.cell(fmtxt.stat(t, '%.2f'))
+            table.cell(fmtxt.stat(1000 * t / iterations, '%.3f'))
+        table.caption("Wall time of boosting: %.2f s" % self.t_run)
+        return table
+
+    def predict(self, x, name=None):
+        """Predict the response to ``x`` with the estimated kernel
+
+        Parameters
+        ----------
+        x : NDVar | sequence of NDVar
+            Predictors, corresponding to the ``x`` parameter to
+            :func:`boosting`, in their original scale.
+        name : str
+            Name of the prediction (default is the name of ``y``).
+
+        Returns
+        -------
+        y_pred : NDVar
+            Predicted response, including the mean of ``y`` if the data were
+            scaled for boosting.
+        """
+        from .._ndvar import convolve
+
+        if isinstance(self.h, NDVar):
+            if not isinstance(x, NDVar):
+                raise TypeError("x=%r: need NDVar for result with single "
+                                "predictor" % (x,))
+            xs = [x]
+            hs = [self.h_scaled]
+            x_means = [self.x_mean]
+        else:
+            xs = [x] if isinstance(x, NDVar) else list(x)
+            if len(xs) != len(self.h):
+                raise ValueError("x=%r: need %i predictors" % (x, len(self.h)))
+            hs = self.h_scaled
+            x_means = self.x_mean
+        if self.scale_data:
+            xs = [x_ - x_mean for x_, x_mean in zip(xs, x_means)]
+        y_pred = convolve(hs, xs)
+        if self.scale_data:
+            y_pred += self.y_mean
+        y_pred.name = self.y if name is None else name
+        return y_pred
+
     def _set_parc(self, parc):
         """Change the parcellation of source-space result
          
@@ -180,11 +317,13 @@ class BoostingResult(object):
 
         for attr in ('h', 'r', 'spearmanr', 'fit_error', 'y_mean', 'y_scale'):
             setattr(self, attr, sub_func(getattr(self, attr)))
+        self._h_sparse = None
 
 
 @user_activity
 def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
-             error='l2'):
+             error='l2', incremental=False, partitions=None, test=False,
+             basis=0, basis_window='hamming', init=None):
     """Estimate a temporal response function through boosting
 
     Parameters
@@ -212,6 +351,44 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
         i.e. ``delta`` is constant.
     error : 'l2' | 'l1'
         Error function to use (default is ``l2``).
+    incremental : bool
+        Evaluate candidate kernel changes from the correlation between
+        residual and stimuli, which is updated after each step, instead of
+        recomputing the error over the whole training data (only for
+        ``error='l2'``). This is much faster for long recordings; results can
+        differ from the default due to rounding errors when candidates are
+        almost tied.
+    partitions : int | sequence of scalar
+        Divide the data into this many partitions of equal length for
+        cross-validation (default 10). Alternatively, a sequence of times (in
+        seconds) at which to divide the data, for example the boundaries of
+        concatenated trials. Each partition is used once to decide when to
+        stop boosting, while the kernel is trained on the remaining
+        partitions; the final kernel is the average of those kernels.
+    test : bool
+        Hold out a test partition from each boosting run: the partition
+        following the validation partition is neither used for training nor
+        for stopping, and ``r``, ``spearmanr`` and ``fit_error`` are computed
+        from the predictions for these held-out partitions (default
+        ``False``: evaluate the averaged kernel on all data). Requires at least
+        3 partitions, but does not increase the number of boosting runs.
+    basis : scalar
+        Fit the TRF as a sum of basis functions of this width (in seconds)
+        instead of impulses (default 0: impulses). Basis functions are spaced
+        by half their width, which reduces the number of candidates evaluated
+        in each step and results in smooth kernels. Basis functions are
+        centered on lags between ``tstart`` and ``tstop``, so ``h`` extends
+        beyond ``tstart`` and ``tstop`` by half the basis function width.
+    basis_window : str
+        Window used as basis function (any window supported by
+        :func:`scipy.signal.get_window`; default ``'hamming'``).
+    init : BoostingResult | NDVar | sequence of NDVar
+        Start boosting from the kernels of a previous result instead of from
+        0, for example when adding a predictor to a model. Kernels are matched
+        to predictors by name; predictors without kernel start at 0, as do
+        lags outside of the previous TRF window. NDVars are interpreted in the
+        scale of the original data (like :attr:`BoostingResult.h_scaled`).
+        Not available with ``basis``.
 
     Returns
     -------
@@ -232,15 +409,245 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
     """
     # check arguments
     mindelta_ = delta if mindelta is None else mindelta
+    check_error(error, incremental)
+
+    data, y_data, x_data, trf_length, (window, lag_step), splits = prepare_data(
+        y, x, tstart, tstop, error, scale_data, partitions, test, basis,
+        basis_window)
+    h0 = init_kernel(data, init, tstart, trf_length, window)
+    n_y = len(y_data)
+
+    # progress bar
+    pbar = tqdm(desc="Boosting %i signals" % n_y if n_y > 1 else "Boosting",
+                total=n_y * len(splits), disable=CONFIG['tqdm'])
+    t_start = time.time()
+    job = (0, y_data, x_data, trf_length, lag_step, h0, splits)
+    (_, h_x, res, diagnostics), = boost_jobs(
+        [job], delta, mindelta_, error, incremental, pbar)
+    pbar.close()
+    dt = time.time() - t_start
+    return package_result(data, h_x, res, diagnostics, dt, tstart, tstop,
+                          delta, mindelta, error, scale_data, incremental,
+                          partitions, test, basis, basis_window, window, init)
+
+
+def boosting_batch(jobs, tstart, tstop, scale_data=True, delta=0.005,
+                   mindelta=None, error='l2', incremental=False,
+                   partitions=None, test=False, basis=0,
+                   basis_window='hamming', ds=None):
+    """Estimate temporal response functions for many ``(y, x)`` pairs
+
+    All boosting runs of all jobs are scheduled on the same worker pool, so
+    that workers do not idle between jobs.
+
+    Parameters
+    ----------
+    jobs : sequence of (y, x) | (y, x, init)
+        Each job is a ``(y, x)`` pair as for :func:`boosting`, optionally with
+        the ``init`` parameter as third element. If ``ds`` is specified,
+        ``y``, ``x`` and ``init`` can be names of :class:`Dataset` columns
+        that contain one :class:`NDVar` (or :class:`BoostingResult`) per
+        case.
+    tstart : float
+        Start of the TRF in seconds.
+    tstop : float
+        Stop of the TRF in seconds.
+    scale_data : bool | 'inplace'
+        Scale ``y`` and ``x`` before boosting (see :func:`boosting`).
+    delta : scalar
+        Step for changes in the kernel.
+    mindelta : scalar
+        If the error for the training data can't be reduced, divide ``delta``
+        in half until ``delta < mindelta``.
+    error : 'l2' | 'l1'
+        Error function to use (default is ``l2``).
+    incremental : bool
+        Use the incremental engine for the ``l2`` error (see :func:`boosting`).
+    partitions : int | sequence of scalar
+        Partitions for cross-validation (see :func:`boosting`).
+    test : bool
+        Evaluate the fit on held-out test partitions (see :func:`boosting`).
+    basis : scalar
+        Width of the basis functions (see :func:`boosting`).
+    basis_window : str
+        Window used as basis function (see :func:`boosting`).
+    ds : Dataset
+        If ``jobs`` refer to columns by name, each job is repeated for each
+        case in ``ds``.
+
+    Yields
+    ------
+    index : int
+        Index of the job. With ``ds``, jobs are numbered by job first, i.e.
+        ``index = job_index * ds.n_cases + case_index``.
+    result : BoostingResult
+        Result for the job (``t_run`` is the time from the start of the batch
+        until the job was done).
+
+    Notes
+    -----
+    Results are yielded as soon as all boosting runs of a job are done, which
+    is not necessarily in the order of ``jobs``. The data of a job are only
+    prepared (scaled) when the workers need more boosting runs, and released
+    once its result is yielded; jobs with the same ``y`` are boosted
+    consecutively and share the prepared ``y``. Errors in the data of a job
+    are raised when the job is reached.
+
+    Examples
+    --------
+    Fit two models for each subject in ``ds``::
+
+        jobs = [('meg', 'envelope'), ('meg', ('envelope', 'onsets'))]
+        results = dict(boosting_batch(jobs, 0, 0.5, ds=ds))
+    """
+    with user_activity:
+        mindelta_ = delta if mindelta is None else mindelta
+        check_error(error, incremental)
+        jobs = [job if len(job) == 3 else (*job, None) for job in jobs]
+        # jobs with the same y share the prepared y data
+        if ds is None:
+            y_keys = [id(y) for y, _, _ in jobs]
+        else:
+            y_keys = [(y if isinstance(y, str) else id(y), i)
+                      for y, _, _ in jobs for i in range(ds.n_cases)]
+            jobs = [tuple(asndvar_case(item, ds, i) for item in job)
+                    for job in jobs for i in range(ds.n_cases)]
+        # boost jobs with the same y consecutively
+        first = {}
+        for job_i, key in enumerate(y_keys):
+            first.setdefault(key, job_i)
+        order = sorted(range(len(jobs)), key=lambda job_i: first[y_keys[job_i]])
+
+        # prepare data lazily, and keep only data that are still needed
+        datas = {}
+        bases = {}
+
+        def prepare_jobs():
+            y_cache = {}
+            n_left = Counter(y_keys)
+            for job_i in order:
+                y, x, init = jobs[job_i]
+                key = y_keys[job_i]
+                data, y_data, x_data, trf_length, basis_, splits = prepare_data(
+                    y, x, tstart, tstop, error, scale_data, partitions, test,
+                    basis, basis_window, y_cache.get(key))
+                n_left[key] -= 1
+                if n_left[key]:
+                    y_cache[key] = data
+                else:
+                    y_cache.pop(key, None)
+                h0 = init_kernel(data, init, tstart, trf_length, basis_[0])
+                datas[job_i] = data
+                bases[job_i] = basis_[0]
+                yield job_i, y_data, x_data, trf_length, basis_[1], h0, splits
+                del data, y_data, x_data, h0
+
+        pbar = tqdm(desc="Boosting %i jobs" % len(jobs), total=len(jobs),
+                    disable=CONFIG['tqdm'])
+        t_start = time.time()
+        for job_i, h_x, res, diagnostics in boost_jobs(
+                prepare_jobs(), delta, mindelta_, error, incremental,
+                tqdm(disable=True)):
+            dt = time.time() - t_start
+            yield job_i, package_result(datas.pop(job_i), h_x, res,
+                                        diagnostics, dt, tstart, tstop, delta,
+                                        mindelta, error, scale_data,
+                                        incremental, partitions, test, basis,
+                                        basis_window, bases.pop(job_i),
+                                        jobs[job_i][2])
+            pbar.update()
+        pbar.close()
+
+
+def asndvar_case(x, ds, i):
+    "Retrieve case ``i`` of the Dataset column(s) ``x``"
+    if isinstance(x, str):
+        return ds[x][i]
+    elif isinstance(x, (list, tuple)):
+        return [asndvar_case(xi, ds, i) for xi in x]
+    else:
+        return x
+
+
+def init_kernel(data, init, tstart, trf_length, window):
+    """Initial kernel from the ``init`` parameter
+
+    Returns
+    -------
+    h0 : None | array (n_y, n_x, trf_length)
+        Initial kernel in the scale of the data.
+    """
+    if init is None:
+        return None
+    elif window is not None:
+        raise NotImplementedError("init with basis")
+    elif isinstance(init, BoostingResult):
+        hs = init.h_scaled
+    else:
+        hs = init
+    if isinstance(hs, NDVar):
+        hs = (hs,)
+    elif not all(isinstance(h, NDVar) for h in hs):
+        raise TypeError("init=%r: need BoostingResult or NDVar" % (init,))
+    h0, n = data.kernel_array(hs, tstart, trf_length)
+    if n == 0:
+        raise ValueError("init=%r: no kernel matches any predictor (%s)"
+                         % (init, data.x_name))
+    return h0
+
+
+def describe_init(init):
+    "Description of the ``init`` parameter for BoostingResult"
+    if init is None or isinstance(init, str):
+        return init
+    elif isinstance(init, BoostingResult):
+        return repr(init)
+    elif isinstance(init, NDVar):
+        init = (init,)
+    return ' + '.join(dataobj_repr(h) for h in init)
+
+
+def check_error(error, incremental):
+    if error not in ERROR_FUNC:
+        raise ValueError("error=%r" % (error,))
+    elif incremental and error != 'l2':
+        raise ValueError("incremental=True requires error='l2', got error=%r"
+                         % (error,))
+
+
+def prepare_data(y, x, tstart, tstop, error, scale_data, partitions, test,
+                 basis=0, basis_window='hamming', share_y=None):
+    """Scale data, crop it to align ``y`` and ``x`` at TRF start and split it
 
-    data = RevCorrData(y, x, error, scale_data)
+    Returns
+    -------
+    data : RevCorrData
+        Data container.
+    y_data : array (n_y, n_times)
+        Dependent signals.
+    x_data : array (n_x, n_times)
+        Predictors (convolved with the basis function if ``basis``).
+    trf_length : int
+        Length of the TRF (in samples).
+    basis : (None | array, int)
+        Basis function and spacing of the basis functions (in samples), see
+        :func:`basis_functions`.
+    splits : list of tuple
+        Cross-validation splits (see :func:`cv_splits`).
+    """
+    shared = bool(CONFIG['n_workers']) and CONFIG['boosting_backend'] == 'process'
+    data = RevCorrData(y, x, error, scale_data, CONFIG['boosting_dtype'],
+                       shared, share_y)
     y_data = data.y
     x_data = data.x
-    n_y = len(y_data)
-    n_x = len(x_data)
 
-    # crop data to align y and x at TRF start
     tstep = data.time.tstep
+    window, lag_step = basis_functions(basis, basis_window, tstep)
+    if window is not None:
+        # boosting the coefficients of the basis functions is boosting
+        # impulses with the predictors convolved with the basis function
+        x_data = convolve1d(x_data, window.astype(x_data.dtype), 1,
+                            mode='constant')
     i_start = int(round(tstart / tstep))
     i_stop = int(round(tstop / tstep))
     trf_length = i_stop - i_start
@@ -251,67 +658,98 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
         x_data = x_data[:, :-i_start]
         y_data = y_data[:, i_start:]
 
-    # progress bar
-    pbar = tqdm(desc="Boosting %i signals" % n_y if n_y > 1 else "Boosting",
-                total=n_y * 10, disable=CONFIG['tqdm'])
-    t_start = time.time()
-    # result containers
-    res = np.empty((3, n_y))  # r, rank-r, error
-    h_x = np.empty((n_y, n_x, trf_length))
-    # boosting
-    if CONFIG['n_workers']:
-        # Make sure cross-validations are added in the same order, otherwise
-        # slight numerical differences can occur
-        job_queue, result_queue = setup_workers(
-            y_data, x_data, trf_length, delta, mindelta_, N_SEGS, error)
-        stop_jobs = Event()
-        thread = Thread(target=put_jobs, args=(job_queue, n_y, N_SEGS, stop_jobs))
-        thread.start()
-
-        # collect results
-        try:
-            h_segs = {}
-            for _ in range(n_y * N_SEGS):
-                y_i, seg_i, h = result_queue.get()
-                pbar.update()
-                if y_i in h_segs:
-                    h_seg = h_segs[y_i]
-                    h_seg[seg_i] = h
-                    if len(h_seg) == N_SEGS:
-                        del h_segs[y_i]
-                        hs = [h for h in (h_seg[i] for i in range(N_SEGS)) if
-                              h is not None]
-                        if hs:
-                            h = np.mean(hs, 0, out=h_x[y_i])
-                            res[:, y_i] = evaluate_kernel(y_data[y_i], x_data, h, error)
-                        else:
-                            h_x[y_i] = 0
-                            res[:, y_i] = 0.
-                else:
-                    h_segs[y_i] = {seg_i: h}
-        except KeyboardInterrupt:
-            stop_jobs.set()
-            raise
+    # cross-validation partitions
+    n_times = y_data.shape[1]
+    if partitions is None:
+        partitions = N_SEGS
+    if isinstance(partitions, (int, np.integer)):
+        n_partitions = partitions
+        seg_len = n_times // n_partitions
+        if seg_len < 1:
+            raise ValueError("partitions=%r: not enough data for %i partitions"
+                             % (partitions, n_partitions))
+        boundaries = [seg_len * i for i in range(1, n_partitions)]
     else:
-        for y_i, y_ in enumerate(y_data):
-            hs = []
-            for i in range(N_SEGS):
-                h = boost_1seg(x_data, y_, trf_length, delta, N_SEGS, i,
-                               mindelta_, error)
-                if h is not None:
-                    hs.append(h)
-                pbar.update()
-
-            if hs:
-                h = np.mean(hs, 0, out=h_x[y_i])
-                res[:, y_i] = evaluate_kernel(y_, x_data, h, error)
+        # boundaries in samples of y_data
+        i0 = max(i_start, 0)
+        boundaries = [int(round((t - data.time.tmin) / tstep)) - i0 for t in partitions]
+        if any(b <= 0 or b >= n_times for b in boundaries):
+            raise ValueError("partitions=%r: boundaries need to be within the "
+                             "data (%g - %g s)" % (partitions, data.time.tmin,
+                                                  data.time.tstop))
+        boundaries = sorted(set(boundaries))
+        n_partitions = len(boundaries) + 1
+    if n_partitions < 2 + bool(test):
+        raise ValueError("partitions=%r: need at least %i partitions%s"
+                         % (partitions, 2 + bool(test), " with test=True" if test else ""))
+    segments = list(zip([0] + boundaries, boundaries + [n_times]))
+    return (data, y_data, x_data, trf_length, (window, lag_step),
+            cv_splits(segments, test))
+
+
+def basis_functions(basis, basis_window, tstep):
+    """Basis function for boosting
+
+    Returns
+    -------
+    window : None | array
+        Basis function (an odd number of samples), or None for impulses.
+    lag_step : int
+        Spacing of the basis functions (in samples).
+    """
+    if not basis:
+        return None, 1
+    elif basis < 0:
+        raise ValueError("basis=%r: needs to be positive" % (basis,))
+    n = int(round(basis / tstep))
+    n += 1 - n % 2
+    if n < 3:
+        raise ValueError("basis=%r: basis functions need to be at least 3 "
+                         "samples long (tstep=%g)" % (basis, tstep))
+    window = get_window(basis_window, n, False)
+    return window, n // 2
+
+
+def cv_splits(segments, test):
+    """Cross-validation splits with one boosting run per partition
+
+    Parameters
+    ----------
+    segments : list of (start, stop)
+        Partitions of the data (in samples).
+    test : bool
+        Hold out a test partition from each run.
+
+    Returns
+    -------
+    splits : list of (train_index, validate_index, test_index)
+        For each partition ``i``, ``validate_index`` is partition ``i``;
+        ``test_index`` is partition ``i + 1`` (cyclic) if ``test``, else
+        ``None``; and ``train_index`` are the remaining partitions. Indexes
+        are ``int64`` arrays of ``(start, stop)`` pairs.
+    """
+    n = len(segments)
+    splits = []
+    for i in range(n):
+        test_i = (i + 1) % n if test else None
+        train = []
+        for j, (start, stop) in enumerate(segments):
+            if j == i or j == test_i:
+                continue
+            elif train and train[-1][1] == start:
+                train[-1] = (train[-1][0], stop)
             else:
-                h_x[y_i].fill(0)
-                res[:, y_i].fill(0.)
+                train.append((start, stop))
+        validate_index = np.array((segments[i],), np.int64)
+        test_index = np.array((segments[test_i],), np.int64) if test else None
+        splits.append((np.array(train, np.int64), validate_index, test_index))
+    return splits
 
-    pbar.close()
-    dt = time.time() - t_start
 
+def package_result(data, h_x, res, diagnostics, dt, tstart, tstop, delta,
+                   mindelta, error, scale_data, incremental, partitions, test,
+                   basis, basis_window, window, init):
+    "Package boosting output as BoostingResult"
     # fit-evaluation statistics
     rs, rrs, errs = res
     isnan = np.isnan(rs)
@@ -322,14 +760,213 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
 
     y_mean, y_scale, x_mean, x_scale = data.data_scale_ndvars()
 
-    return BoostingResult(data.package_kernel(h_x, tstart), r, isnan, dt, VERSION,
-                          delta, mindelta, error, rr, err,
+    return BoostingResult(data.sparse_kernel(h_x, tstart, window), r, isnan,
+                          dt, VERSION, delta, mindelta, error, rr, err,
                           scale_data, y_mean, y_scale, x_mean, x_scale,
-                          data.y_name, data.x_name, tstart, tstop)
+                          data.y_name, data.x_name, tstart, tstop, incremental,
+                          partitions, test, diagnostics, basis, basis_window,
+                          describe_init(init))
+
+
+def boost_jobs(jobs, delta, mindelta, error, incremental, pbar):
+    """Boost all signals of one or several jobs
+
+    Parameters
+    ----------
+    jobs : iterable of tuple
+        For each job, ``(job_i, y_data, x_data, trf_length, lag_step, h0,
+        splits)``:  index of the job; dependent signals (array ``(n_y,
+        n_times)``); predictors (array ``(n_x, n_times)``); TRF length;
+        spacing of the candidate lags (see :func:`basis_functions`); initial
+        kernels (``None`` or array ``(n_y, n_x, trf_length)``, see
+        :func:`init_kernel`); and cross-validation splits (see
+        :func:`cv_splits`). ``jobs`` is consumed lazily (while the previous
+        jobs are still running), and no reference to the data of a job is
+        kept after its results were yielded.
+    delta : scalar
+        Step of the adjustment.
+    mindelta : scalar
+        Smallest delta to use.
+    error : str
+        Error function to use.
+    incremental : bool
+        Use the incremental engine for the l2 error.
+    pbar : tqdm
+        Progress bar, updated after each boosting run.
+
+    Yields
+    ------
+    job_i : int
+        Index of the job.
+    h_x : array (n_y, n_x, trf_length)
+        Kernels.
+    res : array (3, n_y)
+        Correlation, rank correlation and fit error.
+    diagnostics : array (n_y, n_splits)
+        Diagnostics for each boosting run (see :data:`DIAGNOSTICS_DTYPE`).
+    """
+    if not CONFIG['n_workers']:
+        for job_i, y_data, x_data, trf_length, lag_step, h0, splits in jobs:
+            h_x = np.empty((len(y_data), len(x_data), trf_length))
+            res = np.empty((3, len(y_data)))
+            diag = np.empty((len(y_data), len(splits)), DIAGNOSTICS_DTYPE)
+            for y_i, y_ in enumerate(y_data):
+                y_runs = []
+                for seg_i, split in enumerate(splits):
+                    h, y_pred, diag[y_i, seg_i] = boost_split(
+                        y_, x_data, trf_length, split, delta, mindelta, error,
+                        incremental, lag_step, None if h0 is None else h0[y_i])
+                    y_runs.append((h, y_pred))
+                    pbar.update()
+                res[:, y_i] = combine_runs(y_, x_data, y_runs, splits, error,
+                                           h_x[y_i])
+            yield job_i, h_x, res, diag
+        return
+
+    use_threads = CONFIG['boosting_backend'] == 'thread'
+    # Only a limited number of runs are queued, so that a job is only
+    # prepared (``jobs`` is advanced) when the workers need more runs; with
+    # the process backend, ``runs()`` is iterated in the pool's feeder thread
+    queue_slots = Semaphore(4 * CONFIG['n_workers'])
+    stopped = Event()
+    active = {}  # job_i -> [y, x, splits, h_x, res, diag, shared, n_left]
+    errors = []
+
+    def runs():
+        jobs_iter = iter(jobs)
+        while True:
+            try:
+                job = next(jobs_iter)
+            except StopIteration:
+                return
+            except Exception as exception:
+                # raise in the main thread after the queued runs are done
+                errors.append(exception)
+                return
+            job_i, y_data, x_data, trf_length, lag_step, h0, splits = job
+            if use_threads:
+                y_job, x_job = y_data, x_data
+            else:
+                # data that are already in shared memory are not copied
+                y_job = SharedArray.from_array(y_data, copy=False)
+                x_job = SharedArray.from_array(x_data, copy=False)
+            n_y = len(y_data)
+            # the entry keeps the shared memory alive until the job is done
+            active[job_i] = [
+                y_data, x_data, splits,
+                np.empty((n_y, len(x_data), trf_length)),
+                np.empty((3, n_y)),
+                np.empty((n_y, len(splits)), DIAGNOSTICS_DTYPE),
+                (y_job, x_job), n_y]
+            for y_i in range(n_y):
+                h0_i = None if h0 is None else h0[y_i]
+                for seg_i, split in enumerate(splits):
+                    while not queue_slots.acquire(timeout=1):
+                        if stopped.is_set():
+                            return
+                    yield (job_i, y_i, seg_i, y_job, x_job, trf_length,
+                           lag_step, split, h0_i)
+
+    map_func = thread_map if use_threads else parallel_map
+    func = partial(boosting_run, delta, mindelta, error, incremental)
+    y_runs_by_signal = {}
+    try:
+        for _, (job_i, y_i, seg_i, h, y_pred, info) in map_func(func, runs()):
+            queue_slots.release()
+            pbar.update()
+            y_data, x_data, splits, h_x, res, diag, _, _ = job = active[job_i]
+            diag[y_i, seg_i] = info
+            key = (job_i, y_i)
+            y_runs = y_runs_by_signal.setdefault(key, {})
+            y_runs[seg_i] = (h, y_pred)
+            if len(y_runs) < len(splits):
+                continue
+            # Make sure cross-validations are added in the same order,
+            # otherwise slight numerical differences can occur
+            del y_runs_by_signal[key]
+            y_runs = [y_runs[i] for i in range(len(splits))]
+            res[:, y_i] = combine_runs(y_data[y_i], x_data, y_runs, splits,
+                                       error, h_x[y_i])
+            job[-1] -= 1
+            if job[-1] == 0:
+                # release the data of the job
+                del active[job_i], job, y_data, x_data
+                yield job_i, h_x, res, diag
+    finally:
+        stopped.set()
+    if errors:
+        raise errors[0]
+
+
+def boost_split(y, x, trf_length, split, delta, mindelta, error, incremental,
+                lag_step=1, h0=None):
+    """Boost one cross-validation split
+
+    Returns
+    -------
+    h : None | array (n_stims, trf_length)
+        Kernel, or None if 0 is the best kernel.
+    y_pred : None | array
+        Prediction for the test partition (None if the split has no test
+        partition).
+    info : tuple
+        Diagnostics (see :data:`DIAGNOSTICS_DTYPE`).
+    """
+    train_index, validate_index, test_index = split
+    t0 = time.time()
+    h, (n_iterations, best_iteration, n_reductions, stop) = boost_segs(
+        y, x, train_index, validate_index, trf_length, delta, mindelta, error,
+        False, incremental, return_info=True, lag_step=lag_step, h0=h0)
+    info = (n_iterations, best_iteration, n_reductions, time.time() - t0, stop)
+    if test_index is None:
+        return h, None, info
+    start, stop = test_index[0]
+    if h is None:
+        return h, np.zeros(stop - start), info
+    i0 = max(0, start - trf_length + 1)
+    return h, apply_kernel(x[:, i0:stop], h)[start - i0:], info
+
+
+def combine_runs(y, x, runs, splits, error, h_out):
+    """Average the kernels from all splits and evaluate the fit
+
+    Parameters
+    ----------
+    y : array (n_times,)
+        Dependent signal.
+    x : array (n_stims, n_times)
+        Stimulus.
+    runs : list of (h, y_pred)
+        Output of :func:`boost_split` for each split.
+    splits : list
+        Cross-validation splits.
+    error : str
+        Error function.
+    h_out : array (n_stims, trf_length)
+        Buffer for the average kernel.
+
+    Returns
+    -------
+    r, rank_r, error : float
+        Fit statistics (see :func:`evaluate_kernel`).
+    """
+    hs = [h for h, _ in runs if h is not None]
+    if not hs:
+        h_out.fill(0)
+        return 0., 0., 0.
+    np.mean(hs, 0, out=h_out)
+    if splits[0][2] is None:
+        return evaluate_kernel(y, x, h_out, error)
+    # held-out predictions (each partition is the test partition once)
+    y_pred = np.empty(len(y))
+    for (_, _, test_index), (_, y_pred_) in zip(splits, runs):
+        start, stop = test_index[0]
+        y_pred[start: stop] = y_pred_
+    return evaluate_prediction(y, y_pred, h_out.shape[-1] - 1, error)
 
 
 def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
-               return_history=False):
+               return_history=False, incremental=False):
     """Boosting with one test segment determined by regular division
 
     Based on port of svdboostV4pred
@@ -356,6 +993,8 @@ def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
         Error function to use.
     return_history : bool
         Return error history as second return value.
+    incremental : bool
+        Use the incremental engine for the l2 error (see :func:`boost_segs`).
 
     Returns
     -------
@@ -383,11 +1022,12 @@ def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
 
     return boost_segs(y, x, np.array(train_index, np.int64),
                       np.array(test_index, np.int64), trf_length, delta,
-                      mindelta, error, return_history)
+                      mindelta, error, return_history, incremental)
 
 
 def boost_segs(y, x, train_index, test_index, trf_length, delta, mindelta,
-               error, return_history):
+               error, return_history, incremental=False, return_info=False,
+               lag_step=1, h0=None):
     """Boosting supporting multiple array segments
 
     Parameters
@@ -412,6 +1052,18 @@ def boost_segs(y, x, train_index, test_index, trf_length, delta, mindelta,
         Error function to use.
     return_history : bool
         Return error history as second return value.
+    incremental : bool
+        For ``error='l2'``, evaluate candidates from the correlation between
+        residual and shifted stimuli, which is updated after each step, rather
+        than scanning the training data for every candidate. Ignored for
+        training segments shorter than ``trf_length``.
+    return_info : bool
+        Return diagnostics as last return value.
+    lag_step : int
+        Only consider changes of the kernel at lags that are multiples of
+        ``lag_step``.
+    h0 : array (n_stims, trf_length)
+        Initial kernel (default 0).
 
     Returns
     -------
@@ -419,21 +1071,44 @@ def boost_segs(y, x, train_index, test_index, trf_length, delta, mindelta,
         Winning kernel, or None if 0 is the best kernel.
     test_sse_history : list (only if ``return_history==True``)
         SSE for test data at each iteration.
+    info : tuple (only if ``return_info==True``)
+        Number of iterations, best iteration, number of delta reductions and
+        reason for stopping (index into :data:`STOP_REASONS`).
     """
+    if incremental:
+        if error != 'l2':
+            raise ValueError("incremental=True requires error='l2', got "
+                             "error=%r" % (error,))
+        incremental = np.all(train_index[:, 1] - train_index[:, 0] >= trf_length)
     delta_error = DELTA_ERROR_FUNC[error]
     error = ERROR_FUNC[error]
     n_stims, n_times = x.shape
     assert y.shape == (n_times,)
 
-    h = np.zeros((n_stims, trf_length))
+    if h0 is None:
+        h = np.zeros((n_stims, trf_length))
+    else:
+        h = h0.copy()
+    options_shape = (n_stims, -(-trf_length // lag_step))
 
     # index for computing all segments
     all_index = np.vstack((train_index, test_index))
 
     # buffers
-    y_error = y.copy()
-    new_error = np.empty(h.shape)
-    new_sign = np.empty(h.shape, np.int8)
+    y_error = y.astype(np.float64)
+    if h0 is not None:
+        # as update_error(), predict each segment from its own samples only
+        for start, stop in all_index:
+            y_error[start: stop] -= convolve_kernels(
+                h0, x[:, start: stop], 0, stop - start)
+    new_error = np.empty(options_shape)
+    new_sign = np.empty(options_shape, np.int8)
+    if incremental:
+        corr = np.empty(options_shape)
+        x_energy = np.empty(options_shape)
+        l2_correlation(y_error, x, train_index, corr, x_energy, lag_step)
+        # lagged products, computed when a stimulus is first selected
+        xcorrs = {}
 
     # history
     best_test_error = np.inf
@@ -458,14 +1133,20 @@ def boost_segs(y, x, train_index, test_index, trf_length, delta, mindelta,
         if (i_boost > 10 and e_test > test_error_history[-2] and
                 e_test > test_error_history[-3]):
             # print("error(test) not improving in 2 steps")
+            stop = STOP_VALIDATION
             break
 
         # generate possible movements -> training error
-        generate_options(y_error, x, train_index, delta_error, delta, new_error, new_sign)
+        if incremental:
+            generate_options_l2(corr, x_energy, e_train, delta, new_error, new_sign)
+        else:
+            generate_options(y_error, x, train_index, delta_error, delta,
+                             new_error, new_sign, lag_step)
 
-        i_stim, i_time = np.unravel_index(np.argmin(new_error), h.shape)
-        new_train_error = new_error[i_stim, i_time]
-        delta_signed = new_sign[i_stim, i_time] * delta
+        i_stim, i_lag = np.unravel_index(np.argmin(new_error), options_shape)
+        new_train_error = new_error[i_stim, i_lag]
+        delta_signed = new_sign[i_stim, i_lag] * delta
+        i_time = i_lag * lag_step
 
         # If no improvements can be found reduce delta
         if new_train_error > e_train:
@@ -476,89 +1157,71 @@ def boost_segs(y, x, train_index, test_index, trf_length, delta, mindelta,
                 continue
             else:
                 # print("No improvement possible for training data")
+                stop = STOP_MINDELTA
                 break
 
         # abort if we're moving in circles
         if i_boost >= 2 and (i_stim, i_time, -delta_signed) == history[-1]:
             # print("Same h after 2 iterations")
+            stop = STOP_OSCILLATION
             break
         elif i_boost >= 4 and history[-3] is DELTA_REDUCTION_STEP:
             step = (i_stim, i_time, -delta_signed / 2.)
             if history[-1] == step and history[-2] == step:
                 # print("Same h after 3 iterations")
+                stop = STOP_OSCILLATION
                 break
 
         # update h with best movement
         h[i_stim, i_time] += delta_signed
         history.append((i_stim, i_time, delta_signed))
         update_error(y_error, x[i_stim], all_index, delta_signed, i_time)
+        if incremental:
+            if i_stim not in xcorrs:
+                xcorr = np.empty((n_stims, 2 * trf_length - 1))
+                l2_xcorr(x, train_index, i_stim, xcorr)
+                xcorrs[i_stim] = xcorr
+            l2_update_correlation(corr, x, xcorrs[i_stim], train_index,
+                                  delta_signed, i_stim, i_time, lag_step)
     else:
         raise RuntimeError("Maximum number of iterations exceeded")
     # print('  (%i iterations)' % (i_boost + 1))
 
+    if return_info:
+        n_reductions = sum(step is DELTA_REDUCTION_STEP for step in history)
+        info = (i_boost + 1, best_iteration, n_reductions, stop)
+
     # reverse changes after best iteration
     if best_iteration:
         for i_stim, i_time, delta_signed in history[-1: best_iteration - 1: -1]:
             if delta_signed is not None:
                 h[i_stim, i_time] -= delta_signed
+    elif h0 is not None:
+        h = h0
     else:
         h = None
 
+    out = [h]
     if return_history:
-        return h, test_error_history
-    else:
-        return h
+        out.append(test_error_history)
+    if return_info:
+        out.append(info)
+    return tuple(out) if len(out) > 1 else h
 
 
-def setup_workers(y, x, trf_length, delta, mindelta, nsegs, error):
-    n_y, n_times = y.shape
-    n_x, _ = x.shape
+def boosting_run(delta, mindelta, error, incremental, job_i, y_i, seg_i, y,
+                 x, trf_length, lag_step, split, h0):
+    """Boost one cross-validation split of one signal of one job
 
-    y_buffer = RawArray('d', n_y * n_times)
-    y_buffer[:] = y.ravel()
-    x_buffer = RawArray('d', n_x * n_times)
-    x_buffer[:] = x.ravel()
-
-    job_queue = Queue(200)
-    result_queue = Queue(200)
-
-    args = (y_buffer, x_buffer, n_y, n_times, n_x, trf_length, delta,
-            mindelta, nsegs, error, job_queue, result_queue)
-    for _ in range(CONFIG['n_workers']):
-        process = Process(target=boosting_worker, args=args)
-        process.start()
-
-    return job_queue, result_queue
-
-
-def boosting_worker(y_buffer, x_buffer, n_y, n_times, n_x, trf_length,
-                    delta, mindelta, nsegs, error, job_queue, result_queue):
-    if CONFIG['nice']:
-        os.nice(CONFIG['nice'])
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-
-    y = np.frombuffer(y_buffer, np.float64, n_y * n_times).reshape((n_y, n_times))
-    x = np.frombuffer(x_buffer, np.float64, n_x * n_times).reshape((n_x, n_times))
-
-    while True:
-        y_i, seg_i = job_queue.get()
-        if y_i == JOB_TERMINATE:
-            return
-        h = boost_1seg(x, y[y_i], trf_length, delta, nsegs, seg_i, mindelta,
-                       error)
-        result_queue.put((y_i, seg_i, h))
-
-
-def put_jobs(queue, n_y, n_segs, stop):
-    "Feed boosting jobs into a Queue"
-    for job in product(range(n_y), range(n_segs)):
-        queue.put(job)
-        if stop.isSet():
-            while not queue.empty():
-                queue.get()
-            break
-    for _ in range(CONFIG['n_workers']):
-        queue.put((JOB_TERMINATE, None))
+    Job for the worker pool (``y`` and ``x`` are :class:`SharedArray`) or for
+    worker threads (arrays).
+    """
+    if isinstance(y, SharedArray):
+        y = y.x
+        x = x.x
+    h, y_pred, info = boost_split(y[y_i], x, trf_length, split, delta,
+                                  mindelta, error, incremental, lag_step, h0)
+    return job_i, y_i, seg_i, h, y_pred, info
 
 
 def apply_kernel(x, h, out=None):
@@ -568,13 +1231,8 @@ def apply_kernel(x, h, out=None):
     h.shape is (n_stims, n_trf_samples)
     """
     if out is None:
-        out = np.zeros(x.shape[1])
-    else:
-        out.fill(0)
-
-    for ind in range(len(h)):
-        out += np.convolve(h[ind], x[ind])[:len(out)]
-
+        return convolve_kernels(h, x)
+    out[:] = convolve_kernels(h, x)
     return out
 
 
@@ -591,9 +1249,11 @@ def evaluate_kernel(y, x, h, error):
         Error corresponding to error_func.
     """
     y_pred = apply_kernel(x, h)
+    return evaluate_prediction(y, y_pred, h.shape[-1] - 1, error)
+
 
-    # discard onset (length of kernel)
-    i0 = h.shape[-1] - 1
+def evaluate_prediction(y, y_pred, i0, error):
+    "Fit quality statistics, discarding the onset ``y[:i0]``"
     y = y[i0:]
     y_pred = y_pred[i0:]
 
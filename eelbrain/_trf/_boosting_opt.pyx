@@ -1,7 +1,10 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+# The stimulus ``x`` can be float64 or float32; errors and residuals are
+# computed in double precision.
 #cython: boundscheck=False, wraparound=False
 
 cimport cython
+from cython cimport floating
 from cython.view cimport array as cvarray
 from libc.stdlib cimport malloc, free
 from libc.math cimport fabs
@@ -47,7 +50,7 @@ def l2(
 
 cdef void l1_for_delta(
         FLOAT64 [:] y_error,
-        FLOAT64 [:] x,
+        floating [:] x,
         INT64 [:,:] indexes,  # training segment indexes
         double delta,
         size_t shift,
@@ -77,7 +80,7 @@ cdef void l1_for_delta(
 
 cdef void l2_for_delta(
         FLOAT64 [:] y_error,
-        FLOAT64 [:] x,
+        floating [:] x,
         INT64 [:,:] indexes,  # training segment indexes
         double delta,
         size_t shift,
@@ -107,21 +110,22 @@ cdef void l2_for_delta(
 
 def generate_options(
         FLOAT64 [:] y_error,
-        FLOAT64 [:,:] x,  # (n_stims, n_times)
+        floating [:,:] x,  # (n_stims, n_times)
         INT64 [:,:] indexes,  # training segment indexes
         int error,
         double delta,
         # buffers
-        FLOAT64 [:,:] new_error,  # (n_stims, n_times_trf)
+        FLOAT64 [:,:] new_error,  # (n_stims, n_lags)
         INT8 [:,:] new_sign,
+        size_t lag_step=1,  # lag of candidate i_lag is i_lag * lag_step
     ):
     cdef:
         double e_add
         double e_sub
         size_t n_stims = new_error.shape[0]
-        size_t n_times_trf = new_error.shape[1]
-        size_t i_stim, i_time
-        FLOAT64 [:] x_stim
+        size_t n_lags = new_error.shape[1]
+        size_t i_stim, i_lag
+        floating [:] x_stim
 
     if error != 1 and error != 2:
         raise RuntimeError("error=%r" % (error,))
@@ -129,24 +133,24 @@ def generate_options(
     with nogil:
         for i_stim in range(n_stims):
             x_stim = x[i_stim]
-            for i_time in range(n_times_trf):
+            for i_lag in range(n_lags):
                 # +/- delta
                 if error == 1:
-                    l1_for_delta(y_error, x_stim, indexes, delta, i_time, &e_add, &e_sub)
+                    l1_for_delta(y_error, x_stim, indexes, delta, i_lag * lag_step, &e_add, &e_sub)
                 else:
-                    l2_for_delta(y_error, x_stim, indexes, delta, i_time, &e_add, &e_sub)
+                    l2_for_delta(y_error, x_stim, indexes, delta, i_lag * lag_step, &e_add, &e_sub)
 
                 if e_add > e_sub:
-                    new_error[i_stim, i_time] = e_sub
-                    new_sign[i_stim, i_time] = -1
+                    new_error[i_stim, i_lag] = e_sub
+                    new_sign[i_stim, i_lag] = -1
                 else:
-                    new_error[i_stim, i_time] = e_add
-                    new_sign[i_stim, i_time] = 1
+                    new_error[i_stim, i_lag] = e_add
+                    new_sign[i_stim, i_lag] = 1
 
 
 def update_error(
         FLOAT64 [:] y_error,
-        FLOAT64 [:] x,
+        floating [:] x,
         INT64 [:,:] indexes,  # training segment indexes
         double delta,
         size_t shift,
@@ -158,3 +162,144 @@ def update_error(
         for seg_i in range(indexes.shape[0]):
             for i in range(indexes[seg_i, 0] + shift, indexes[seg_i, 1]):
                 y_error[i] -= delta * x[i - shift]
+
+
+# Incremental L2 engine
+# ---------------------
+# For the l2 error, the training error after adding ``d * x[i_stim]`` at lag
+# ``i_time`` is ``e_train - 2 * d * corr + d ** 2 * x_energy``, where ``corr``
+# is the correlation of the residual with the shifted stimulus and
+# ``x_energy`` the energy of the shifted stimulus in the training segments.
+# Instead of scanning the training data for each candidate, ``corr`` is
+# updated after each step from the lagged products of the stimuli.
+# Candidates are restricted to lags that are multiples of ``lag_step``.
+def l2_correlation(
+        FLOAT64 [:] y_error,
+        floating [:,:] x,  # (n_stims, n_times)
+        INT64 [:,:] indexes,  # training segment indexes
+        # buffers
+        FLOAT64 [:,:] corr,  # (n_stims, n_lags)
+        FLOAT64 [:,:] x_energy,  # (n_stims, n_lags)
+        size_t lag_step=1,
+    ):
+    cdef:
+        double c, q
+        size_t n_stims = corr.shape[0]
+        size_t n_lags = corr.shape[1]
+        size_t i, i_stim, i_lag, i_time, seg_i
+
+    with nogil:
+        for i_stim in range(n_stims):
+            for i_lag in range(n_lags):
+                i_time = i_lag * lag_step
+                c = 0.
+                q = 0.
+                for seg_i in range(indexes.shape[0]):
+                    for i in range(indexes[seg_i, 0] + i_time, indexes[seg_i, 1]):
+                        c += y_error[i] * x[i_stim, i - i_time]
+                        q += (<double>x[i_stim, i - i_time]) ** 2
+                corr[i_stim, i_lag] = c
+                x_energy[i_stim, i_lag] = q
+
+
+def l2_xcorr(
+        floating [:,:] x,  # (n_stims, n_times)
+        INT64 [:,:] indexes,  # training segment indexes
+        size_t i_stim,
+        FLOAT64 [:,:] out,  # (n_stims, 2 * n_times_trf - 1)
+    ):
+    """Lagged products of ``x[i_stim]`` with all stimuli
+
+    ``out[s, k + n_times_trf - 1]`` is the sum of ``x[s, j] * x[i_stim, j + k]``
+    over all ``j`` for which both samples are in the same training segment.
+    """
+    cdef:
+        double total
+        size_t n_stims = out.shape[0]
+        Py_ssize_t n_lags = out.shape[1]
+        Py_ssize_t n_times_trf = (n_lags + 1) // 2
+        Py_ssize_t j, k, i_lag, seg_start, seg_stop
+        size_t s, seg_i
+
+    with nogil:
+        for s in range(n_stims):
+            for i_lag in range(n_lags):
+                k = i_lag - (n_times_trf - 1)
+                total = 0.
+                for seg_i in range(indexes.shape[0]):
+                    seg_start = indexes[seg_i, 0]
+                    seg_stop = indexes[seg_i, 1]
+                    if k < 0:
+                        seg_start -= k
+                    else:
+                        seg_stop -= k
+                    for j in range(seg_start, seg_stop):
+                        total += <double>x[s, j] * x[i_stim, j + k]
+                out[s, i_lag] = total
+
+
+def l2_update_correlation(
+        FLOAT64 [:,:] corr,  # (n_stims, n_lags)
+        floating [:,:] x,  # (n_stims, n_times)
+        FLOAT64 [:,:] xcorr,  # l2_xcorr() for i_stim
+        INT64 [:,:] indexes,  # training segment indexes
+        double delta,
+        size_t i_stim,
+        size_t shift,
+        size_t lag_step=1,
+    ):
+    """Update ``corr`` after ``update_error(y_error, x[i_stim], ..., delta, shift)``
+
+    Requires training segments of at least ``n_times_trf`` samples.
+    """
+    cdef:
+        double total
+        size_t n_stims = corr.shape[0]
+        Py_ssize_t n_lags = corr.shape[1]
+        Py_ssize_t n_times_trf = (xcorr.shape[1] + 1) // 2
+        Py_ssize_t j, k, i_lag, i_time, seg_stop
+        size_t s, seg_i
+
+    with nogil:
+        for s in range(n_stims):
+            for i_lag in range(n_lags):
+                i_time = i_lag * lag_step
+                k = i_time - <Py_ssize_t>shift
+                total = xcorr[s, k + n_times_trf - 1]
+                # remove products beyond the lag of the candidate
+                for seg_i in range(indexes.shape[0]):
+                    seg_stop = indexes[seg_i, 1]
+                    for j in range(seg_stop - i_time, seg_stop - (k if k > 0 else 0)):
+                        total -= <double>x[s, j] * x[i_stim, j + k]
+                corr[s, i_lag] -= delta * total
+
+
+def generate_options_l2(
+        FLOAT64 [:,:] corr,  # (n_stims, n_lags)
+        FLOAT64 [:,:] x_energy,  # (n_stims, n_lags)
+        double e_train,
+        double delta,
+        # buffers
+        FLOAT64 [:,:] new_error,  # (n_stims, n_lags)
+        INT8 [:,:] new_sign,
+    ):
+    cdef:
+        double e_add
+        double e_sub
+        double e_delta2
+        size_t n_stims = new_error.shape[0]
+        size_t n_times_trf = new_error.shape[1]
+        size_t i_stim, i_time
+
+    with nogil:
+        for i_stim in range(n_stims):
+            for i_time in range(n_times_trf):
+                e_delta2 = e_train + delta * delta * x_energy[i_stim, i_time]
+                e_add = e_delta2 - 2 * delta * corr[i_stim, i_time]
+                e_sub = e_delta2 + 2 * delta * corr[i_stim, i_time]
+                if e_add > e_sub:
+                    new_error[i_stim, i_time] = e_sub
+                    new_sign[i_stim, i_time] = -1
+                else:
+                    new_error[i_stim, i_time] = e_add
+                    new_sign[i_stim, i_time] = 1
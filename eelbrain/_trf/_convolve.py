@@ -0,0 +1,96 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Convolution of many kernels with many predictors
+
+Long kernels are applied with the FFT through overlap-add: ``x`` is split
+into blocks about as long as the kernel; blocks, kernels and outputs are
+transformed together, and products are summed over predictors in the
+frequency domain. Short kernels are applied directly with
+:func:`numpy.convolve`, which is faster and exact.
+"""
+import numpy as np
+
+
+# use the FFT for kernels of at least this many samples
+FFT_MIN_KERNEL = 32
+# maximum number of frequency-domain values per batch of blocks
+FFT_BUFFER_SIZE = 2 ** 22
+
+
+def convolve_kernels(h, x, start=0, stop=None):
+    """Convolve kernels with predictors and sum over predictors
+
+    Parameters
+    ----------
+    h : array (..., n_x, n_h)
+        Kernels; leading dimensions are output dimensions.
+    x : array (n_x, n_times)
+        Predictors.
+    start : int
+        First sample of the full convolution to return (can be negative).
+    stop : int
+        Stop of the samples to return (default ``n_times``). Samples outside
+        of the full convolution are 0.
+
+    Returns
+    -------
+    y : array (..., stop - start)
+        ``y[..., t - start]`` is the sum over ``i`` and ``k`` of
+        ``h[..., i, k] * x[i, t - k]``.
+    """
+    n_x, n_times = x.shape
+    n_h = h.shape[-1]
+    if h.shape[-2] != n_x:
+        raise ValueError("h with %i predictors for x with %i predictors"
+                         % (h.shape[-2], n_x))
+    if stop is None:
+        stop = n_times
+    out_shape = h.shape[:-2]
+    out = np.zeros(out_shape + (stop - start,))
+    # part of the output that overlaps with the full convolution
+    t0 = max(start, 0)
+    t1 = min(stop, n_times + n_h - 1)
+    if t1 <= t0:
+        return out
+
+    h_flat = h.reshape((-1, n_x, n_h))
+    out_flat = out.reshape((-1, stop - start))
+    if n_h < FFT_MIN_KERNEL:
+        for h_i, out_i in zip(h_flat, out_flat):
+            for h_ij, x_j in zip(h_i, x):
+                out_i[t0 - start: t1 - start] += np.convolve(h_ij, x_j)[t0:t1]
+        return out
+
+    # overlap-add
+    n_out = len(h_flat)
+    n_fft = 2 ** int(np.ceil(np.log2(2 * n_h)))
+    block = n_fft - n_h + 1
+    h_fft = np.fft.rfft(h_flat, n_fft)  # (n_out, n_x, n_freq)
+    n_freq = h_fft.shape[-1]
+    # frequency as first axis for batched matrix products
+    h_fft = np.ascontiguousarray(h_fft.transpose((2, 0, 1)))
+    b_start = max(0, t0 - n_h + 1) // block
+    b_stop = -(-min(t1, n_times) // block)
+    batch = max(1, FFT_BUFFER_SIZE // (n_freq * max(n_out, n_x)))
+    for b0 in range(b_start, b_stop, batch):
+        b1 = min(b0 + batch, b_stop)
+        n_blocks = b1 - b0
+        i0 = b0 * block
+        i1 = min(b1 * block, n_times)
+        xb = np.zeros((n_x, n_blocks * block))
+        xb[:, :i1 - i0] = x[:, i0:i1]
+        xb = xb.reshape((n_x, n_blocks, block)).swapaxes(0, 1)
+        x_fft = np.fft.rfft(xb, n_fft)  # (n_blocks, n_x, n_freq)
+        y_fft = np.matmul(h_fft, x_fft.transpose((2, 1, 0)))  # (n_freq, n_out, n_blocks)
+        yb = np.fft.irfft(y_fft, n_fft, 0).transpose((1, 2, 0))  # (n_out, n_blocks, n_fft)
+        # add the blocks and their overlapping tails
+        seg = np.zeros((n_out, (n_blocks + 1) * block))
+        seg[:, :n_blocks * block] += yb[:, :, :block].reshape((n_out, -1))
+        tails = np.zeros((n_out, n_blocks, block))
+        tails[:, :, :n_fft - block] = yb[:, :, block:]
+        seg[:, block:] += tails.reshape((n_out, -1))
+        # copy the part of the segment that is in the output
+        a = max(i0, t0)
+        b = min(i0 + seg.shape[1], t1)
+        if a < b:
+            out_flat[:, a - start: b - start] += seg[:, a - i0: b - i0]
+    return out
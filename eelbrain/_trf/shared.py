@@ -1,13 +1,34 @@
 import numpy as np
 from numpy import newaxis
+from scipy.ndimage import convolve1d
 
 from .. import _info
 from .._data_obj import NDVar, UTS, dataobj_repr
+from .._utils.parallel import SharedArray
 
 
 class RevCorrData(object):
     """Restructure input NDVars into arrays for reverse correlation
-    
+
+    Parameters
+    ----------
+    y : NDVar
+        Dependent variable.
+    x : NDVar | sequence of NDVar
+        Predictors.
+    error : 'l1' | 'l2'
+        Error function (determines the scaling).
+    scale_data : bool | 'inplace'
+        Scale the data.
+    dtype : numpy dtype
+        Data type for ``y`` and ``x``; data of a different type are copied.
+    shared : bool
+        Keep the data in shared memory, so that worker processes can access
+        them through :meth:`SharedArray.from_array` without another copy.
+    share_y : RevCorrData
+        Reuse the (scaled) ``y`` data of another :class:`RevCorrData` object
+        that was created from the same ``y`` with the same parameters.
+
     Attributes
     ----------
     y : array  (n_y, n_times)
@@ -15,7 +36,8 @@ class RevCorrData(object):
     x : array  (n_x, n_times)
         Predictors.
     """
-    def __init__(self, y, x, error, scale_data):
+    def __init__(self, y, x, error, scale_data, dtype=np.float64, shared=False,
+                 share_y=None):
         # scale_data param
         if isinstance(scale_data, bool):
             scale_in_place = False
@@ -42,7 +64,10 @@ class RevCorrData(object):
             raise ValueError("Not all NDVars have the same time dimension")
 
         # y_data:  ydim x time array
-        if y.ndim == 1:
+        if share_y is not None:
+            ydims = share_y.ydims
+            y_data = share_y.y
+        elif y.ndim == 1:
             ydims = ()
             y_data = y.x[None, :]
         else:
@@ -74,41 +99,58 @@ class RevCorrData(object):
             x_meta.append((x_.name, xdim, index))
             n_x += len(data)
 
-        if len(x_data) == 1:
+        # copy the data unless they can be used (or scaled) in place
+        dtype = np.dtype(dtype)
+        in_place = scale_in_place or not scale_data
+        self._shared = []
+        if share_y is not None:
+            # keep the shared memory of y alive
+            self._shared.extend(share_y._shared)
+            y_is_copy = True
+        elif not in_place or y_data.dtype != dtype:
+            y_data = self._copy([y_data], dtype, shared)
+            y_is_copy = True
+        else:
+            y_is_copy = False
+        if len(x_data) == 1 and in_place and x_data[0].dtype == dtype:
             x_data = x_data[0]
             x_is_copy = False
         else:
-            x_data = np.vstack(x_data)
+            x_data = self._copy(x_data, dtype, shared)
             x_is_copy = True
 
         if scale_data:
-            if not scale_in_place:
-                y_data = y_data.copy()
-                if not x_is_copy:
-                    x_data = x_data.copy()
-                    x_is_copy = True
-
-            y_mean = y_data.mean(1)
-            x_mean = x_data.mean(1)
-            y_data -= y_mean[:, newaxis]
+            # statistics in double precision
+            if share_y is None:
+                y_mean = y_data.mean(1, dtype=np.float64)
+                y_data -= y_mean[:, newaxis]
+            x_mean = x_data.mean(1, dtype=np.float64)
             x_data -= x_mean[:, newaxis]
+            if share_y is not None:
+                y_mean = share_y.y_mean
+                y_scale = share_y.y_scale
+            elif error == 'l1':
+                y_scale = np.abs(y_data).mean(1, dtype=np.float64)
+            elif error == 'l2':
+                y_scale = y_data.std(1, dtype=np.float64)
+            else:
+                raise RuntimeError("error=%r" % (error,))
             if error == 'l1':
-                y_scale = np.abs(y_data).mean(1)
-                x_scale = np.abs(x_data).mean(1)
+                x_scale = np.abs(x_data).mean(1, dtype=np.float64)
             elif error == 'l2':
-                y_scale = y_data.std(1)
-                x_scale = x_data.std(1)
+                x_scale = x_data.std(1, dtype=np.float64)
             else:
                 raise RuntimeError("error=%r" % (error,))
-            y_data /= y_scale[:, newaxis]
+            if share_y is None:
+                y_data /= y_scale[:, newaxis]
             x_data /= x_scale[:, newaxis]
             # for data-check
             y_check = y_scale
             x_check = x_scale
         else:
             y_mean = x_mean = y_scale = x_scale = None
-            y_check = y_data.var(1)
-            x_check = x_data.var(1)
+            y_check = y_data.var(1, dtype=np.float64)
+            x_check = x_data.var(1, dtype=np.float64)
         # check for flat data
         zero_var = [y.name or 'y'] if np.any(y_check == 0) else []
         zero_var.extend(x_name[i] for i, v in enumerate(x_check) if v == 0)
@@ -119,6 +161,13 @@ class RevCorrData(object):
         has_nan.extend(x_name[i] for i, v in enumerate(x_check) if np.isnan(v))
         if has_nan:
             raise ValueError("Data with NaN: " + ', '.join(has_nan))
+        # data that were used in place still need to be copied to shared memory
+        if shared:
+            if not y_is_copy:
+                y_data = self._copy([y_data], dtype, shared)
+            if not x_is_copy:
+                x_data = self._copy([x_data], dtype, shared)
+                x_is_copy = True
 
         self.time = time_dim
         self._scale_data = bool(scale_data)
@@ -139,6 +188,21 @@ class RevCorrData(object):
         self._multiple_x = multiple_x
         self._x_is_copy = x_is_copy
 
+    def _copy(self, arrays, dtype, shared):
+        "Concatenate ``arrays`` into a new array of type ``dtype``"
+        shape = (sum(len(data) for data in arrays), arrays[0].shape[1])
+        if shared:
+            buffer = SharedArray(shape, dtype)
+            self._shared.append(buffer)
+            out = buffer.x
+        else:
+            out = np.empty(shape, dtype)
+        i = 0
+        for data in arrays:
+            out[i: i + len(data)] = data
+            i += len(data)
+        return out
+
     def data_scale_ndvars(self):
         if self._scale_data:
             # y
@@ -177,26 +241,73 @@ class RevCorrData(object):
         h : array  (n_y, n_x, n_times)
             Kernel data.
         """
-        h_time = UTS(tstart, self.time.tstep, h.shape[-1])
-        hs = []
-        for name, dim, index in self._x_meta:
-            x = h[:, index, :]
-            if dim is None:
-                dims = (h_time,)
-            else:
-                dims = (dim, h_time)
-            if self.ydims:
-                dims = self.ydims + dims
-                if len(self.ydims) > 1:
-                    x = x.reshape(self.yshape + x.shape[1:])
-            else:
-                x = x[0]
-            hs.append(NDVar(x, dims, self._y_info.copy(), name))
+        return package_kernel(h, tstart, self.time.tstep, self._x_meta,
+                              self.ydims, self._y_info, self._multiple_x)
 
-        if self._multiple_x:
-            return tuple(hs)
-        else:
-            return hs[0]
+    def sparse_kernel(self, h, tstart, window=None):
+        """Package kernel as :class:`SparseKernel`
+
+        Parameters
+        ----------
+        h : array  (n_y, n_x, n_times)
+            Kernel data (coefficients of the basis functions if ``window`` is
+            specified).
+        window : array
+            Basis function (centered on each coefficient).
+        """
+        return SparseKernel(h, tstart, self.time.tstep, self._x_meta,
+                            self.ydims, self._y_info, self._multiple_x, window)
+
+    def kernel_array(self, hs, tstart, trf_length):
+        """Convert kernels in the scale of the original data to an array
+
+        Parameters
+        ----------
+        hs : sequence of NDVar
+            Kernels, matched to the predictors by name (as
+            :attr:`BoostingResult.h_scaled`).
+        tstart : scalar
+            Time of the first sample of the array.
+        trf_length : int
+            Length of the array (in samples).
+
+        Returns
+        -------
+        h : array  (n_y, n_x, trf_length)
+            Kernel data in the scale of ``y`` and ``x``. Predictors without
+            kernel and lags that are not covered by the kernel are 0.
+        n : int
+            Number of predictors with kernel.
+        """
+        hs = {h.name: h for h in hs}
+        tstep = self.time.tstep
+        out = np.zeros((len(self.y), len(self.x), trf_length))
+        n = 0
+        for name, dim, index in self._x_meta:
+            if name not in hs:
+                continue
+            h = hs[name]
+            h_time = h.get_dim('time')
+            dims = self.ydims + ((h_time,) if dim is None else (dim, h_time))
+            if h.dims != dims:
+                raise ValueError("h=%r: dimensions do not match %s for "
+                                 "predictor %s" % (h, dims, name))
+            if abs(h_time.tstep - tstep) > tstep * 1e-6:
+                raise ValueError("h=%r: tstep %g does not match data (%g)"
+                                 % (h, h_time.tstep, tstep))
+            n += 1
+            # sample j of h is at lag i0 + j
+            i0 = int(round((h_time.tmin - tstart) / tstep))
+            j0 = max(0, -i0)
+            j1 = min(len(h_time), trf_length - i0)
+            if j1 <= j0:
+                continue
+            target = out[:, index, i0 + j0: i0 + j1]
+            target[:] = h.x[..., j0:j1].reshape(target.shape)
+        if self._scale_data:
+            out *= self.x_scale[:, newaxis]
+            out /= self.y_scale[:, newaxis, newaxis]
+        return out, n
 
     def package_statistic(self, stat, meas, name):
         if not self.ydims:
@@ -211,3 +322,80 @@ class RevCorrData(object):
         elif len(self.ydims) > 1:
             value = value.reshape(self.yshape)
         return NDVar(value, self.ydims, self._y_info.copy(), name)
+
+
+class SparseKernel(object):
+    """Kernel stored as its non-zero coefficients
+
+    Boosting kernels are sparse; :meth:`expand` restores the NDVar(s) of
+    :meth:`RevCorrData.package_kernel`. If more than half of the coefficients
+    are non-zero, they are stored densely.
+    """
+    def __init__(self, h, tstart, tstep, x_meta, ydims, y_info, multiple_x,
+                 window=None):
+        self.shape = h.shape
+        h = h.ravel()
+        index = np.flatnonzero(h)
+        if len(index) > h.size // 2:
+            self.index = None
+            self.values = h.copy()
+        else:
+            self.index = index.astype(np.int32 if h.size < 2 ** 31 else np.int64)
+            self.values = h[index]
+        self.tstart = tstart
+        self.tstep = tstep
+        self.x_meta = x_meta
+        self.ydims = ydims
+        self.y_info = y_info
+        self.multiple_x = multiple_x
+        self.window = window
+
+    @property
+    def nnz(self):
+        "Number of non-zero coefficients"
+        if self.index is None:
+            return np.count_nonzero(self.values)
+        return len(self.index)
+
+    def expand(self):
+        "Restore the kernel NDVar(s)"
+        if self.index is None:
+            h = self.values.reshape(self.shape)
+        else:
+            h = np.zeros(self.shape)
+            h.flat[self.index] = self.values
+        tstart = self.tstart
+        if self.window is not None:
+            # the basis functions at the first and last lags extend beyond the
+            # TRF window by half their length
+            n_pad = len(self.window) // 2
+            h = np.pad(h, [(0, 0)] * (h.ndim - 1) + [(n_pad, n_pad)], 'constant')
+            h = convolve1d(h, self.window, -1, mode='constant')
+            tstart -= n_pad * self.tstep
+        return package_kernel(h, tstart, self.tstep, self.x_meta, self.ydims,
+                              self.y_info, self.multiple_x)
+
+
+def package_kernel(h, tstart, tstep, x_meta, ydims, y_info, multiple_x):
+    "Package kernel array (n_y, n_x, n_times) as NDVar(s)"
+    h_time = UTS(tstart, tstep, h.shape[-1])
+    yshape = tuple(map(len, ydims))
+    hs = []
+    for name, dim, index in x_meta:
+        x = h[:, index, :]
+        if dim is None:
+            dims = (h_time,)
+        else:
+            dims = (dim, h_time)
+        if ydims:
+            dims = ydims + dims
+            if len(ydims) > 1:
+                x = x.reshape(yshape + x.shape[1:])
+        else:
+            x = x[0]
+        hs.append(NDVar(x, dims, y_info.copy(), name))
+
+    if multiple_x:
+        return tuple(hs)
+    else:
+        return hs[0]
@@ -1,4 +1,5 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+from copy import copy
 from math import floor
 import os
 
@@ -6,14 +7,24 @@ from nose.tools import eq_, assert_almost_equal, assert_is_none, assert_raises
 import numpy as np
 from numpy.testing import assert_array_equal, assert_allclose
 import pickle
+from scipy.ndimage import convolve1d
 import scipy.io
-from eelbrain import test, boosting, convolve, configure, datasets
+from eelbrain import (
+    Dataset, Datalist, test, boosting, boosting_batch, convolve, configure,
+    datasets,
+)
 from eelbrain._trf._boosting import boost_1seg, evaluate_kernel
+from eelbrain._trf.shared import RevCorrData
 from eelbrain._utils.testing import assert_dataobj_equal
 
 
 def assert_res_equal(res1, res):
-    assert_array_equal(res1.h, res.h)
+    if isinstance(res.h, tuple):
+        eq_(len(res1.h), len(res.h))
+        for h1, h in zip(res1.h, res.h):
+            assert_dataobj_equal(h1, h)
+    else:
+        assert_dataobj_equal(res1.h, res.h)
     eq_(res1.r, res.r)
     eq_(res1.spearmanr, res.spearmanr)
 
@@ -59,6 +70,60 @@ def run_boosting(ds):
 
     res = boosting(y, [x1, x2], 0, 1)
     eq_(round(res.r, 2), 0.98)
+    res = boosting(y, [x1, x2], 0, 1, incremental=True)
+    eq_(repr(res), '<boosting y ~ x1 + x2, 0 - 1, incremental=True>')
+    eq_(round(res.r, 2), 0.98)
+    assert_raises(ValueError, boosting, y, x2, 0, 1, error='l1', incremental=True)
+
+    # warm start
+    res_w = boosting(y, [x1, x2], 0, 1, init=res)
+    eq_(res_w.init, repr(res))
+    assert_almost_equal(res_w.r, res.r, 2)
+    assert (res_w.diagnostics['iterations'].sum() <
+            res.diagnostics['iterations'].sum())
+    assert_res_equal(boosting(y, [x1, x2], 0, 1, init=res.h_scaled), res_w)
+    res_x1 = boosting(y, x1, 0, 1)
+    res_w = boosting(y, [x1, x2], -0.1, 1, init=res_x1)
+    assert res_w.r > 0.95
+    assert_raises(ValueError, boosting, y, x2, 0, 1, init=res_x1)
+    assert_raises(NotImplementedError, boosting, y, x1, 0, 1, init=res_x1, basis=0.3)
+
+    # cross-validation partitions
+    res = boosting(y, x1, 0, 1, partitions=5, test=True)
+    eq_(repr(res), '<boosting y ~ x1, 0 - 1, partitions=5, test=True>')
+    assert 0 < res.r < 1
+    res_b = boosting(y, x1, 0, 1, partitions=[2, 4, 6, 8], test=True)
+    assert_res_equal(res_b, res)
+    assert_raises(ValueError, boosting, y, x1, 0, 1, partitions=2, test=True)
+    assert_raises(ValueError, boosting, y, x1, 0, 1, partitions=[20])
+
+    # basis functions
+    res = boosting(y, [x1, x2], 0, 1, basis=0.3)
+    eq_(repr(res), '<boosting y ~ x1 + x2, 0 - 1, basis=0.3>')
+    assert 0.9 < res.r < 1
+    res_inc = boosting(y, [x1, x2], 0, 1, basis=0.3, incremental=True)
+    assert_almost_equal(res_inc.r, res.r, 2)
+    res_p = pickle.loads(pickle.dumps(res, pickle.HIGHEST_PROTOCOL))
+    assert_res_equal(res_p, res)
+    assert_raises(ValueError, boosting, y, x1, 0, 1, basis=0.01)
+    # the kernel includes the full basis functions at the edges and reproduces
+    # the prediction from the basis function coefficients once all lags are
+    # in the data (before that, the expanded kernel also applies the part of
+    # the basis functions that precedes the data)
+    res = boosting(y, x1, 0, 1, basis=0.3, scale_data=False)
+    kernel = copy(res._h_sparse)
+    window = kernel.window
+    kernel.window = None
+    coefs = kernel.expand().x
+    n_pad = len(window) // 2
+    eq_(len(res.h.time), len(coefs) + 2 * n_pad)
+    assert_almost_equal(res.h.time.tmin, -n_pad * res.h.time.tstep)
+    x_conv = convolve1d(x1.x, window, mode='constant')
+    y_pred = np.zeros(len(x_conv))
+    for lag, coef in enumerate(coefs):
+        y_pred[lag:] += coef * x_conv[:len(x_conv) - lag]
+    i0 = len(coefs) - 1
+    assert_allclose(res.predict(x1).x[i0:], y_pred[i0:], atol=1e-10)
 
 
 def test_boosting():
@@ -70,6 +135,46 @@ def test_boosting():
     yield run_boosting, ds
     configure(n_workers=True)
     yield run_boosting, ds
+    configure(boosting_backend='thread')
+    yield run_boosting, ds
+    configure(boosting_backend='process')
+
+
+def test_boosting_batch():
+    "Test boosting_batch()"
+    ds = datasets._get_continuous()
+    y = ds['y']
+    x1 = ds['x1']
+    x2 = ds['x2']
+    jobs = [(y, x1), (y, [x1, x2]), (y, x2)]
+    for n_workers, backend in ((0, 'process'), (True, 'process'), (True, 'thread')):
+        configure(n_workers=n_workers, boosting_backend=backend)
+        results = dict(boosting_batch(jobs, 0, 1))
+        eq_(sorted(results), [0, 1, 2])
+        for i, (y_, x_) in enumerate(jobs):
+            assert_res_equal(results[i], boosting(y_, x_, 0, 1))
+    configure(boosting_backend='process')
+    # errors in the data of a job
+    assert_raises(ValueError, dict, boosting_batch([(y, x1), (y, x1 * 0)], 0, 1))
+
+    # jobs with the same y share the prepared y
+    for shared in (False, True):
+        data = RevCorrData(y, x1, 'l2', True, shared=shared)
+        data_2 = RevCorrData(y, x2, 'l2', True, shared=shared, share_y=data)
+        assert data_2.y is data.y
+        eq_(data_2.y_scale, data.y_scale)
+        assert_array_equal(data_2.x, RevCorrData(y, x2, 'l2', True).x)
+
+    # Dataset columns
+    ds_ = Dataset()
+    ds_['y'] = Datalist([y, y])
+    ds_['x1'] = Datalist([x1, x1])
+    ds_['x2'] = Datalist([x2, x2])
+    results = dict(boosting_batch([('y', 'x1'), ('y', ('x1', 'x2'))], 0, 1, ds=ds_))
+    eq_(sorted(results), [0, 1, 2, 3])
+    assert_res_equal(results[1], results[0])
+    assert_res_equal(results[3], boosting(y, [x1, x2], 0, 1))
+    eq_(repr(results[2]), '<boosting y ~ x1 + x2, 0 - 1>')
 
 
 def test_result():
@@ -90,6 +195,31 @@ def test_result():
     y2 *= res.y_scale
     y2 += y1.mean() - y2.mean()  # mean can't be reconstructed
     assert_dataobj_equal(y1, y2, decimal=12)
+    # diagnostics
+    eq_(res.diagnostics.shape, (1, 10))
+    assert np.all(res.diagnostics['iterations'] > res.diagnostics['best_iteration'])
+    assert np.all(res.diagnostics['stop'] < len(res.STOP_REASONS))
+    assert 'total' in str(res.timing_report())
+    res_p = pickle.loads(pickle.dumps(res, pickle.HIGHEST_PROTOCOL))
+    assert_array_equal(res_p.diagnostics, res.diagnostics)
+    # sparse storage
+    state = res.__getstate__()
+    eq_(state['h'].nnz, np.count_nonzero(res.h.x))
+    assert_dataobj_equal(state['h'].expand(), res.h)
+    # predict
+    y_pred = res.predict(ds['x1'])
+    y3 = convolve(res.h_scaled, ds['x1'] - res.x_mean) + res.y_mean
+    y3.name = 'y'
+    assert_dataobj_equal(y_pred, y3, decimal=12)
+    assert_raises(TypeError, res.predict, [ds['x1'], ds['x2']])
+    # single precision storage
+    configure(boosting_dtype='float32')
+    try:
+        res_32 = boosting(ds['y'], ds['x1'], 0, 1)
+    finally:
+        configure(boosting_dtype='float64')
+    assert_almost_equal(res_32.r, res.r, 2)
+    assert_raises(ValueError, configure, boosting_dtype='int32')
     # reconstriction
     res = boosting(x1, y, -1, 0)
     x1r = convolve(res.h_scaled, y[:9.1])
@@ -122,6 +252,10 @@ def test_boosting_func():
     assert_almost_equal(r, mat['crlt'][0, 0], 10)
     assert_almost_equal(rr, mat['crlt'][1, 0], 10)
     assert_allclose(test_sse_history, mat['Str_testE'][0])
+    # incremental engine
+    h_inc, test_sse_inc = boost_1seg(x, y, 10, 0.005, 40, 0, 0.01, 'l2', True, True)
+    assert_array_equal(h_inc, h)
+    assert_allclose(test_sse_inc, test_sse_history)
 
     # 2d-TRF
     path = os.path.join(os.path.dirname(__file__), 'test_boosting_2d.mat')
@@ -138,3 +272,6 @@ def test_boosting_func():
     assert_almost_equal(rr, mat['crlt'][1, 0])
     # svdboostV4pred multiplies error by number of predictors
     assert_allclose(test_sse_history, mat['Str_testE'][0] / 3)
+    h_inc, test_sse_inc = boost_1seg(x, y, 10, 0.005, 40, 0, 0.01, 'l2', True, True)
+    assert_array_equal(h_inc, h)
+    assert_allclose(test_sse_inc, test_sse_history)
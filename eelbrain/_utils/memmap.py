@@ -0,0 +1,126 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Out-of-core data in memory-mapped files
+
+The data of an :class:`NDVar` can be a :class:`numpy.memmap`. Operations along
+the case dimension that would otherwise load all data into memory (indexing
+cases, :meth:`NDVar.mean` over cases, :meth:`NDVar.aggregate`) use the
+functions in this module to process the data in chunks of cases.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+
+# maximum size of a chunk of cases (in bytes)
+CHUNK_SIZE = 2 ** 26
+# reductions that can be computed chunk by chunk
+CHUNKED_FUNCS = (np.mean, np.sum, np.max, np.min)
+
+
+def is_memmap(x):
+    return isinstance(x, np.memmap)
+
+
+def chunk_length(x):
+    "Number of cases of ``x`` per chunk"
+    case_size = x.itemsize * int(np.prod(x.shape[1:], dtype=np.int64))
+    return max(1, CHUNK_SIZE // max(case_size, 1))
+
+
+def scratch_memmap(shape, dtype, dirname=None):
+    """Memory-mapped array in a temporary file
+
+    On systems that allow it, the file is removed immediately, and the disk
+    space is released when the array is garbage-collected.
+    """
+    if not int(np.prod(shape, dtype=np.int64)):
+        return np.empty(shape, dtype)
+    fd, path = tempfile.mkstemp('.dat', 'eelbrain-', dirname)
+    os.close(fd)
+    x = np.memmap(path, dtype, 'w+', shape=shape)
+    try:
+        os.remove(path)
+    except OSError:  # Windows does not remove open files
+        pass
+    return x
+
+
+def _dirname(x):
+    filename = getattr(x, 'filename', None)
+    return None if filename is None else os.path.dirname(filename)
+
+
+def _case_index(index, n):
+    "Integer array for a case index"
+    index = np.asarray(index)
+    if index.dtype.kind == 'b':
+        return np.flatnonzero(index)
+    return np.arange(n)[index]
+
+
+def take_cases(x, index):
+    """``x[index]`` along the first axis, reading ``x`` chunk by chunk
+
+    Contiguous cases are returned as view; if the selection is larger than
+    :data:`CHUNK_SIZE`, it is copied to a temporary memory-mapped file.
+    """
+    index = _case_index(index, len(x))
+    if len(index) and np.all(np.diff(index) == 1):
+        return x[index[0]: index[-1] + 1]
+    n_chunk = chunk_length(x)
+    if len(index) <= n_chunk:
+        return np.asarray(x[index])
+    out = scratch_memmap((len(index),) + x.shape[1:], x.dtype, _dirname(x))
+    for i in range(0, len(index), n_chunk):
+        out[i: i + n_chunk] = x[index[i: i + n_chunk]]
+    return out
+
+
+def reduce_cases(x, func, index=None):
+    """Apply ``func`` over the cases of ``x``, reading ``x`` chunk by chunk
+
+    Parameters
+    ----------
+    x : array
+        Data with cases on the first axis.
+    func : callable
+        One of :data:`CHUNKED_FUNCS`.
+    index : array
+        Only use these cases (default all).
+
+    Returns
+    -------
+    out : None | array
+        ``func(x[index], axis=0)``, or ``None`` if ``func`` can't be computed
+        in chunks.
+    """
+    if func not in CHUNKED_FUNCS:
+        return None
+    index = np.arange(len(x)) if index is None else _case_index(index, len(x))
+    n = len(index)
+    if n == 0:
+        return None
+    n_chunk = chunk_length(x)
+    out_dtype = func(x[:1], axis=0).dtype
+    if func is np.mean or func is np.sum:
+        if out_dtype.kind in 'fc':
+            acc_dtype = np.result_type(out_dtype, np.float64)
+        else:
+            acc_dtype = out_dtype
+        out = np.zeros(x.shape[1:], acc_dtype)
+        for i in range(0, n, n_chunk):
+            out += take_cases(x, index[i: i + n_chunk]).sum(0, dtype=acc_dtype)
+        if func is np.mean:
+            out /= n
+    else:
+        out = None
+        for i in range(0, n, n_chunk):
+            part = func(take_cases(x, index[i: i + n_chunk]), axis=0)
+            if out is None:
+                out = part
+            elif func is np.max:
+                np.maximum(out, part, out)
+            else:
+                np.minimum(out, part, out)
+    return np.asarray(out.astype(out_dtype, copy=False))
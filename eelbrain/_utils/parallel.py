@@ -0,0 +1,505 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Session-wide pool of worker processes
+
+The pool is started the first time a multiprocessing enabled computation runs
+(see :func:`eelbrain.configure`) and persists until :func:`shutdown` is called,
+the number of workers is changed, or the Python session ends.
+
+Large data is handed to the workers through :class:`SharedArray` objects,
+arrays in named shared memory of which only the name is pickled. Each task
+pickles its job function once to a shared file; workers load it when they
+receive the first job of the task and keep it until the task is released.
+
+Functions that release the GIL can additionally use a pool of threads
+(:func:`get_thread_pool`), which is not used inside worker processes, or
+distribute jobs over threads that share their data with :func:`thread_map`.
+"""
+import atexit
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+from multiprocessing import Barrier, Lock, Pipe, Process, cpu_count
+import os
+import pickle
+from queue import Queue
+import signal
+import tempfile
+from threading import Event, Lock as ThreadLock, Thread
+import traceback
+
+import numpy as np
+
+from .._config import CONFIG
+
+
+# directory for named shared memory
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# process messages
+JOB_TERMINATE = None
+JOB_RELEASE = 'release'
+
+_POOL = None
+_THREAD_POOL = None
+# whether the current process is a worker process
+_IN_WORKER = False
+
+
+class SharedArray(object):
+    """Numpy array in named shared memory
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Array shape.
+    dtype : numpy dtype
+        Array data type.
+
+    Notes
+    -----
+    Pickling a :class:`SharedArray` only stores its name, shape and dtype;
+    unpickling in another process maps the same memory. The memory is freed
+    when the creating object is closed or garbage collected.
+
+    A :class:`SharedArray` can also refer to an existing memory-mapped array
+    (see :meth:`from_array`); other processes then map the same file
+    copy-on-write, i.e., changes are not written back to the file.
+    """
+    def __init__(self, shape, dtype=np.float64):
+        fd, path = tempfile.mkstemp('.dat', 'eelbrain-', SHM_DIR)
+        os.close(fd)
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.offset = 0
+        self.strides = None
+        self._owner = True
+        self.x = self._map('w+')
+
+    @classmethod
+    def from_array(cls, x, dtype=None, copy=True):
+        """Copy ``x`` to a new :class:`SharedArray`
+
+        Parameters
+        ----------
+        x : array
+            Data.
+        dtype : numpy dtype
+            Convert the data to ``dtype``.
+        copy : bool
+            If ``False`` and ``x`` is a view of a memory-mapped file (for
+            example, of another :class:`SharedArray`) with matching ``dtype``,
+            refer to that file instead of copying the data.
+        """
+        if not copy and (dtype is None or np.dtype(dtype) == x.dtype):
+            source = memmap_source(x)
+            if source is not None:
+                out = cls.__new__(cls)
+                out.path, out.offset = source
+                out.shape = x.shape
+                out.dtype = x.dtype
+                out.strides = x.strides
+                out._owner = False
+                out.x = x
+                return out
+        out = cls(x.shape, x.dtype if dtype is None else dtype)
+        out.x[...] = x
+        return out
+
+    def _map(self, mode):
+        if 0 in self.shape:
+            return np.empty(self.shape, self.dtype)
+        elif self.strides is None:
+            return np.memmap(self.path, self.dtype, mode, shape=self.shape)
+        # view of a file that belongs to someone else
+        span = sum((n - 1) * stride for n, stride in zip(self.shape, self.strides))
+        buffer = np.memmap(self.path, np.uint8, 'c', self.offset, (span + self.dtype.itemsize,))
+        return np.ndarray(self.shape, self.dtype, buffer, 0, self.strides)
+
+    def __getstate__(self):
+        return {'path': self.path, 'shape': self.shape, 'dtype': self.dtype.str,
+                'offset': self.offset, 'strides': self.strides}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.shape = state['shape']
+        self.dtype = np.dtype(state['dtype'])
+        self.offset = state.get('offset', 0)
+        self.strides = state.get('strides')
+        self._owner = False
+        self.x = self._map('r+')
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:  # interpreter shutdown
+            pass
+
+    def close(self):
+        "Release the memory (in the creating process: delete the shared memory)"
+        self.x = None
+        if self._owner:
+            self._owner = False
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def memmap_source(x):
+    """File and offset of the data of ``x`` if ``x`` is a view of a memory-map
+
+    Returns
+    -------
+    source : None | (str, int)
+        Path of the file and offset (in bytes) of ``x[0, ..., 0]``, or ``None``
+        if ``x`` is not a view of a memory-mapped file.
+    """
+    if not isinstance(x, np.memmap) or x.filename is None:
+        return None
+    elif any(stride < 0 for stride in x.strides):
+        return None
+    # np.memmap maps the file position ``offset`` to the start of the
+    # outermost array
+    root = x
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap):
+        return None
+    return x.filename, root.offset + (x.ctypes.data - root.ctypes.data)
+
+
+class WorkerError(RuntimeError):
+    "An error occurred in a worker process"
+
+
+class WorkerPool(object):
+    """Pool of worker processes
+
+    Parameters
+    ----------
+    n_workers : int
+        Number of worker processes.
+    nice : int
+        Scheduling priority for the worker processes.
+    """
+    def __init__(self, n_workers, nice=0):
+        logger = logging.getLogger(__name__)
+        logger.debug("Starting %i worker processes...", n_workers)
+        self.n_workers = n_workers
+        self.nice = nice
+        self._job_reader, self._job_writer = Pipe(False)
+        self._job_lock = Lock()
+        self._result_reader, self._result_writer = Pipe(False)
+        self._result_lock = Lock()
+        self._release_barrier = Barrier(n_workers)
+        # results are routed to the map call of their task, so that the pool
+        # can be used while another map call is suspended
+        self._tasks = {}  # {task: Queue}
+        self._tasks_lock = ThreadLock()
+        # feeder threads of concurrent map calls share the job pipe
+        self._send_lock = ThreadLock()
+        self._terminated = Event()
+        args = (self._job_reader, self._job_lock, self._result_writer,
+                self._result_lock, self._release_barrier, nice)
+        self._processes = [Process(target=pool_worker, args=args, daemon=True)
+                           for _ in range(n_workers)]
+        for process in self._processes:
+            process.start()
+        self._router = Thread(target=self._route_results, daemon=True)
+        self._router.start()
+
+    def is_alive(self):
+        return all(process.is_alive() for process in self._processes)
+
+    def map(self, func, jobs):
+        """Apply ``func`` to each job in the worker processes
+
+        Parameters
+        ----------
+        func : callable
+            Job function, called in a worker process as ``func(*job)``. Needs
+            to be picklable; it is pickled only once for all jobs.
+        jobs : iterable of tuple
+            Arguments for ``func``. Arrays can be reused by the iterator
+            (each job is pickled before the next one is requested).
+
+        Yields
+        ------
+        index : int
+            Index of the job in ``jobs``.
+        result
+            Return value of ``func(*job)``.
+
+        Notes
+        -----
+        Results are yielded in the order in which they are completed. If the
+        caller closes the iterator before it is exhausted, no new jobs are
+        started, and the results of jobs that were already sent to the workers
+        are discarded. If the iterator is abandoned because of an exception,
+        the pool is terminated.
+
+        The pool can be used by other map calls while the iterator is
+        suspended (for example, for processing its results); their jobs share
+        the workers.
+        """
+        fd, path = tempfile.mkstemp('.pickle', 'eelbrain-', SHM_DIR)
+        try:
+            with os.fdopen(fd, 'wb') as fid:
+                pickle.dump(func, fid, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            os.remove(path)
+            raise
+        results = Queue()
+        with self._tasks_lock:
+            self._tasks[path] = results
+        stop = Event()
+        thread = Thread(target=self._put_jobs, args=(path, jobs, stop), daemon=True)
+        thread.start()
+        complete = False
+        try:
+            n_jobs = None
+            n_done = 0
+            while n_jobs is None or n_done < n_jobs:
+                index, result, error = results.get()
+                if error:
+                    raise WorkerError(error)
+                elif index is None:
+                    n_jobs = result
+                else:
+                    n_done += 1
+                    yield index, result
+            complete = True
+        except GeneratorExit:
+            # stopped by the caller: wait for jobs that were already sent
+            stop.set()
+            while n_jobs is None or n_done < n_jobs:
+                index, result, error = results.get()
+                if error:
+                    break
+                elif index is None:
+                    n_jobs = result
+                else:
+                    n_done += 1
+            else:
+                complete = True
+            raise
+        finally:
+            stop.set()
+            with self._tasks_lock:
+                del self._tasks[path]
+            if self._terminated.is_set():  # by another map call
+                pass
+            elif complete:
+                with self._send_lock:
+                    for _ in range(self.n_workers):
+                        self._job_writer.send(JOB_RELEASE)
+            else:
+                self.terminate()
+            os.remove(path)
+
+    def n_tasks(self):
+        "Number of map calls that are in progress"
+        with self._tasks_lock:
+            return len(self._tasks)
+
+    def _route_results(self):
+        "Pass results on to the map call of their task (runs in a separate thread)"
+        while not self._terminated.is_set():
+            if not self._result_reader.poll(0.5):
+                continue
+            task, index, result, error = self._result_reader.recv()
+            self._put_result(task, index, result, error)
+
+    def _put_result(self, task, index, result, error):
+        with self._tasks_lock:
+            results = self._tasks.get(task)
+        if results is not None:  # task was not abandoned
+            results.put((index, result, error))
+
+    def _put_jobs(self, task, jobs, stop):
+        "Feed jobs into the job pipe (runs in a separate thread)"
+        n_jobs = 0
+        try:
+            for job in jobs:
+                if stop.is_set():
+                    break
+                try:
+                    with self._send_lock:
+                        self._job_writer.send((task, n_jobs, job))
+                except (OSError, ValueError):  # pool was terminated
+                    return
+                n_jobs += 1
+        except Exception:
+            self._put_result(task, None, None, traceback.format_exc())
+            return
+        self._put_result(task, None, n_jobs, None)
+
+    def close(self):
+        "Shut down the worker processes after they finish their current job"
+        for _ in self._processes:
+            self._job_writer.send(JOB_TERMINATE)
+        for process in self._processes:
+            process.join(10)
+        self.terminate()
+
+    def terminate(self):
+        "Terminate the worker processes immediately"
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            process.join()
+        self._job_writer.close()
+        self._job_reader.close()
+        # stop the router and all map calls that are still waiting for results
+        self._terminated.set()
+        self._router.join()
+        self._result_writer.close()
+        self._result_reader.close()
+        with self._tasks_lock:
+            for results in self._tasks.values():
+                results.put((None, None, "The worker pool was terminated"))
+        global _POOL
+        if _POOL is self:
+            _POOL = None
+
+
+def pool_worker(job_reader, job_lock, result_writer, result_lock, release_barrier, nice):
+    "Worker process loop"
+    global _IN_WORKER
+    _IN_WORKER = True
+    # worker processes can't start their own pool
+    CONFIG['n_workers'] = 0
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if nice:
+        os.nice(nice)
+    task = func = None
+    while True:
+        with job_lock:
+            job = job_reader.recv()
+        if job is JOB_TERMINATE:
+            return
+        elif job == JOB_RELEASE:
+            task = func = None
+            release_barrier.wait()
+            continue
+        job_task, index, args = job
+        try:
+            if job_task != task:
+                with open(job_task, 'rb') as fid:
+                    func = pickle.load(fid)
+                task = job_task
+            result = func(*args)
+        except Exception:
+            item = (job_task, index, None, traceback.format_exc())
+        else:
+            item = (job_task, index, result, None)
+        with result_lock:
+            result_writer.send(item)
+
+
+def get_pool():
+    """Retrieve the session-wide worker pool
+
+    The pool is (re-)started when it is not running yet, or when the
+    ``n_workers`` or ``nice`` settings changed.
+    """
+    global _POOL
+    if _POOL is not None:
+        if (_POOL.n_workers != CONFIG['n_workers'] or
+                _POOL.nice != CONFIG['nice'] or not _POOL.is_alive()):
+            shutdown()
+    if _POOL is None:
+        _POOL = WorkerPool(CONFIG['n_workers'], CONFIG['nice'])
+    return _POOL
+
+
+def parallel_map(func, jobs):
+    """Apply ``func`` to each job in the session-wide worker pool
+
+    See :meth:`WorkerPool.map`. If the ``persistent_pool`` option is disabled
+    (see :func:`eelbrain.configure`), the pool is shut down when all jobs are
+    done.
+    """
+    pool = get_pool()
+    yield from pool.map(func, jobs)
+    # other map calls can still be using the pool
+    if not CONFIG['persistent_pool'] and not pool.n_tasks():
+        shutdown()
+
+
+def thread_map(func, jobs, n_threads=None):
+    """Apply ``func`` to each job in threads of the current process
+
+    Same interface as :func:`parallel_map`, but ``func`` and the jobs are
+    shared with the threads instead of being pickled, so arrays are not
+    copied. Only useful for functions that spend most of their time with the
+    GIL released.
+
+    Parameters
+    ----------
+    func : callable
+        Job function, called as ``func(*job)``.
+    jobs : iterable of tuple
+        Arguments for ``func``.
+    n_threads : int
+        Number of threads (default ``CONFIG['n_workers']``).
+
+    Yields
+    ------
+    index : int
+        Index of the job in ``jobs``.
+    result
+        Return value of ``func(*job)``.
+    """
+    if n_threads is None:
+        n_threads = CONFIG['n_workers'] or 1
+    jobs = enumerate(jobs)
+    with ThreadPoolExecutor(n_threads) as executor:
+        # keep a limited number of jobs queued so that ``jobs`` can be lazy
+        pending = {}
+        for index, job in jobs:
+            pending[executor.submit(func, *job)] = index
+            if len(pending) >= 2 * n_threads:
+                break
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    yield index, future.result()
+                    for next_index, job in jobs:
+                        pending[executor.submit(func, *job)] = next_index
+                        break
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def thread_count():
+    "Number of threads for computations that release the GIL"
+    return 1 if _IN_WORKER else cpu_count()
+
+
+def get_thread_pool():
+    "Retrieve the session-wide thread pool (see :func:`thread_count`)"
+    global _THREAD_POOL
+    if _THREAD_POOL is None:
+        _THREAD_POOL = ThreadPoolExecutor(thread_count())
+    return _THREAD_POOL
+
+
+def shutdown():
+    """Shut down the pool of worker processes
+
+    The pool is started automatically the next time a multiprocessing enabled
+    computation is performed.
+    """
+    global _POOL
+    if _POOL is not None:
+        pool = _POOL
+        _POOL = None
+        pool.close()
+
+
+atexit.register(shutdown)
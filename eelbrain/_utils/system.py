@@ -1,11 +1,14 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
-from contextlib import ContextDecorator
+from contextlib import ContextDecorator, contextmanager
 import os
 import sys
 
 IS_OSX = sys.platform == 'darwin'
 IS_WINDOWS = os.name == 'nt'
 
+if not IS_WINDOWS:
+    import fcntl
+
 if IS_OSX:
     from . import macos as c
 else:
@@ -31,3 +34,21 @@ class ActivityContext(ContextDecorator):
 
 
 user_activity = ActivityContext(c.NSActivityUserInitiated, 'Eelbrain user activity')
+
+
+@contextmanager
+def file_lock(path):
+    """Lock shared by all processes that use the same lock-file ``path``
+
+    The lock-file is created if it does not exist. On Windows, the lock is
+    not implemented and this context does nothing.
+    """
+    with open(path, 'a') as fid:
+        if IS_WINDOWS:
+            yield
+            return
+        fcntl.flock(fid, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fid, fcntl.LOCK_UN)
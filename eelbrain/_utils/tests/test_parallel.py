@@ -0,0 +1,114 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+from functools import partial
+import os
+import pickle
+
+from nose.tools import assert_raises, eq_
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from eelbrain import configure, shutdown
+from eelbrain._utils import parallel
+from eelbrain._utils.parallel import SharedArray, WorkerError, parallel_map
+
+
+def scale_row(y, factor, i):
+    return y.x[i] * factor
+
+
+def test_shared_array():
+    "Test SharedArray"
+    x = np.random.normal(0, 1, (4, 5))
+    shared = SharedArray.from_array(x)
+    assert_array_equal(shared.x, x)
+    shared_2 = pickle.loads(pickle.dumps(shared))
+    assert_array_equal(shared_2.x, x)
+    shared_2.x[0] = 0
+    eq_(shared.x[0].sum(), 0)
+    # only the owner deletes the memory
+    shared_2.close()
+    assert os.path.exists(shared.path)
+    shared.close()
+    assert not os.path.exists(shared.path)
+
+    # refer to memory-mapped data instead of copying
+    shared = SharedArray.from_array(x)
+    view = SharedArray.from_array(shared.x[1:, 2:], copy=False)
+    eq_(view.path, shared.path)
+    view_2 = pickle.loads(pickle.dumps(view))
+    assert_array_equal(view_2.x, x[1:, 2:])
+    view_2.x[0] = 0  # copy-on-write
+    assert_array_equal(shared.x, x)
+    view_2.close()
+    view.close()
+    assert os.path.exists(shared.path)
+    shared.close()
+    # arrays in memory are copied
+    copy = SharedArray.from_array(x, copy=False)
+    assert copy.path is not None
+    assert_array_equal(copy.x, x)
+    copy.close()
+    assert not os.path.exists(copy.path)
+
+
+def test_worker_pool():
+    "Test the session-wide worker pool"
+    configure(n_workers=2)
+    x = np.random.normal(0, 1, (20, 5))
+    y = SharedArray.from_array(x)
+    func = partial(scale_row, y, 2)
+    jobs = ((i,) for i in range(len(x)))
+    out = np.empty_like(x)
+    for i, row in parallel_map(func, jobs):
+        out[i] = row
+    assert_array_equal(out, x * 2)
+    pool = parallel._POOL
+    assert pool.is_alive()
+
+    # pool persists
+    for i, row in parallel_map(func, [(1,)]):
+        assert_array_equal(row, x[1] * 2)
+    assert parallel._POOL is pool
+
+    # stopping early keeps the pool
+    results = parallel_map(func, ((i,) for i in range(len(x))))
+    next(results)
+    results.close()
+    assert parallel._POOL is pool
+    for i, row in parallel_map(func, [(2,)]):
+        assert_array_equal(row, x[2] * 2)
+
+    # using the pool while a map call is suspended
+    for i, row in parallel_map(func, ((i,) for i in range(4))):
+        assert_array_equal(row, x[i] * 2)
+        inner = dict(parallel_map(func, ((j,) for j in range(len(x)))))
+        assert_array_equal(inner[i + 10], x[i + 10] * 2)
+    assert parallel._POOL is pool
+
+    # errors in worker
+    with assert_raises(WorkerError):
+        for _ in parallel_map(func, [(100,)]):
+            pass
+    assert parallel._POOL is None
+
+    # changing n_workers restarts the pool
+    for _ in parallel_map(func, [(1,)]):
+        pass
+    configure(n_workers=1)
+    for _ in parallel_map(func, [(1,)]):
+        pass
+    eq_(parallel._POOL.n_workers, 1)
+
+    # non-persistent pool
+    configure(persistent_pool=False)
+    for _ in parallel_map(func, [(1,)]):
+        pass
+    assert parallel._POOL is None
+    configure(n_workers=True, persistent_pool=True)
+
+    # explicit shutdown
+    for _ in parallel_map(func, [(1,)]):
+        pass
+    shutdown()
+    assert parallel._POOL is None
+    y.close()
@@ -1,6 +1,7 @@
 """Some basic example datasets for testing."""
 from distutils.version import LooseVersion
 import os
+import shutil
 
 import mne
 from mne import minimum_norm as mn
@@ -9,6 +10,7 @@ import numpy as np
 from . import _info, load
 from ._data_obj import Dataset, Factor, Var, NDVar, Case, Scalar, Sensor, Space, UTS
 from ._design import permute
+from ._trf._convolve import convolve_kernels
 
 
 def _apply_kernel(x, h, out=None):
@@ -18,13 +20,8 @@ def _apply_kernel(x, h, out=None):
     h.shape is (n_stims, n_trf_samples)
     """
     if out is None:
-        out = np.zeros(x.shape[1])
-    else:
-        out.fill(0)
-
-    for ind in range(len(h)):
-        out += np.convolve(h[ind], x[ind])[:len(out)]
-
+        return convolve_kernels(h, x)
+    out[:] = convolve_kernels(h, x)
     return out
 
 
@@ -439,7 +436,8 @@ def get_uv(seed=0, nrm=False, vector=False):
     return ds
 
 
-def setup_samples_experiment(dst, n_subjects=3, n_segments=4, n_sessions=1):
+def setup_samples_experiment(dst, n_subjects=3, n_segments=4, n_sessions=1,
+                             mris=False):
     """Setup up file structure for the SampleExperiment class
 
     Parameters
@@ -453,6 +451,10 @@ def setup_samples_experiment(dst, n_subjects=3, n_segments=4, n_sessions=1):
         Number of data segments to include in each file.
     n_sessions : int
         Number of sessions.
+    mris : bool
+        Add MRIs for source localization: each subject gets an MRI scaled from
+        the ``sample`` MRI, which can be used as ``common_brain``, and the
+        ``sample`` head-MRI transformation (default False).
     """
     data_path = mne.datasets.sample.data_path()
     raw_path = os.path.join(data_path, 'MEG', 'sample', 'sample_audvis_raw.fif')
@@ -501,3 +503,26 @@ def setup_samples_experiment(dst, n_subjects=3, n_segments=4, n_sessions=1):
             raw_.load_data()
             raw_.pick_types('mag', stim=True, exclude=[])
             raw_.save(raw_file.format(subject=subject, session=session))
+
+    if not mris:
+        return
+    subjects_dir = os.path.join(data_path, 'subjects')
+    mri_sdir = os.path.join(root, 'mri')
+    sample_dir = os.path.join(mri_sdir, 'sample')
+    os.makedirs(sample_dir)
+    # files are only written to bem, the MRI volumes are not needed
+    for name in ('label', 'surf'):
+        os.symlink(os.path.join(subjects_dir, 'sample', name),
+                   os.path.join(sample_dir, name))
+    bem_dir = os.path.join(sample_dir, 'bem')
+    shutil.copytree(os.path.join(subjects_dir, 'sample', 'bem'), bem_dir)
+    # the inner skull surface of scaled MRIs is read from a separate file
+    surfs = mne.read_bem_surfaces(os.path.join(bem_dir, 'sample-5120-bem.fif'))
+    mne.write_bem_surfaces(os.path.join(bem_dir, 'sample-inner_skull-bem.fif'), surfs)
+    trans_path = os.path.join(data_path, 'MEG', 'sample', 'sample_audvis_raw-trans.fif')
+    for s_id in range(n_subjects):
+        subject = 'R%04i' % s_id
+        mne.coreg.scale_mri('sample', subject, 1., subjects_dir=mri_sdir,
+                            skip_fiducials=True)
+        shutil.copy(trans_path, os.path.join(meg_dir.format(subject=subject),
+                                             '%s-trans.fif' % subject))
@@ -286,6 +286,48 @@ def test_combine():
     assert_array_equal(dsc.info['b'][0], np.arange(2))
 
 
+def test_combine_memmap():
+    "Test combine() into memory-mapped NDVars"
+    from eelbrain import testnd
+    from eelbrain._utils import memmap
+
+    ds = datasets.get_uts(utsnd=True)
+    tempdir = tempfile.mkdtemp()
+    chunk_size = memmap.CHUNK_SIZE
+    try:
+        dsm = combine((ds[i: i + 10] for i in range(0, ds.n_cases, 10)),
+                      memmap=tempdir)
+        assert_dataset_equal(dsm, ds)
+        y = dsm['utsnd']
+        assert_is_instance(y.x, np.memmap)
+        assert_dataobj_equal(combine(iter((ds['utsnd'][:30], ds['utsnd'][30:])),
+                                     memmap=tempdir), ds['utsnd'])
+
+        # process data in chunks of 7 cases
+        memmap.CHUNK_SIZE = y.x[0].nbytes * 7
+        index = ds['B'] == 'b1'
+        assert_dataobj_equal(y[index], ds['utsnd'][index])
+        assert_dataobj_equal(y.sub(index, time=0.1), ds['utsnd'].sub(index, time=0.1))
+        assert_dataobj_equal(y[5:20], ds['utsnd'][5:20])
+        assert_dataobj_equal(y.mean('case'), ds['utsnd'].mean('case'), decimal=12)
+        assert_dataobj_equal(y.max(('case', 'time')), ds['utsnd'].max(('case', 'time')))
+        assert_almost_equal(y.mean(), ds['utsnd'].mean(), 12)
+        assert_dataobj_equal(y.aggregate(ds['A']), ds['utsnd'].aggregate(ds['A']), decimal=12)
+        # testnd with averaging
+        res = testnd.ttest_rel('utsnd', 'A', match='rm', ds=dsm, samples=0)
+        res_ref = testnd.ttest_rel('utsnd', 'A', match='rm', ds=ds, samples=0)
+        assert_dataobj_equal(res.t, res_ref.t, decimal=10)
+
+        # mismatching dimensions
+        y1 = ds['utsnd'].sub(sensor=['1', '2'])
+        assert_raises(DimensionMismatchError, combine, (ds['utsnd'], y1), memmap=tempdir)
+        assert_dataobj_equal(combine((y1, ds['utsnd']), memmap=tempdir),
+                             combine((y1, ds['utsnd'])))
+    finally:
+        memmap.CHUNK_SIZE = chunk_size
+        shutil.rmtree(tempdir)
+
+
 def test_datalist():
     "Test Datalist class"
     dl = Datalist(range(10))
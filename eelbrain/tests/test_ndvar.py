@@ -1,7 +1,7 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 from nose.tools import eq_
 import numpy as np
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_allclose
 from scipy import signal
 
 from eelbrain import (
@@ -55,6 +55,14 @@ def test_convolve():
                        np.convolve(h2.x[1], x1.x)[:100]))
     assert_array_equal(xc.x, xc_np)
 
+    # long kernel (FFT)
+    x = NDVar(np.random.normal(0, 1, (3, 1000)), (Scalar('xdim', [0, 1, 2]), UTS(0, 0.01, 1000)))
+    h = NDVar(np.random.normal(0, 1, (4, 3, 100)), (Case, x.dims[0], UTS(-0.2, 0.01, 100)))
+    xc = convolve(h, x)
+    eq_(xc.dims, (h.dims[0], x.time))
+    xc_np = [sum(np.convolve(h_ij, x_j)[20:1020] for h_ij, x_j in zip(h_i, x.x)) for h_i in h.x]
+    assert_allclose(xc.x, xc_np, atol=1e-10)
+
 
 def test_cross_correlation():
     ds = datasets._get_continuous()